@@ -0,0 +1,145 @@
+"""
+Import-time budgets for the command-line entry points.
+
+Each entry point is imported in a fresh interpreter with `python -X importtime`
+(best of --repeat runs). The check fails when the module's cumulative import
+time exceeds its budget, or when it pulls in a module it must not need at
+import time. For example, `create_report` must not load matplotlib (only
+needed without --skip-visualizations), `train_risk_model` must not load
+scikit-learn before its arguments are parsed, and `risk_scoring` must not
+load scikit-learn or joblib (scoring runs from the saved linear weights).
+
+The forbidden-module checks hold on any machine; the millisecond budgets
+are generous, so a failure means an import crept back to module level.
+
+Typical usage (from core/python):
+  python bench_imports.py
+  python bench_imports.py --repeat 5 --json ../../reports/bench_imports.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Iterable
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+CORE = ROOT_DIR / "core" / "python"
+RISK = ROOT_DIR / "package_risk" / "python"
+COMM = ROOT_DIR / "package_commercial" / "python"
+
+HEAVY = ("sklearn", "matplotlib", "seaborn", "plotly")
+
+# (module, directory, budget ms, modules it must not import)
+ENTRY_POINTS = [
+    ("run_sql", CORE, 600, ("pandas",) + HEAVY),
+    ("run_pipeline", CORE, 600, ("pandas", "numpy") + HEAVY),
+    ("create_report", CORE, 1500, HEAVY),
+    ("check_query_plans", CORE, 600, ("pandas",) + HEAVY),
+    ("bench_pipeline", CORE, 200, ("pandas", "sqlalchemy") + HEAVY),
+    ("load_data", CORE, 1500, HEAVY),
+    ("generate_data", CORE, 1500, HEAVY),
+    ("generate_test_data", CORE, 1500, HEAVY),
+    ("vintage_engine", CORE, 1500, HEAVY),
+    ("loan_state", CORE, 1500, HEAVY),
+    ("ingest_service", CORE, 1500, HEAVY),
+    ("bench_ingest", CORE, 1500, HEAVY),
+    ("dashboard_server", CORE, 1500, HEAVY),
+    ("portfolio_cube", CORE, 1500, HEAVY),
+    ("snapshot_history", CORE, 1500, HEAVY),
+    ("kpi_sample", CORE, 1500, HEAVY),
+    ("duckdb_marts", CORE, 1500, ("duckdb",) + HEAVY),
+    ("create_visualizations", CORE, 4000, ("sklearn",)),
+    ("train_risk_model", RISK, 200, ("pandas", "sqlalchemy") + HEAVY),
+    ("risk_scoring", RISK, 1500, ("joblib",) + HEAVY),
+    ("bench_risk_scoring", RISK, 1500, ("joblib",) + HEAVY),
+    ("risk_watchlist", RISK, 600, ("pandas",) + HEAVY),
+    ("migration_simulation", RISK, 1500, HEAVY),
+    ("commercial_engine", COMM, 1500, HEAVY),
+    ("scenario_engine", COMM, 1500, HEAVY),
+]
+
+
+def import_profile(module: str, cwd: Path) -> dict[str, int]:
+    """Cumulative import time (us) per module for `import module` in a fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    times: dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line.split("|")
+        try:
+            cumulative = int(parts[1])
+        except ValueError:  # header line
+            continue
+        times[parts[2].strip()] = cumulative
+    return times
+
+
+def check(module: str, cwd: Path, budget_ms: float, forbidden: Iterable[str], repeat: int) -> dict:
+    best, loaded = None, set()
+    for _ in range(repeat):
+        times = import_profile(module, cwd)
+        ms = times.get(module, 0) / 1000.0
+        best = ms if best is None else min(best, ms)
+        loaded |= set(times)
+    bad = sorted(f for f in forbidden if any(m == f or m.startswith(f + ".") for m in loaded))
+    return {
+        "module": module,
+        "import_ms": round(best, 1),
+        "budget_ms": budget_ms,
+        "forbidden_loaded": bad,
+        "ok": best <= budget_ms and not bad,
+    }
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Check import-time budgets of the entry points.")
+    parser.add_argument("--repeat", type=int, default=3, help="Imports per entry point; the fastest counts (default: 3)")
+    parser.add_argument("--only", action="append", help="Only check entry points whose name contains this text (repeatable)")
+    parser.add_argument("--json", dest="json_path", help="Also write results as JSON to this path")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    results = []
+    print(f"{'entry point':<24}{'import ms':>10}{'budget':>8}  status")
+    for module, cwd, budget, forbidden in ENTRY_POINTS:
+        if args.only and not any(o in module for o in args.only):
+            continue
+        try:
+            r = check(module, cwd, budget, forbidden, max(1, args.repeat))
+        except RuntimeError as e:
+            r = {"module": module, "import_ms": None, "budget_ms": budget, "forbidden_loaded": [], "ok": False,
+                 "error": str(e)}
+        results.append(r)
+        if "error" in r:
+            status = f"ERROR {r['error']}"
+        elif r["ok"]:
+            status = "ok"
+        else:
+            status = "FAIL" + (f" imports {', '.join(r['forbidden_loaded'])}" if r["forbidden_loaded"] else " over budget")
+        ms = "" if r["import_ms"] is None else f"{r['import_ms']:.0f}"
+        print(f"{module:<24}{ms:>10}{budget:>8}  {status}")
+
+    if args.json_path:
+        out = Path(args.json_path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Saved: {out}")
+    failed = [r["module"] for r in results if not r["ok"]]
+    if failed:
+        print(f"FAILED: {', '.join(failed)}")
+        return 1
+    print("OK: all entry points within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,172 @@
+"""
+Throughput / latency benchmark for ingest_service.py.
+
+Copies the SQLite database from DB_URL to a temporary file (the benchmark
+writes payments, so the real book is never touched). It then starts the
+service on a Unix socket and sends --events payment events from --clients
+concurrent keep-alive connections, --per-request events per POST. It
+reports events per second, p50 / p99 request latency, the batches written,
+and checks that every event reached fct_payments.
+
+Typical usage (from core/python):
+  python bench_ingest.py
+  python bench_ingest.py --events 200000 --clients 32 --per-request 50 --batch-size 5000
+  python bench_ingest.py --per-request 1 --max-latency-ms 5 --json ../../reports/bench_ingest.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+from sqlalchemy import make_url
+
+from db_engine import get_db_url, get_engine
+from ingest_service import BATCH_SIZE, MAX_LATENCY_MS, MAX_PENDING, QUEUE_TIMEOUT, serve
+
+
+def copy_database(db_url: str, target: Path) -> None:
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        raise SystemExit("bench_ingest.py copies a SQLite database file; set DB_URL='sqlite:///loan_demo.db'")
+    src = get_engine(db_url, read_only=True).raw_connection()
+    dst = sqlite3.connect(target)
+    try:
+        with dst:
+            src.driver_connection.backup(dst)  # consistent copy, including pages still in the WAL
+    finally:
+        src.close()
+        dst.close()
+
+
+def sample_events(db: Path, n: int, seed: int = 42) -> list[dict]:
+    con = sqlite3.connect(db)
+    day = con.execute("SELECT MAX(payment_date) FROM fct_payments").fetchone()[0]
+    loans = [r[0] for r in con.execute("SELECT loan_id FROM fct_loans WHERE origination_date <= ?", (day,))]
+    con.close()
+    if not loans:
+        raise SystemExit("No loans to send payments for. Load data first.")
+    rng = random.Random(seed)
+    return [{"loan_id": rng.choice(loans), "payment_date": day, "paid_amount": round(rng.uniform(50, 900), 2)}
+            for _ in range(n)]
+
+
+async def _client(path: str, requests: list[bytes], latencies: list[float], statuses: dict) -> None:
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        for body in requests:
+            t0 = time.perf_counter()
+            writer.write(b"POST /payments HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while (h := await reader.readline()) not in (b"\r\n", b""):
+                if h.lower().startswith(b"content-length:"):
+                    length = int(h.split(b":")[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - t0)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def _drive(path: str, events: list[dict], clients: int, per_request: int) -> tuple[float, list[float], dict]:
+    bodies = [json.dumps(events[i:i + per_request]).encode() for i in range(0, len(events), per_request)]
+    shares = [bodies[k::clients] for k in range(clients)]
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_client(path, s, latencies, statuses) for s in shares if s))
+    return time.perf_counter() - t0, latencies, statuses
+
+
+def _pct(values: list[float], q: float) -> float:
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))] * 1000.0 if s else 0.0
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the payment ingestion service on a copy of the database.")
+    parser.add_argument("--events", type=int, default=50_000, help="Payment events to send (default: 50000)")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent connections (default: 16)")
+    parser.add_argument("--per-request", type=int, default=20, help="Events per POST (default: 20)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"Service batch size (default: {BATCH_SIZE})")
+    parser.add_argument("--max-latency-ms", type=float, default=MAX_LATENCY_MS,
+                        help=f"Service batch latency (default: {MAX_LATENCY_MS})")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING, help=f"Service queue limit (default: {MAX_PENDING})")
+    parser.add_argument("--json", dest="json_path", help="Also write results as JSON to this path")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    with tempfile.TemporaryDirectory(prefix="bench_ingest_") as tmp:
+        db = Path(tmp) / "bench.db"
+        sock = os.path.join(tmp, "ingest.sock")
+        copy_database(get_db_url(), db)
+        events = sample_events(db, args.events)
+        engine = get_engine(f"sqlite:///{db.as_posix()}")
+        before = sqlite3.connect(db).execute("SELECT COUNT(*) FROM fct_payments").fetchone()[0]
+
+        ready, result = threading.Event(), {}
+        loop = asyncio.new_event_loop()
+        stop = None
+
+        def run_service() -> None:
+            nonlocal stop
+            asyncio.set_event_loop(loop)
+            stop = asyncio.Event()
+            result.update(loop.run_until_complete(serve(
+                engine, unix=sock, batch_size=args.batch_size, max_latency_ms=args.max_latency_ms,
+                max_pending=args.max_pending, queue_timeout=QUEUE_TIMEOUT, ready=ready, stop=stop)))
+
+        service = threading.Thread(target=run_service)
+        service.start()
+        ready.wait()
+        wall, latencies, statuses = asyncio.run(_drive(sock, events, args.clients, args.per_request))
+        loop.call_soon_threadsafe(stop.set)
+        service.join()
+        engine.dispose()
+        after = sqlite3.connect(db).execute("SELECT COUNT(*) FROM fct_payments").fetchone()[0]
+
+    accepted = sum(n for s, n in statuses.items() if s == 200) * args.per_request
+    out = {
+        "events": args.events,
+        "clients": args.clients,
+        "per_request": args.per_request,
+        "batch_size": args.batch_size,
+        "max_latency_ms": args.max_latency_ms,
+        "wall_s": round(wall, 3),
+        "events_per_s": round(args.events / wall, 1),
+        "p50_ms": round(_pct(latencies, 0.50), 2),
+        "p99_ms": round(_pct(latencies, 0.99), 2),
+        "statuses": statuses,
+        "batches": result.get("batches", 0),
+        "avg_batch": result.get("avg_batch", 0.0),
+        "avg_write_ms": result.get("avg_write_ms", 0.0),
+        "rows_written": after - before,
+    }
+    print(f"{out['events']:,} events, {args.clients} clients x {args.per_request}/request: "
+          f"{out['events_per_s']:,.0f} events/s, p50 {out['p50_ms']:.1f} ms, p99 {out['p99_ms']:.1f} ms")
+    print(f"  {out['batches']:,} batches (avg {out['avg_batch']:,} events, {out['avg_write_ms']} ms per commit), "
+          f"statuses {statuses}, rows written {out['rows_written']:,}")
+    if args.json_path:
+        path = Path(args.json_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(out, indent=2), encoding="utf-8")
+        print(f"Saved: {path}")
+    if out["rows_written"] != min(accepted, args.events):
+        print(f"MISMATCH: {accepted:,} events acknowledged, {out['rows_written']:,} rows written")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,353 @@
+"""
+Scaling benchmark for the pipeline across portfolio sizes.
+
+For each size a fresh portfolio is generated with generate_test_data.py
+(customers = 2/3 of loans, as in generate_data.py), loaded into its own
+SQLite database and taken through schema -> load -> marts -> risk features ->
+train -> report -> plans. Every stage runs in a fresh subprocess with METRICS_DIR set,
+so wall/CPU time, peak RSS, rows and DB round-trips come from that stage's
+instrumentation (see instrumentation.py) rather than from a process that has
+already grown. The mart and feature stages run with `run_sql.py --profile-views`,
+so each view is materialised once and timed on its own. The plans stage runs
+check_query_plans.py against core/sql/query_plan_baseline.json (SQLite and
+PostgreSQL only), so a query that gains a full scan or temp B-tree fails the run.
+
+Per stage (and per view) the scaling exponent between consecutive sizes is
+log(t2 / t1) / log(n2 / n1): ~1 is linear, noticeably above 1 is where a
+stage turns superlinear. Results go to JSON and are compared with a stored
+baseline (same sizes and stages); slower or fatter stages fail the run.
+
+Timings depend on the machine and on its load. The baseline records the host
+(CPU model and count, OS, Python) and, per entry, a calibration time: a fixed
+SQLite + Python workload timed before and after the run. A baseline from
+another host is not compared (a warning says so). On the same host, baseline
+times are scaled by the ratio of the calibration times before the tolerance
+applies. That absorbs a slower or busier machine, not a burst of other work
+in the middle of the run.
+
+The default ladder (1k / 2k / 5k loans) takes minutes. --full runs the
+10k / 100k / 1M ladder. Generation alone runs at ~80 loans/s, so that takes
+hours; use --timeout to stop once a stage gets too slow.
+
+Typical usage (from core/python):
+  python bench_pipeline.py --sizes 1000                        # quick check (~1 min)
+  python bench_pipeline.py                                     # 1k / 2k / 5k loans (~8 min), vs the baseline
+  python bench_pipeline.py --update-baseline                   # re-record reports/bench_pipeline_baseline.json
+  python bench_pipeline.py --full --timeout 3600               # 10k / 100k / 1M loans (hours)
+  python bench_pipeline.py --db-url postgresql://...           # reuse one server DB for every size
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable
+
+HERE = Path(__file__).resolve().parent
+ROOT_DIR = HERE.parents[1]
+CORE_SQL = ROOT_DIR / "core" / "sql"
+RISK_DIR = ROOT_DIR / "package_risk"
+DEFAULT_RESULTS_PATH = ROOT_DIR / "reports" / "bench_pipeline.json"
+DEFAULT_BASELINE_PATH = ROOT_DIR / "reports" / "bench_pipeline_baseline.json"
+
+# generate_test_data.py makes ~80 loans/s, so the default ladder finishes in minutes and --full takes hours
+DEFAULT_SIZES = [1_000, 2_000, 5_000]
+FULL_SIZES = [10_000, 100_000, 1_000_000]
+CALIBRATION_ROWS = 200_000
+SUPERLINEAR = 1.2      # scaling exponent flagged in the summary
+MIN_SCALING_S = 0.5    # shorter timings are too noisy for an exponent
+MIN_REGRESSION_S = 1.0
+MIN_REGRESSION_MB = 50.0
+
+
+def stage_commands(loans: int, work: Path) -> list[tuple[str, list[str]]]:
+    """(stage, argv) in run order; paths are relative to the run dir for the ../data/raw scripts."""
+    py = sys.executable
+    return [
+        ("generate", [py, str(HERE / "generate_test_data.py"), "--loans", str(loans),
+                      "--customers", str(max(1, loans * 2 // 3)), "--output-dir", "../data/raw"]),
+        ("schema", [py, str(HERE / "run_sql.py"), str(CORE_SQL / "01_schema.sql"), "--top", "0"]),
+        ("load", [py, str(HERE / "load_data.py")]),
+        ("marts", [py, str(HERE / "run_sql.py"), str(CORE_SQL / "03_mart_views.sql"),
+                   str(CORE_SQL / "03_mart_views_plus_balance.sql"), "--profile-views", "--top", "0",
+                   "--report", str(work / "marts_sql.json")]),
+        ("features", [py, str(HERE / "run_sql.py"), str(RISK_DIR / "sql" / "10_risk_features.sql"),
+                      "--profile-views", "--top", "0", "--report", str(work / "features_sql.json")]),
+        ("train", [py, str(RISK_DIR / "python" / "train_risk_model.py"), "--model-path", str(work / "model.joblib")]),
+        ("report", [py, str(HERE / "create_report.py"), "--skip-visualizations", "--output", str(work / "report.html")]),
+        # the bench does not build the commercial marts; queries on them are skipped
+        ("plans", [py, str(HERE / "check_query_plans.py"), "--no-propose", "--skip-missing",
+                   "--report", str(work / "query_plans.json")]),
+    ]
+
+
+STAGES = [name for name, _ in stage_commands(1, Path("."))]
+PLAN_DIALECTS = ("sqlite", "postgresql")  # what check_query_plans.py supports
+
+
+def _stage_metrics(metrics_dir: Path) -> dict:
+    """Top-level step of the single instrumentation JSON a stage script wrote, plus summed step rows."""
+    files = sorted(metrics_dir.glob("*.json"))
+    if not files:
+        return {}
+    steps = json.loads(files[-1].read_text(encoding="utf-8"))
+    top = steps[0]
+    children = [s for s in steps if s["step"].count("/") == 1]
+    rows = sum(s["rows"] or 0 for s in children) if any(s["rows"] is not None for s in children) else top["rows"]
+    return {
+        "stage_s": top["wall_s"],
+        "cpu_s": top["cpu_s"],
+        "peak_rss_mb": top["peak_rss_mb"],
+        "rows": rows,
+        "db_calls": top["db_calls"],
+    }
+
+
+def _view_timings(report: Path) -> dict[str, float]:
+    if not report.exists():
+        return {}
+    return {r["target"]: r["seconds"] for r in json.loads(report.read_text(encoding="utf-8")) if r["kind"] == "VIEW SCAN"}
+
+
+def run_size(loans: int, work: Path, db_url: str | None, stages: list[str], timeout: float | None) -> list[dict]:
+    """Run the selected stages for one portfolio size; stops at the first failing stage."""
+    run_dir = work / "run"
+    run_dir.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ)
+    env.pop("PROFILE", None)
+    env["DB_URL"] = db_url or f"sqlite:///{(work / 'bench.db').as_posix()}"
+    env["MPLBACKEND"] = "Agg"
+
+    results = []
+    for stage, cmd in stage_commands(loans, work):
+        if stage not in stages:
+            continue
+        if stage == "plans" and env["DB_URL"].split(":", 1)[0].split("+", 1)[0] not in PLAN_DIALECTS:
+            continue
+        metrics_dir = work / "metrics" / stage
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        env["METRICS_DIR"] = str(metrics_dir)
+        print(f"  [{loans:,}] {stage} ...", end="", flush=True)
+        t0 = time.perf_counter()
+        try:
+            proc = subprocess.run(cmd, cwd=run_dir, env=env, capture_output=True, text=True, timeout=timeout)
+            status = "ok" if proc.returncode == 0 else f"exit {proc.returncode}"
+            log = proc.stdout + proc.stderr
+        except subprocess.TimeoutExpired as e:
+            status = "timeout"
+            log = (e.stdout or b"").decode(errors="replace") if isinstance(e.stdout, bytes) else (e.stdout or "")
+        wall = time.perf_counter() - t0
+        (work / f"{stage}.log").write_text(log, encoding="utf-8")
+
+        rec = {"loans": loans, "stage": stage, "status": status, "wall_s": round(wall, 3), **_stage_metrics(metrics_dir)}
+        rec["loans_per_s"] = round(loans / wall, 1) if wall > 0 else None
+        if rec.get("rows") and rec.get("stage_s"):
+            rec["rows_per_s"] = round(rec["rows"] / rec["stage_s"], 1)
+        if stage in ("marts", "features"):
+            rec["views"] = _view_timings(work / f"{stage}_sql.json")
+        results.append(rec)
+        print(f" {status} {wall:.1f}s" + (f", peak {rec['peak_rss_mb']:.0f} MB" if rec.get("peak_rss_mb") else ""))
+        if status != "ok":
+            for line in log.strip().splitlines()[-5:]:
+                print(f"    {line}")
+            print(f"    see {work / f'{stage}.log'}")
+            break
+    return results
+
+
+def host_info() -> dict:
+    """What the timings depend on besides the code; baselines from another host are not compared."""
+    cpu = platform.processor()
+    try:
+        for line in Path("/proc/cpuinfo").read_text(encoding="utf-8").splitlines():
+            if line.startswith("model name"):
+                cpu = line.split(":", 1)[1].strip()
+                break
+    except OSError:
+        pass
+    return {"system": platform.system(), "machine": platform.machine(), "cpu": cpu, "cpus": os.cpu_count(),
+            "python": ".".join(platform.python_version_tuple()[:2])}
+
+
+def calibrate(repeat: int = 3) -> float:
+    """Seconds for a fixed SQLite insert + GROUP BY workload, best of `repeat`."""
+    import sqlite3
+
+    best = math.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        con = sqlite3.connect(":memory:")
+        con.execute("CREATE TABLE t (k INTEGER, v REAL)")
+        con.executemany("INSERT INTO t VALUES (?, ?)", ((i % 997, i * 0.5) for i in range(CALIBRATION_ROWS)))
+        con.execute("SELECT k, SUM(v), COUNT(*) FROM t GROUP BY k ORDER BY 2").fetchall()
+        con.close()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def load_baseline(path: Path) -> dict:
+    """{"host", "stages"}; a file without a host (older format) holds only the stages."""
+    stored = json.loads(path.read_text(encoding="utf-8"))
+    if "stages" not in stored:
+        return {"host": None, "stages": stored}
+    return stored
+
+
+def scaling(results: list[dict]) -> list[dict]:
+    """Scaling exponents per stage and per profiled view between consecutive sizes."""
+    series: dict[str, list[tuple[int, float]]] = {}
+    for r in results:
+        if r["status"] != "ok":
+            continue
+        series.setdefault(r["stage"], []).append((r["loans"], r.get("stage_s", r["wall_s"])))
+        for view, s in r.get("views", {}).items():
+            series.setdefault(f"{r['stage']}:{view}", []).append((r["loans"], s))
+    out = []
+    for name, pts in series.items():
+        pts.sort()
+        for (n1, t1), (n2, t2) in zip(pts, pts[1:]):
+            if t1 >= MIN_SCALING_S and t2 > 0 and n2 > n1:
+                out.append({"name": name, "from": n1, "to": n2, "exponent": round(math.log(t2 / t1) / math.log(n2 / n1), 2)})
+    return out
+
+
+def compare(results: list[dict], baseline: dict[str, dict], tolerance: float, calibration_s: float | None = None) -> list[str]:
+    """
+    Stages slower or with a higher peak RSS than the baseline beyond `tolerance`.
+    Baseline times are scaled by calibration_s / the entry's calibration_s when both are known.
+    """
+    regressions = []
+    for r in results:
+        key = f"{r['loans']}/{r['stage']}"
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if r["status"] != "ok":
+            regressions.append(f"{key}: {r['status']}")
+            continue
+        t, bt = r.get("stage_s", r["wall_s"]), base["stage_s"]
+        if calibration_s and base.get("calibration_s"):
+            bt *= calibration_s / base["calibration_s"]
+        if t > bt * (1 + tolerance) and t - bt > MIN_REGRESSION_S:
+            regressions.append(f"{key}: {t:.2f}s vs {bt:.2f}s")
+        m, bm = r.get("peak_rss_mb"), base.get("peak_rss_mb")
+        if m and bm and m > bm * (1 + tolerance) and m - bm > MIN_REGRESSION_MB:
+            regressions.append(f"{key}: peak {m:.0f} MB vs {bm:.0f} MB")
+    return regressions
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline across portfolio sizes.")
+    ladder = parser.add_mutually_exclusive_group()
+    ladder.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Loan counts (default: 1k 2k 5k)")
+    ladder.add_argument("--full", action="store_true", help="Run the 10k / 100k / 1M ladder (hours; see --timeout)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run (default: all)")
+    parser.add_argument("--db-url", help="Benchmark against this database instead of a fresh SQLite file per size")
+    parser.add_argument("--work-dir", help="Where portfolios, databases and logs go (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep the work dir")
+    parser.add_argument("--timeout", type=float, default=None, help="Per-stage timeout in seconds; larger sizes are skipped after it")
+    parser.add_argument("--json", dest="json_path", default=str(DEFAULT_RESULTS_PATH), help=f"Results JSON (default: {DEFAULT_RESULTS_PATH})")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE_PATH), help=f"Baseline JSON (default: {DEFAULT_BASELINE_PATH})")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown / memory growth vs baseline (default: 0.25)")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    sizes = FULL_SIZES if args.full else args.sizes
+    work_root = Path(args.work_dir).expanduser().resolve() if args.work_dir else Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    results: list[dict] = []
+    host = host_info()
+    calibration = [calibrate()]
+    try:
+        for loans in sorted(sizes):
+            work = work_root / f"loans_{loans}"
+            shutil.rmtree(work, ignore_errors=True)
+            work.mkdir(parents=True)
+            print(f"Portfolio: {loans:,} loans")
+            res = run_size(loans, work, args.db_url, args.stages, args.timeout)
+            results.extend(res)
+            if any(r["status"] != "ok" for r in res):
+                print("Stopping: a stage failed, larger sizes would too.")
+                break
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_root, ignore_errors=True)
+        elif results:
+            print(f"Work dir: {work_root}")
+    calibration.append(calibrate())
+    calibration_s = round(sum(calibration) / len(calibration), 4)
+    print(f"Calibration: {calibration_s:.3f}s (before {calibration[0]:.3f}s, after {calibration[1]:.3f}s)")
+
+    print(f"\n{'loans':>10} {'stage':<10} {'wall s':>9} {'stage s':>9} {'peak MB':>9} {'loans/s':>10} {'db':>7}")
+    for r in results:
+        stage_s = f"{r['stage_s']:.2f}" if r.get("stage_s") is not None else ""
+        rss = f"{r['peak_rss_mb']:.0f}" if r.get("peak_rss_mb") is not None else ""
+        print(f"{r['loans']:>10,} {r['stage']:<10} {r['wall_s']:>9.2f} {stage_s:>9} {rss:>9} "
+              f"{r['loans_per_s'] or 0:>10,.0f} {r.get('db_calls', ''):>7}")
+
+    exps = scaling(results)
+    steep = sorted((e for e in exps if e["exponent"] >= SUPERLINEAR), key=lambda e: -e["exponent"])
+    if steep:
+        print("\nSuperlinear (time ~ loans^k):")
+        for e in steep:
+            print(f"  k={e['exponent']:.2f}  {e['name']}  {e['from']:,} -> {e['to']:,} loans")
+
+    out = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "db": (args.db_url or "sqlite").split(":", 1)[0],
+            "run_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": host,
+            "calibration_s": calibration_s,
+        },
+        "results": results,
+        "scaling": exps,
+    }
+    json_path = Path(args.json_path).expanduser().resolve()
+    json_path.parent.mkdir(parents=True, exist_ok=True)
+    json_path.write_text(json.dumps(out, indent=2), encoding="utf-8")
+    print(f"Saved: {json_path}")
+
+    baseline_path = Path(args.baseline).expanduser().resolve()
+    current = {f"{r['loans']}/{r['stage']}": {"stage_s": r.get("stage_s", r["wall_s"]), "peak_rss_mb": r.get("peak_rss_mb"),
+                                              "calibration_s": calibration_s}
+               for r in results if r["status"] == "ok"}
+    ok = 0 if all(r["status"] == "ok" for r in results) else 1
+    if args.update_baseline:
+        stored = load_baseline(baseline_path) if baseline_path.exists() else {"host": host, "stages": {}}
+        stages = stored["stages"] if stored["host"] == host else {}  # entries from another host are dropped
+        stages.update(current)
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps({"host": host, "stages": stages}, indent=2, sort_keys=True) + "\n",
+                                 encoding="utf-8")
+        print(f"Saved baseline: {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --update-baseline to create one.")
+        return ok
+    baseline = load_baseline(baseline_path)
+    if baseline["host"] != host:
+        print(f"WARNING: the baseline was recorded on {baseline['host'] or 'an unrecorded host'}, this is {host}; "
+              f"timings not compared. Re-record it here with --update-baseline.")
+        return ok
+    regressions = compare(results, baseline["stages"], args.tolerance, calibration_s)
+    for r in regressions:
+        print(f"  REGRESSION {r}")
+    if regressions:
+        print(f"FAILED: {len(regressions)} regression(s)")
+        return 1
+    print("OK: no regressions against the baseline")
+    return ok
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
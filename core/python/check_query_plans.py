@@ -0,0 +1,346 @@
+"""
+Query-plan regression check for the mart views and report queries.
+
+Collects:
+- every view created in 03_mart_views*.sql, package_risk/sql/10_risk_features.sql
+  and package_commercial/sql/20_commercial_marts.sql (as SELECT * FROM view)
+- the SQL strings in create_report.py and create_visualizations.py
+  (f-strings are rendered with QUERY_CONTEXT)
+
+and records how each one executes:
+- SQLite: EXPLAIN QUERY PLAN, flagging full scans (SCAN without an index),
+  temp B-trees (USE TEMP B-TREE ...) and automatic indexes (SQLite building a
+  transient index because none exists). Index proposals come from the sqlite3
+  shell's .expert mode (when the sqlite3 binary is on PATH) and from index scans
+  that still read the base table (a covering variant is proposed).
+- PostgreSQL: EXPLAIN (ANALYZE, FORMAT JSON), flagging Seq Scans and sorts
+  that spill to disk, plus execution time.
+
+Flags are compared with a stored baseline (core/sql/query_plan_baseline.json);
+any query that gains a flag fails the run (exit code 1). bench_pipeline.py runs
+this check as its "plans" stage, so a plan regression fails the benchmark too.
+
+Typical usage (from core/python):
+  python check_query_plans.py                    # compare with baseline
+  python check_query_plans.py --update-baseline  # accept current plans
+  python check_query_plans.py --report ../../reports/query_plans.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import json
+import re
+import shutil
+import subprocess
+from collections import Counter
+from pathlib import Path
+from typing import Iterable
+
+from sqlalchemy import text
+
+from db_engine import get_engine
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_BASELINE_PATH = ROOT_DIR / "core" / "sql" / "query_plan_baseline.json"
+
+VIEW_SQL_FILES = [
+    ROOT_DIR / "core" / "sql" / "03_mart_views.sql",
+    ROOT_DIR / "core" / "sql" / "03_mart_views_plus_balance.sql",
+    ROOT_DIR / "package_risk" / "sql" / "10_risk_features.sql",
+    ROOT_DIR / "package_commercial" / "sql" / "20_commercial_marts.sql",
+]
+QUERY_MODULES = [
+    ROOT_DIR / "core" / "python" / "create_report.py",
+    ROOT_DIR / "core" / "python" / "create_visualizations.py",
+]
+# Values for the f-string placeholders in QUERY_MODULES (the v2 snapshot path)
+QUERY_CONTEXT = {"snapshot_view": "mart_portfolio_snapshot_v2", "has_eop": True}
+
+# errors meaning a query's table or view is not built in this database (--skip-missing)
+_MISSING_RE = re.compile(r"no such table|no such view|relation .* does not exist", re.IGNORECASE)
+_VIEW_RE = re.compile(r"CREATE\s+VIEW\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+_PARAM_RE = re.compile(r"(?<!:):([A-Za-z_]\w*)")
+_SQL_START_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_AUTO_INDEX_RE = re.compile(r"SEARCH (\S+) USING AUTOMATIC (?:COVERING |PARTIAL )*INDEX \(([^)]*)\)")
+_INDEX_SCAN_RE = re.compile(r"^(?:SCAN|SEARCH) (\w+) USING INDEX (\w+)")
+
+
+# -- query collection ------------------------------------------------------
+
+def view_queries(files: Iterable[Path] = VIEW_SQL_FILES) -> dict[str, str]:
+    out = {}
+    for f in files:
+        for name in _VIEW_RE.findall(f.read_text(encoding="utf-8")):
+            out[f"view:{name}"] = f"SELECT * FROM {name}"
+    return out
+
+
+def _render(node: ast.AST, context: dict) -> str | None:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for v in node.values:
+            if isinstance(v, ast.Constant):
+                parts.append(str(v.value))
+            else:
+                expr = ast.Expression(body=v.value)
+                try:
+                    parts.append(str(eval(compile(expr, "<query>", "eval"), {}, dict(context))))
+                except Exception:
+                    return None
+        return "".join(parts)
+    return None
+
+
+def module_queries(paths: Iterable[Path] = QUERY_MODULES, context: dict = QUERY_CONTEXT) -> dict[str, str]:
+    """SQL string literals (SELECT/WITH ...) per function, keyed module:function:variable."""
+    out = {}
+    for path in paths:
+        tree = ast.parse(path.read_text(encoding="utf-8"))
+        for func in [n for n in ast.walk(tree) if isinstance(n, ast.FunctionDef)]:
+            for node in ast.walk(func):
+                target, value = None, None
+                if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                    target, value = node.targets[0].id, node.value
+                elif isinstance(node, ast.Call) and node.args:
+                    target, value = "inline", node.args[0]
+                if value is None:
+                    continue
+                sql = _render(value, context)
+                if sql and _SQL_START_RE.match(sql):
+                    key = f"{path.stem}:{func.name}:{target}"
+                    n = 2
+                    while key in out and out[key] != sql:
+                        key = f"{path.stem}:{func.name}:{target}#{n}"
+                        n += 1
+                    out[key] = sql.strip().rstrip(";")
+    return out
+
+
+def collect_queries() -> dict[str, str]:
+    return {**view_queries(), **module_queries()}
+
+
+# -- plans -----------------------------------------------------------------
+
+def _normalise(detail: str) -> str:
+    return re.sub(r"\(subquery-\d+\)", "(subquery)", detail)
+
+
+def sqlite_plan(conn, sql: str) -> dict:
+    params = {p: None for p in _PARAM_RE.findall(sql)}
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).fetchall()
+    lines = [_normalise(r[3]) for r in rows]
+    flags = []
+    for line in lines:
+        if line.startswith("SCAN ") and "INDEX" not in line and line != "SCAN CONSTANT ROW":
+            flags.append(line)
+        elif line.startswith("USE TEMP B-TREE") or "AUTOMATIC" in line:
+            flags.append(line)
+    return {"plan": lines, "flags": flags}
+
+
+def postgres_plan(conn, sql: str) -> dict:
+    params = {p: None for p in _PARAM_RE.findall(sql)}
+    doc = conn.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"), params).scalar()
+    doc = json.loads(doc) if isinstance(doc, str) else doc
+    root = doc[0]
+    lines, flags = [], []
+
+    def walk(node):
+        label = node["Node Type"] + (f" on {node['Relation Name']}" if "Relation Name" in node else "")
+        lines.append(label)
+        if node["Node Type"] == "Seq Scan":
+            flags.append(label)
+        if node.get("Sort Space Type") == "Disk":
+            flags.append(f"{label} (disk)")
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(root["Plan"])
+    return {"plan": lines, "flags": flags, "execution_ms": root.get("Execution Time")}
+
+
+def expert_indexes(db_path: str, sql: str) -> list[str]:
+    """CREATE INDEX proposals from the sqlite3 shell's .expert mode ([] when unavailable)."""
+    exe = shutil.which("sqlite3")
+    if not exe or not db_path:
+        return []
+    sql = _PARAM_RE.sub("NULL", sql)
+    try:
+        res = subprocess.run(
+            [exe, db_path], input=f".expert\n{sql};\n", capture_output=True, text=True, timeout=60
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    return [l.strip() for l in res.stdout.splitlines() if l.strip().upper().startswith("CREATE INDEX")]
+
+
+def auto_index_hints(flags: list[str]) -> list[str]:
+    """alias(columns) for each transient index SQLite builds (usually a CTE or view joined on these columns)."""
+    hints = []
+    for f in flags:
+        m = _AUTO_INDEX_RE.search(f)
+        if m:
+            cols = [c.split("=")[0].strip() for c in m.group(2).split(" AND ")]
+            hint = f"{m.group(1)}({', '.join(cols)})"
+            if hint not in hints:
+                hints.append(hint)
+    return hints
+
+
+def _expanded_sql(conn, sql: str) -> str:
+    """The query plus the definitions of every view it reaches."""
+    views = dict(conn.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'view'")).fetchall())
+    text_, seen = sql, set()
+    while True:
+        new = [v for v in views if v not in seen and re.search(rf"\b{v}\b", text_)]
+        if not new:
+            return text_
+        seen.update(new)
+        text_ += "\n" + "\n".join(views[v] for v in new)
+
+
+def covering_index_proposals(conn, sql: str, plan: list[str]) -> list[str]:
+    """
+    For base-table index scans that still read the table (USING INDEX, not
+    COVERING INDEX), propose an index extended with the other columns of that
+    table the query (or the views it reads) mentions. Measure before adopting:
+    a different index can change how SQLite materialises the CTEs above it.
+    """
+    tables = {r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    expanded = None
+    out = []
+    for line in plan:
+        m = _INDEX_SCAN_RE.match(line)
+        if not m or m.group(1) not in tables:
+            continue
+        table, index = m.groups()
+        expanded = expanded or _expanded_sql(conn, sql)
+        idx_cols = [r[2] for r in conn.execute(text(f"PRAGMA index_info({index})"))]
+        extra = [
+            r[1] for r in conn.execute(text(f"PRAGMA table_info({table})"))
+            if r[1] not in idx_cols and re.search(rf"\b{r[1]}\b", expanded)
+        ]
+        if extra:
+            stmt = f"CREATE INDEX {index}_cov ON {table}({', '.join(idx_cols + extra)});"
+            if stmt not in out:
+                out.append(stmt)
+    return out
+
+
+def explain_all(engine, queries: dict[str, str], propose: bool = True) -> dict[str, dict]:
+    dialect = engine.dialect.name
+    db_path = engine.url.database if dialect == "sqlite" else None
+    results = {}
+    with engine.connect() as conn:
+        for name, sql in queries.items():
+            try:
+                res = sqlite_plan(conn, sql) if dialect == "sqlite" else postgres_plan(conn, sql)
+                if dialect == "postgresql":
+                    conn.rollback()
+            except Exception as e:
+                results[name] = {"error": str(e).splitlines()[0]}
+                if dialect == "postgresql":
+                    conn.rollback()
+                continue
+            if propose and dialect == "sqlite":
+                res["proposed_indexes"] = covering_index_proposals(conn, sql, res["plan"])
+                if res["flags"]:
+                    res["proposed_indexes"] += [i for i in expert_indexes(db_path, sql) if i not in res["proposed_indexes"]]
+                    res["auto_index_hints"] = auto_index_hints(res["flags"])
+            results[name] = res
+    return results
+
+
+def compare(results: dict[str, dict], baseline: dict[str, list[str]]) -> list[str]:
+    """Queries whose flags grew relative to the baseline."""
+    regressions = []
+    for name, res in sorted(results.items()):
+        if "flags" not in res or name not in baseline:
+            continue
+        added = Counter(res["flags"]) - Counter(baseline[name])
+        if added:
+            regressions.append(f"{name}: + " + "; + ".join(sorted(added.elements())))
+    return regressions
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Check mart and report query plans against a stored baseline.")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE_PATH), help=f"Baseline JSON (default: {DEFAULT_BASELINE_PATH})")
+    parser.add_argument("--update-baseline", action="store_true", help="Write the current flags as the new baseline")
+    parser.add_argument("--report", help="Write full plans, flags and index proposals to this JSON file")
+    parser.add_argument("--no-propose", action="store_true", help="Skip index proposals")
+    parser.add_argument("--verbose", action="store_true", help="Also print the automatic-index columns per query")
+    parser.add_argument("--only", action="append", help="Only check queries whose name contains this text (repeatable)")
+    parser.add_argument("--skip-missing", action="store_true",
+                        help="Skip queries on tables or views that are not built (e.g. the commercial marts) instead of failing")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    engine = get_engine()
+    if engine.dialect.name not in ("sqlite", "postgresql"):
+        raise SystemExit(f"Query plans are supported on SQLite and PostgreSQL, not {engine.dialect.name}.")
+
+    queries = collect_queries()
+    if args.only:
+        queries = {k: v for k, v in queries.items() if any(o in k for o in args.only)}
+    results = explain_all(engine, queries, propose=not args.no_propose)
+    if args.skip_missing:
+        skipped = [k for k, v in results.items() if "error" in v and _MISSING_RE.search(v["error"])]
+        for name in skipped:
+            del results[name]
+        if skipped:
+            print(f"Skipped {len(skipped)} queries on objects that are not built: {', '.join(skipped)}")
+
+    n_flagged = 0
+    for name, res in results.items():
+        if "error" in res:
+            print(f"  ERROR {name}: {res['error']}")
+            continue
+        if res["flags"] or res.get("proposed_indexes"):
+            n_flagged += bool(res["flags"])
+            counts = Counter(res["flags"])
+            print(f"  {name}: " + ", ".join(f"{c}x {f}" if c > 1 else f for f, c in counts.items()))
+            for idx in res.get("proposed_indexes", []):
+                print(f"      proposed: {idx}")
+            if args.verbose:
+                for hint in res.get("auto_index_hints", []):
+                    print(f"      automatic index: {hint}")
+    print(f"Queries: {len(results)}  flagged: {n_flagged}")
+
+    if args.report:
+        report_path = Path(args.report).expanduser().resolve()
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report_path.write_text(json.dumps({"dialect": engine.dialect.name, "queries": results}, indent=2), encoding="utf-8")
+        print(f"Saved: {report_path}")
+
+    baseline_path = Path(args.baseline)
+    baseline_key = engine.dialect.name
+    stored = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {}
+    current = {k: sorted(v["flags"]) for k, v in results.items() if "flags" in v}
+
+    if args.update_baseline:
+        stored[baseline_key] = {**stored.get(baseline_key, {}), **current} if args.only else current
+        baseline_path.write_text(json.dumps(stored, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"Saved baseline: {baseline_path}")
+        return 0
+
+    if baseline_key not in stored:
+        print(f"No {baseline_key} baseline at {baseline_path}; run with --update-baseline to create one.")
+        return 0
+    regressions = compare(results, stored[baseline_key])
+    errors = [k for k, v in results.items() if "error" in v]
+    for r in regressions:
+        print(f"  REGRESSION {r}")
+    if regressions or errors:
+        print(f"FAILED: {len(regressions)} plan regression(s), {len(errors)} error(s)")
+        return 1
+    print("OK: no plan regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,410 @@
+"""
+Interactive portfolio dashboard served from cached aggregates.
+
+The page is small HTML. Data is fetched as compact JSON when a chart needs
+it, so opening the dashboard never ships the loan-level snapshot:
+
+  1. One GROUP BY over mart_portfolio_snapshot_v2 (joined to dim_customers for
+     the region) builds month x product_type x channel x region x dpd_bucket
+     loan counts and EOP balances. Its size depends on the number of segments,
+     not the number of loans.
+  2. The aggregates are cached in core/data/dashboard_cache.npz, keyed by
+     the loaded book (loan and payment counts / max ids), so a restart
+     reads a few arrays instead of querying the marts.
+  3. A small local HTTP server answers filter and drill-down requests from
+     the arrays (a boolean mask plus np.bincount per measure), memoises
+     responses, and gzips them when the browser accepts it.
+
+Endpoints:
+  GET /                  the dashboard page (Plotly WebGL traces)
+  GET /api/meta          dimension values and months
+  GET /api/series        monthly loans / balance / 30+ 60+ 90+ rates; filters
+                         ?product_type=..&channel=..&region=.. (comma-separated),
+                         split with &by=product_type|channel|region|dpd_bucket
+  GET /api/breakdown     one month (&month=YYYY-MM-DD) by a dimension, same filters
+  GET /plotly.min.js     served from the installed plotly package (else the page uses the CDN)
+
+Typical usage (from core/python):
+  python dashboard_server.py                 # http://127.0.0.1:8050
+  python dashboard_server.py --rebuild       # re-query the marts
+  python dashboard_server.py --build-only    # refresh the cache and exit (e.g. after the marts)
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterable
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from db_engine import get_engine
+from month_keys import month_end_from_key
+from portfolio_cube import book_fingerprint
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_CACHE_PATH = ROOT_DIR / "core" / "data" / "dashboard_cache.npz"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8050
+PLOTLY_CDN = "https://cdn.plot.ly/plotly-2.35.2.min.js"
+
+DIMS = ["product_type", "channel", "region", "dpd_bucket"]
+BUCKETS = ["DPD_0", "DPD_1_29", "DPD_30_59", "DPD_60_89", "DPD_90_PLUS"]
+# measure -> dpd_bucket codes it counts (None: all rows)
+LOAN_MEASURES = {"loans": None, "loans_30p": (2, 3, 4), "loans_60p": (3, 4), "loans_90p": (4,)}
+
+AGG_SQL = """
+SELECT
+  s.month_key,
+  s.product_type,
+  s.channel,
+  COALESCE(c.region, 'Unknown') AS region,
+  s.dpd_bucket,
+  COUNT(*) AS loans,
+  SUM(COALESCE(s.eop_balance, 0)) AS balance
+FROM mart_portfolio_snapshot_v2 s
+LEFT JOIN dim_customers c
+  ON c.customer_id = s.customer_id
+GROUP BY s.month_key, s.product_type, s.channel, COALESCE(c.region, 'Unknown'), s.dpd_bucket
+"""
+
+
+class Aggregates:
+    """Segment x month rows with dictionary-encoded dimensions."""
+
+    def __init__(self, values: dict[str, list[str]], codes: dict[str, np.ndarray], month_key: np.ndarray,
+                 loans: np.ndarray, balance: np.ndarray, fingerprint: str = ""):
+        self.values = values            # dim -> labels
+        self.codes = codes              # dim -> int16 code per row
+        self.month_key = month_key      # int32 per row
+        self.loans = loans              # int64 per row
+        self.balance = balance          # float64 per row
+        self.fingerprint = fingerprint
+        self.months = np.unique(month_key)
+        self.month_idx = np.searchsorted(self.months, month_key)
+        self.month_ends = list(month_end_from_key(self.months)) if len(self.months) else []
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, fingerprint: str = "") -> "Aggregates":
+        values, codes = {}, {}
+        for dim in DIMS:
+            cat = pd.Categorical(df[dim].astype(str), categories=BUCKETS if dim == "dpd_bucket" else None)
+            values[dim] = [str(v) for v in cat.categories]
+            codes[dim] = cat.codes.astype(np.int16)
+        return cls(values, codes, df["month_key"].to_numpy(dtype=np.int32), df["loans"].to_numpy(dtype=np.int64),
+                   df["balance"].to_numpy(dtype=np.float64), fingerprint)
+
+    def save(self, path: Path | str = DEFAULT_CACHE_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {f"code_{d}": self.codes[d] for d in DIMS}
+        arrays.update({f"values_{d}": np.array(self.values[d]) for d in DIMS})
+        np.savez(path, month_key=self.month_key, loans=self.loans, balance=self.balance,
+                 fingerprint=np.array(self.fingerprint), **arrays)
+
+    @classmethod
+    def load(cls, path: Path | str = DEFAULT_CACHE_PATH) -> "Aggregates":
+        with np.load(Path(path), allow_pickle=False) as z:
+            return cls({d: [str(v) for v in z[f"values_{d}"]] for d in DIMS},
+                       {d: z[f"code_{d}"] for d in DIMS}, z["month_key"], z["loans"], z["balance"],
+                       str(z["fingerprint"]))
+
+    # -- queries -------------------------------------------------------------
+
+    def _mask(self, filters: dict[str, list[str]]) -> np.ndarray:
+        mask = np.ones(len(self.loans), dtype=bool)
+        for dim, wanted in filters.items():
+            if dim in self.codes and wanted:
+                ids = [self.values[dim].index(v) for v in wanted if v in self.values[dim]]
+                mask &= np.isin(self.codes[dim], ids)
+        return mask
+
+    def _sums(self, keys: np.ndarray, size: int, mask: np.ndarray) -> dict[str, np.ndarray]:
+        """Measures summed per key (0..size-1) over the masked rows."""
+        bucket = self.codes["dpd_bucket"][mask]
+        keys, loans, balance = keys[mask], self.loans[mask], self.balance[mask]
+        out = {}
+        for name, buckets in LOAN_MEASURES.items():
+            w = loans if buckets is None else loans * np.isin(bucket, buckets)
+            out[name] = np.bincount(keys, weights=w, minlength=size)
+        out["balance"] = np.bincount(keys, weights=balance, minlength=size)
+        out["balance_60p"] = np.bincount(keys, weights=balance * np.isin(bucket, LOAN_MEASURES["loans_60p"]),
+                                         minlength=size)
+        return out
+
+    @staticmethod
+    def _kpis(s: dict[str, np.ndarray], sel) -> dict[str, list]:
+        loans, balance = s["loans"][sel], s["balance"][sel]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rates = {
+                "rate_30p": s["loans_30p"][sel] / loans,
+                "rate_60p": s["loans_60p"][sel] / loans,
+                "rate_90p": s["loans_90p"][sel] / loans,
+                "bal_rate_60p": s["balance_60p"][sel] / balance,
+            }
+        out = {"loans": loans.astype(np.int64).tolist(), "balance": np.round(balance, 0).tolist()}
+        # NaN (no loans) -> null in JSON
+        out.update({k: [None if np.isnan(x) else round(float(x), 5) for x in v] for k, v in rates.items()})
+        return out
+
+    def series(self, filters: dict[str, list[str]], by: str | None = None) -> dict:
+        """Monthly KPIs for the filtered portfolio, one series per value of `by`."""
+        mask = self._mask(filters)
+        T = len(self.months)
+        groups = self.values[by] if by else ["All"]
+        g = self.codes[by].astype(np.int64) if by else np.zeros(len(self.loans), dtype=np.int64)
+        s = self._sums(g * T + self.month_idx, len(groups) * T, mask)
+        series = {}
+        for k, name in enumerate(groups):
+            sel = slice(k * T, (k + 1) * T)
+            if s["loans"][sel].any():
+                series[name] = self._kpis(s, sel)
+        return {"months": self.month_ends, "by": by, "series": series}
+
+    def breakdown(self, month_end: str, filters: dict[str, list[str]], by: str) -> dict:
+        """KPIs for one month by a dimension (drill-down)."""
+        if month_end not in self.month_ends:
+            raise KeyError(f"unknown month {month_end}")
+        mask = self._mask(filters) & (self.month_idx == self.month_ends.index(month_end))
+        groups = self.values[by]
+        s = self._sums(self.codes[by].astype(np.int64), len(groups), mask)
+        keep = np.flatnonzero(s["loans"])
+        return {"month": month_end, "by": by, "groups": [groups[k] for k in keep], **self._kpis(s, keep)}
+
+    def meta(self) -> dict:
+        return {"dims": self.values, "months": self.month_ends, "rows": len(self.loans),
+                "loans_latest": int(self.loans[self.month_idx == len(self.months) - 1].sum()) if len(self.months) else 0}
+
+
+def load_aggregates(engine, cache_path: Path | str | None = DEFAULT_CACHE_PATH, rebuild: bool = False) -> Aggregates:
+    """Cached aggregates for the loaded book; re-queried when the book changed or `rebuild`."""
+    fp = book_fingerprint(engine)
+    if cache_path and not rebuild and Path(cache_path).exists():
+        agg = Aggregates.load(cache_path)
+        if agg.fingerprint == fp:
+            return agg
+    agg = Aggregates.from_frame(pd.read_sql_query(text(AGG_SQL), engine), fp)
+    if cache_path:
+        agg.save(cache_path)
+    return agg
+
+
+# -- HTTP ------------------------------------------------------------------------
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Portfolio Risk Dashboard</title>
+<script src="__PLOTLY__"></script>
+<style>
+  body { font-family: system-ui, sans-serif; margin: 16px; color: #222; }
+  .filters { display: flex; gap: 16px; flex-wrap: wrap; align-items: flex-start; }
+  .filters label { display: flex; flex-direction: column; font-size: 12px; }
+  select[multiple] { min-height: 90px; min-width: 140px; }
+  .grid { display: grid; grid-template-columns: 1fr 1fr; gap: 8px; }
+  .chart { height: 380px; }
+  #status { font-size: 12px; color: #666; }
+</style>
+</head>
+<body>
+<h2>Portfolio Risk Dashboard</h2>
+<div class="filters" id="filters"></div>
+<p id="status"></p>
+<div class="grid">
+  <div class="chart" id="rate"></div>
+  <div class="chart" id="size"></div>
+  <div class="chart" id="drill"></div>
+  <div class="chart" id="buckets"></div>
+</div>
+<script>
+const FILTER_DIMS = ["product_type", "channel", "region"];
+const BUCKET_COLORS = {DPD_0: "#2ca02c", DPD_1_29: "#bcbd22", DPD_30_59: "#ff7f0e", DPD_60_89: "#d62728", DPD_90_PLUS: "#7f0000"};
+let meta = null, month = null;
+
+function query(extra) {
+  const p = new URLSearchParams(extra || {});
+  for (const d of FILTER_DIMS) {
+    const sel = [...document.getElementById("f_" + d).selectedOptions].map(o => o.value);
+    if (sel.length) p.set(d, sel.join(","));
+  }
+  return p.toString();
+}
+
+async function getJSON(url) {
+  const t0 = performance.now();
+  const r = await fetch(url);
+  const body = await r.json();
+  document.getElementById("status").textContent = `${url.split("?")[0]}: ${(performance.now() - t0).toFixed(0)} ms`;
+  if (!r.ok) throw new Error(body.error);
+  return body;
+}
+
+function filterBox(dim, values) {
+  const opts = values.map(v => `<option>${v}</option>`).join("");
+  return `<label>${dim}<select multiple id="f_${dim}">${opts}</select></label>`;
+}
+
+async function drawSeries() {
+  const by = document.getElementById("by").value;
+  const data = await getJSON("/api/series?" + query(by ? {by} : {}));
+  const x = data.months;
+  const rate = [], size = [];
+  for (const [name, s] of Object.entries(data.series)) {
+    rate.push({type: "scattergl", mode: "lines", name, x, y: s.rate_60p, hovertemplate: "%{y:.2%}"});
+    size.push({type: "scattergl", mode: "lines", name, x, y: s.loans});
+  }
+  Plotly.react("rate", rate, {title: "60+ DPD rate (click a month to drill down)", yaxis: {tickformat: ".1%"}, margin: {t: 40}});
+  Plotly.react("size", size, {title: "Loans", margin: {t: 40}});
+  if (!month || !x.includes(month)) month = x[x.length - 1];
+  await drawDrill();
+}
+
+async function drawDrill() {
+  const dim = document.getElementById("drill_by").value;
+  const [d, b] = await Promise.all([
+    getJSON("/api/breakdown?" + query({month, by: dim})),
+    getJSON("/api/breakdown?" + query({month, by: "dpd_bucket"})),
+  ]);
+  Plotly.react("drill", [{type: "bar", x: d.groups, y: d.rate_60p, text: d.loans.map(n => n + " loans"),
+                          hovertemplate: "%{x}: %{y:.2%} (%{text})<extra></extra>"}],
+               {title: `60+ rate by ${dim}, ${month}`, yaxis: {tickformat: ".1%"}, margin: {t: 40}});
+  Plotly.react("buckets", [{type: "pie", labels: b.groups, values: b.loans, sort: false,
+                            marker: {colors: b.groups.map(g => BUCKET_COLORS[g])}}],
+               {title: `DPD mix, ${month}`, margin: {t: 40}});
+}
+
+async function init() {
+  meta = await getJSON("/api/meta");
+  const f = document.getElementById("filters");
+  f.innerHTML = FILTER_DIMS.map(d => filterBox(d, meta.dims[d])).join("") +
+    `<label>split by<select id="by"><option value="">(portfolio)</option>` +
+    FILTER_DIMS.concat(["dpd_bucket"]).map(d => `<option>${d}</option>`).join("") + `</select></label>` +
+    `<label>drill down by<select id="drill_by">` + FILTER_DIMS.map(d => `<option>${d}</option>`).join("") + `</select></label>`;
+  for (const el of f.querySelectorAll("select")) el.addEventListener("change", () => el.id === "drill_by" ? drawDrill() : drawSeries());
+  await drawSeries();
+  document.getElementById("rate").on("plotly_click", ev => { month = ev.points[0].x.slice(0, 10); drawDrill(); });
+}
+init().catch(e => { document.getElementById("status").textContent = "Error: " + e.message; });
+</script>
+</body>
+</html>
+"""
+
+
+def _plotly_js() -> bytes | None:
+    try:
+        from plotly.offline import get_plotlyjs
+    except ImportError:
+        return None
+    return get_plotlyjs().encode("utf-8")
+
+
+class DashboardApp:
+    """Routes and memoised JSON responses over one Aggregates instance."""
+
+    def __init__(self, agg: Aggregates):
+        self.agg = agg
+        self.plotly_js = _plotly_js()
+        self.page = PAGE.replace("__PLOTLY__", "/plotly.min.js" if self.plotly_js else PLOTLY_CDN).encode("utf-8")
+        self.respond = lru_cache(maxsize=1024)(self._respond)
+
+    def _respond(self, path: str, query: str) -> tuple[int, bytes]:
+        params = {k: v[-1] for k, v in parse_qs(query).items()}
+        filters = {d: params[d].split(",") for d in DIMS if params.get(d)}
+        by = params.get("by") or None
+        if by is not None and by not in DIMS:
+            return 400, json.dumps({"error": f"by must be one of {', '.join(DIMS)}"}).encode()
+        try:
+            if path == "/api/meta":
+                body = self.agg.meta()
+            elif path == "/api/series":
+                body = self.agg.series(filters, by)
+            elif path == "/api/breakdown":
+                body = self.agg.breakdown(params.get("month", ""), filters, by or "product_type")
+            else:
+                return 404, json.dumps({"error": f"unknown path {path}"}).encode()
+        except KeyError as e:
+            return 400, json.dumps({"error": str(e.args[0])}).encode()
+        return 200, json.dumps(body, separators=(",", ":")).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "PortfolioDashboard/1.0"
+    app: DashboardApp  # set by serve()
+
+    def log_message(self, fmt, *args):  # quiet; the page shows request timings
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, cache: str = "no-cache") -> None:
+        if len(body) > 1024 and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=5)
+            self.send_response(status)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", cache)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path in ("/", "/index.html"):
+            self._send(200, self.app.page, "text/html; charset=utf-8")
+        elif url.path == "/plotly.min.js" and self.app.plotly_js:
+            self._send(200, self.app.plotly_js, "application/javascript", cache="max-age=86400")
+        else:
+            status, body = self.app.respond(url.path, url.query)
+            self._send(status, body, "application/json")
+
+
+def serve(agg: Aggregates, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+          ready: threading.Event | None = None) -> ThreadingHTTPServer:
+    """Start the dashboard server in a background thread and return it (call .shutdown() to stop)."""
+    handler = type("Handler", (_Handler,), {"app": DashboardApp(agg)})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if ready is not None:
+        ready.set()
+    return server
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve the interactive portfolio dashboard from cached aggregates.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Listen address (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Listen port (default: {DEFAULT_PORT})")
+    parser.add_argument("--cache", default=str(DEFAULT_CACHE_PATH), help=f"Aggregate cache (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--rebuild", action="store_true", help="Re-query the marts even if the cache matches the book")
+    parser.add_argument("--build-only", action="store_true", help="Refresh the cache and exit")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    t0 = time.perf_counter()
+    agg = load_aggregates(get_engine(read_only=True), args.cache, rebuild=args.rebuild)
+    print(f"Aggregates: {len(agg.loans):,} segment-months over {len(agg.months):,} months "
+          f"({time.perf_counter() - t0:.2f}s)")
+    if args.build_only:
+        return 0
+    server = serve(agg, args.host, args.port)
+    print(f"Dashboard on http://{args.host}:{server.server_address[1]}/ (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
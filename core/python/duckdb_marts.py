@@ -0,0 +1,434 @@
+"""
+Optional DuckDB backend for the mart, risk-feature and commercial SQL.
+
+The marts are window-function work (cumulative sums, LAG, rolling frames over
+loan_id partitions) that SQLite evaluates row by row every time a view is
+read. This module runs the same SQL files in an in-process DuckDB database
+(columnar, vectorised, multi-threaded; no server) and publishes the results
+back into the SQLite database:
+
+  - every mart view is materialised into a table mv_<view>, and the SQLite
+    view becomes `SELECT * FROM mv_<view>`, so all consumers keep their queries
+  - comm_loan_month is filled in the same pass (the measures of commercial_engine.py)
+  - views that only pass through one table (v_month_ends, comm_*), the table /
+    index DDL and the dim_month INSERT run on SQLite as written
+
+Results are staged in <table>__new tables and swapped in with one SQLite
+transaction, so readers see either the previous build or the new one.
+
+Inputs are the tables and views the files read but do not create. They are
+read from the SQLite database over the shared read-only engine, or with
+--raw-dir straight from the raw layer (<table>.parquet, else <table>.csv),
+with the month keys and dim_month derived in DuckDB.
+
+Dialect differences are handled per statement: SQLite's scalar MAX(0, x)
+becomes GREATEST, REAL becomes DOUBLE (REAL is 4-byte in DuckDB), DROP VIEW /
+CREATE INDEX are not needed, and the dim_month INSERT (SQLite date functions)
+is replaced by DuckDB calendar SQL.
+
+DuckDB sums the running totals in a different order from SQLite. The DPD
+buckets are taken on arrears rounded to cents and missed instalments rounded
+to 6 decimals (03_mart_views.sql), so both engines publish the same buckets.
+
+Running the SQL files with run_sql.py restores the plain SQLite views; the
+mv_* tables stay until the next DuckDB build replaces them.
+
+Needs `pip install duckdb` (the rest of the pipeline does not). SQLite only:
+the SQL files are written for it.
+
+Typical usage (from core/python):
+  python duckdb_marts.py
+  python duckdb_marts.py --raw-dir ../data/raw --threads 8
+  python run_pipeline.py --backend duckdb
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+from sqlalchemy import inspect
+
+from db_engine import get_engine
+from instrumentation import Recorder, count_db_calls, instrument
+from month_keys import BASE_YEAR, MONTH_KEY_COLUMNS
+from run_sql import label, read_sql, split_sql
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_FILES = [
+    ROOT_DIR / "core" / "sql" / "03_mart_views.sql",
+    ROOT_DIR / "core" / "sql" / "03_mart_views_plus_balance.sql",
+    ROOT_DIR / "package_risk" / "sql" / "10_risk_features.sql",
+    ROOT_DIR / "package_commercial" / "sql" / "20_commercial_marts.sql",
+]
+RAW_TABLES = ["dim_customers", "dim_products", "dim_channels", "fct_loans", "fct_schedule", "fct_payments", "fct_collections"]
+
+PREFIX = "mv_"
+STAGE_SUFFIX = "__new"
+COMM_TABLE = "comm_loan_month"
+# pass-through views: as cheap on SQLite as their table, kept as written
+KEEP_VIEWS = {"v_month_ends", "comm_interest_income_monthly", "comm_nii_monthly", "comm_rar_monthly"}
+BATCH_ROWS = 50_000
+
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+_DIALECT = [
+    (re.compile(r"\bMAX\(\s*0\s*,", re.IGNORECASE), "GREATEST(0,"),  # SQLite's two-argument scalar MAX
+    (re.compile(r"\bREAL\b", re.IGNORECASE), "DOUBLE"),
+]
+_CREATE_VIEW_RE = re.compile(r"^\s*CREATE\s+VIEW\s+(\S+)\s+AS\b", re.IGNORECASE)
+
+# Missing calendar months between the earliest and latest fact month keys
+# (DuckDB version of the INSERT at the top of 03_mart_views.sql)
+DIM_MONTH_SQL = f"""
+INSERT INTO dim_month
+SELECT
+  r.k,
+  strftime(make_date(CAST({BASE_YEAR} + r.k // 12 AS INTEGER), CAST(r.k % 12 + 1 AS INTEGER), 1), '%Y-%m-%d'),
+  strftime(last_day(make_date(CAST({BASE_YEAR} + r.k // 12 AS INTEGER), CAST(r.k % 12 + 1 AS INTEGER), 1)), '%Y-%m-%d'),
+  {BASE_YEAR} + r.k // 12,
+  r.k % 12 + 1
+FROM (
+  SELECT MIN(lo) AS lo, MAX(hi) AS hi
+  FROM (
+    SELECT MIN(orig_month_key) AS lo, MAX(orig_month_key) AS hi FROM fct_loans
+    UNION ALL
+    SELECT MIN(due_month_key), MAX(due_month_key) FROM fct_schedule
+    UNION ALL
+    SELECT MIN(payment_month_key), MAX(payment_month_key) FROM fct_payments
+  )
+) b, range(COALESCE(b.lo, 0), COALESCE(b.hi + 1, 0)) AS r(k)
+WHERE r.k NOT IN (SELECT month_key FROM dim_month)
+"""
+
+
+@dataclass
+class Step:
+    """One statement of a SQL file and where it runs."""
+    file: Path
+    kind: str
+    target: str
+    sql: str
+
+    @property
+    def published(self) -> bool:
+        return self.kind == "CREATE VIEW" and self.target.lower() not in KEEP_VIEWS
+
+    @property
+    def on_duckdb(self) -> bool:
+        return self.published or self.kind == "CREATE TABLE" or self.is_calendar
+
+    @property
+    def is_calendar(self) -> bool:
+        return self.kind == "INSERT" and self.target.lower() == "dim_month"
+
+
+def plan(files: Iterable[Path]) -> list[Step]:
+    steps = []
+    for f in files:
+        for stmt in split_sql(read_sql(f)):
+            kind, target = label(stmt)
+            steps.append(Step(f, kind, target.split(".")[-1], stmt))
+    return steps
+
+
+def to_duckdb(step: Step) -> str:
+    """DuckDB version of a statement; published views become tables."""
+    if step.is_calendar:
+        return DIM_MONTH_SQL
+    sql = step.sql
+    for rx, repl in _DIALECT:
+        sql = rx.sub(repl, sql)
+    if step.published:
+        sql = _CREATE_VIEW_RE.sub(lambda m: f"CREATE TABLE {m.group(1)} AS", sql, count=1)
+    return sql
+
+
+def comm_sql() -> str:
+    """
+    comm_loan_month rows from the marts, with commercial_engine's assumptions
+    (ROUND_EVEN for its numpy rounding; a value that sits on a half cent can
+    still land one cent apart, as the two engines sum floats differently).
+    """
+    sys.path.append(str(ROOT_DIR / "package_commercial" / "python"))
+    from commercial_engine import COMM_COLS, FUNDING_RATE, LGD_ASSUMPTION, PD_PROXY
+
+    cases = " ".join(f"WHEN '{bucket}' THEN {p}" for bucket, p in PD_PROXY.items())
+    nii = f"eop_balance * interest_rate_apr / 12.0 - eop_balance * {FUNDING_RATE} / 12.0"
+    el = f"eop_balance * pd_proxy * {LGD_ASSUMPTION}"
+    return f"""
+INSERT INTO {COMM_TABLE} ({", ".join(COMM_COLS)})
+WITH x AS (
+  SELECT
+    s.month_end, s.loan_id, s.product_type, s.channel, s.dpd_bucket,
+    b.eop_balance, s.interest_rate_apr,
+    CASE s.dpd_bucket {cases} ELSE {PD_PROXY["DPD_90_PLUS"]} END AS pd_proxy
+  FROM mart_portfolio_snapshot s
+  LEFT JOIN mart_balance_eop b
+    ON b.loan_id = s.loan_id AND b.month_key = s.month_key
+)
+SELECT
+  month_end, loan_id, product_type, channel, dpd_bucket, eop_balance, interest_rate_apr,
+  ROUND_EVEN(eop_balance * interest_rate_apr / 12.0, 2),
+  ROUND_EVEN(eop_balance * {FUNDING_RATE} / 12.0, 2),
+  ROUND_EVEN({nii}, 2),
+  pd_proxy,
+  {LGD_ASSUMPTION},
+  ROUND_EVEN({el}, 2),
+  ROUND_EVEN({nii} - {el}, 2)
+FROM x
+"""
+
+
+def _words(sql: str) -> set[str]:
+    return {w.lower() for w in _WORD_RE.findall(sql)}
+
+
+def required_inputs(steps: list[Step], with_comm: bool) -> set[str]:
+    """Lower-cased names the DuckDB statements read but do not create."""
+    created, refs = set(), set()
+    for s in steps:
+        if s.on_duckdb:
+            refs |= _words(s.sql)
+            if s.kind.startswith("CREATE"):
+                created.add(s.target.lower())
+    if with_comm:
+        refs |= _words(comm_sql())
+    return refs - created
+
+
+# -- inputs --------------------------------------------------------------------------
+
+def read_sqlite_inputs(con, engine, names: set[str]) -> dict[str, int]:
+    """Copy the needed tables / views of the SQLite database into DuckDB."""
+    insp = inspect(engine)
+    available = {n.lower(): n for n in insp.get_table_names() + insp.get_view_names()}
+    rows = {}
+    for name in sorted(names & set(available)):
+        df = pd.read_sql_query(f"SELECT * FROM {available[name]}", engine)
+        con.register("_input", df)
+        con.execute(f"CREATE TABLE {name} AS SELECT * FROM _input")
+        con.unregister("_input")
+        rows[name] = len(df)
+    return rows
+
+
+def _iso_dates_select(con, source: str) -> str:
+    """SELECT list for `source` with DATE / TIMESTAMP columns as ISO strings (as SQLite stores them)."""
+    cols = []
+    for name, dtype, *_ in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall():
+        if dtype.upper().startswith(("DATE", "TIMESTAMP")):
+            cols.append(f"strftime(\"{name}\", '%Y-%m-%d') AS \"{name}\"")
+        else:
+            cols.append(f'"{name}"')
+    return ", ".join(cols)
+
+
+def read_raw_inputs(con, raw_dir: Path) -> dict[str, int]:
+    """Raw-layer tables (Parquet preferred over CSV) with month keys, plus dim_month."""
+    rows = {}
+    for name in RAW_TABLES:
+        parquet, csv = raw_dir / f"{name}.parquet", raw_dir / f"{name}.csv"
+        if parquet.exists():
+            source = f"read_parquet('{parquet.as_posix()}')"
+        elif csv.exists():
+            source = f"read_csv('{csv.as_posix()}', header = true)"
+        else:
+            continue
+        select = _iso_dates_select(con, source)
+        for date_col, key_col in MONTH_KEY_COLUMNS.get(name, {}).items():
+            select += (f", (CAST(substr(CAST(\"{date_col}\" AS VARCHAR), 1, 4) AS INTEGER) - {BASE_YEAR}) * 12"
+                       f" + CAST(substr(CAST(\"{date_col}\" AS VARCHAR), 6, 2) AS INTEGER) - 1 AS {key_col}")
+        con.execute(f"CREATE TABLE {name} AS SELECT {select} FROM {source}")
+        rows[name] = con.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+    missing = {"fct_loans", "fct_schedule", "fct_payments"} - set(rows)
+    if missing:
+        raise SystemExit(f"Raw layer {raw_dir} has no {', '.join(sorted(missing))} (.parquet or .csv)")
+    con.execute("CREATE TABLE dim_month (month_key INTEGER, month_start VARCHAR, month_end VARCHAR, "
+                "year INTEGER, month INTEGER)")
+    con.execute(DIM_MONTH_SQL)
+    rows["dim_month"] = con.execute("SELECT COUNT(*) FROM dim_month").fetchone()[0]
+    return rows
+
+
+# -- publish -------------------------------------------------------------------------
+
+def _sqlite_type(duck_type: str) -> str:
+    t = duck_type.upper()
+    if "INT" in t or t == "BOOLEAN":
+        return "INTEGER"
+    if t in ("DOUBLE", "FLOAT", "REAL") or t.startswith("DECIMAL"):
+        return "REAL"
+    return "TEXT"
+
+
+def stage_table(con, dbapi, source: str, target: str) -> int:
+    """Copy DuckDB table `source` into a fresh SQLite table `target`; returns rows."""
+    cols = [(name, dtype) for name, dtype, *_ in con.execute(f"DESCRIBE {source}").fetchall()]
+    select = []
+    for name, dtype in cols:
+        t = dtype.upper()
+        if t.startswith("DECIMAL"):
+            select.append(f'CAST("{name}" AS DOUBLE)')  # sqlite3 can't bind Decimal
+        elif t.startswith(("DATE", "TIMESTAMP")):
+            select.append(f"strftime(\"{name}\", '%Y-%m-%d')")
+        else:
+            select.append(f'"{name}"')
+    cur = dbapi.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {target}")
+    cur.execute(f"CREATE TABLE {target} ({', '.join(f'{n} {_sqlite_type(t)}' for n, t in cols)})")
+    insert = f"INSERT INTO {target} VALUES ({', '.join('?' * len(cols))})"
+    res = con.execute(f"SELECT {', '.join(select)} FROM {source}")
+    n = calls = 0
+    cur.execute("BEGIN")
+    while batch := res.fetchmany(BATCH_ROWS):
+        cur.executemany(insert, batch)
+        n += len(batch)
+        calls += 1
+    cur.execute("COMMIT")
+    cur.close()
+    count_db_calls(calls + 4)
+    return n
+
+
+def swap_in(dbapi, steps: list[Step], columns: dict[str, list[str]], with_comm: bool) -> None:
+    """
+    One transaction: run the SQLite-side statements in file order, replace each
+    published view with a view over its freshly staged mv_ table, and move the
+    staged commercial rows into comm_loan_month.
+    """
+    cur = dbapi.cursor()
+    # rename without re-checking views that point at tables dropped a moment earlier
+    cur.execute("PRAGMA legacy_alter_table=ON")
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        for s in steps:
+            if not s.published:
+                cur.execute(s.sql)
+                if with_comm and s.kind == "CREATE TABLE" and s.target.lower() == COMM_TABLE:
+                    cur.execute(f"DELETE FROM {COMM_TABLE}")
+                    cur.execute(f"INSERT INTO {COMM_TABLE} SELECT * FROM {COMM_TABLE}{STAGE_SUFFIX}")
+                    cur.execute(f"DROP TABLE {COMM_TABLE}{STAGE_SUFFIX}")
+                continue
+            mv = PREFIX + s.target
+            cur.execute(f"DROP VIEW IF EXISTS {s.target}")
+            cur.execute(f"DROP TABLE IF EXISTS {mv}")
+            cur.execute(f"ALTER TABLE {mv}{STAGE_SUFFIX} RENAME TO {mv}")
+            if {"month_end", "loan_id"} <= set(columns[s.target]):
+                cur.execute(f"CREATE INDEX ix_{mv} ON {mv}(month_end, loan_id)")
+            cur.execute(f"CREATE VIEW {s.target} AS SELECT * FROM {mv}")
+        cur.execute("COMMIT")
+    except Exception:
+        if dbapi.in_transaction:
+            cur.execute("ROLLBACK")
+        raise
+    finally:
+        cur.execute("PRAGMA legacy_alter_table=OFF")
+        cur.close()
+    count_db_calls(len(steps) + 2)
+
+
+# -- build ---------------------------------------------------------------------------
+
+def build(files: Iterable[Path], engine=None, raw_dir: Path | None = None, threads: int | None = None,
+          rec=None) -> dict[str, int]:
+    """
+    Run `files` on DuckDB and publish the results into the SQLite database of
+    `engine` (default: the shared engine). Returns rows published per object.
+    """
+    try:
+        import duckdb
+    except ImportError:
+        raise SystemExit("The DuckDB backend needs `pip install duckdb`")
+
+    engine = engine or get_engine()
+    if engine.dialect.name != "sqlite":
+        raise SystemExit(f"The DuckDB backend publishes into SQLite databases, not {engine.dialect.name}.")
+    steps = plan(files)
+    with_comm = any(s.kind == "CREATE TABLE" and s.target.lower() == COMM_TABLE for s in steps)
+
+    rec = rec or Recorder("duckdb_marts")
+    con = duckdb.connect()
+    try:
+        if threads:
+            con.execute(f"SET threads = {int(threads)}")
+        with rec.step("read_inputs") as st:
+            if raw_dir is not None:
+                inputs = read_raw_inputs(con, Path(raw_dir))
+            else:
+                reader = get_engine(engine.url.render_as_string(hide_password=False), read_only=True)
+                inputs = read_sqlite_inputs(con, reader, required_inputs(steps, with_comm))
+            st.rows = sum(inputs.values())
+        for name, n in inputs.items():
+            print(f"  input {name}: {n:,}")
+
+        columns: dict[str, list[str]] = {}
+        for s in steps:
+            if not s.on_duckdb:
+                continue
+            with rec.step(f"duckdb/{s.target}"):
+                con.execute(to_duckdb(s))
+            if s.published:
+                columns[s.target] = [r[0] for r in con.execute(f"DESCRIBE {s.target}").fetchall()]
+        if with_comm:
+            with rec.step("duckdb/commercial_measures"):
+                con.execute(comm_sql())
+
+        published: dict[str, int] = {}
+        raw = engine.raw_connection()
+        dbapi = raw.driver_connection
+        isolation = dbapi.isolation_level
+        try:
+            dbapi.isolation_level = None  # explicit BEGIN / COMMIT
+            for s in steps:
+                if s.published:
+                    with rec.step(f"publish/{s.target}") as st:
+                        st.rows = published[s.target] = stage_table(con, dbapi, s.target, PREFIX + s.target + STAGE_SUFFIX)
+            if with_comm:
+                with rec.step(f"publish/{COMM_TABLE}") as st:
+                    st.rows = published[COMM_TABLE] = stage_table(con, dbapi, COMM_TABLE, COMM_TABLE + STAGE_SUFFIX)
+            with rec.step("swap"):
+                swap_in(dbapi, steps, columns, with_comm)
+        finally:
+            dbapi.isolation_level = isolation
+            raw.close()
+    finally:
+        con.close()
+    return published
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Build the mart, risk-feature and commercial SQL on DuckDB and publish to SQLite.")
+    parser.add_argument("files", nargs="*", help="SQL files, in dependency order (default: the 03, 10 and 20 mart files)")
+    parser.add_argument("--raw-dir", help="Read the fact tables from this raw layer (.parquet or .csv) instead of the database")
+    parser.add_argument("--threads", type=int, help="DuckDB worker threads (default: all cores)")
+    parser.add_argument("--show-sql", action="store_true", help="Print each statement as it runs on DuckDB / SQLite and exit")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    files = [Path(f) for f in args.files] or DEFAULT_FILES
+    for f in files:
+        if not f.exists():
+            raise SystemExit(f"SQL file not found: {f}")
+
+    if args.show_sql:
+        for s in plan(files):
+            where = "duckdb" if s.on_duckdb else "sqlite"
+            sql = to_duckdb(s) if s.on_duckdb else s.sql
+            print(f"-- [{where}] {s.file.name}: {s.kind} {s.target}\n{sql.strip()};\n")
+            if s.published:
+                print(f"-- [sqlite] CREATE VIEW {s.target} AS SELECT * FROM {PREFIX}{s.target};\n")
+        return 0
+
+    with instrument("duckdb_marts") as rec:
+        published = build(files, raw_dir=args.raw_dir, threads=args.threads, rec=rec)
+    for name, n in published.items():
+        print(f"Published {name}: {n:,}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
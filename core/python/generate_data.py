@@ -7,6 +7,9 @@ from datetime import date, timedelta
 import numpy as np
 import pandas as pd
 
+from instrumentation import instrument
+from month_keys import add_month_keys
+
 @dataclass
 class Config:
     seed: int = 42
@@ -219,31 +222,51 @@ def main():
     cfg = Config()
     os.makedirs(cfg.out_dir, exist_ok=True)
 
-    customers = make_customers(cfg)
-    loans = make_loans(cfg, customers)
-    schedule = build_schedule(loans)
-    payments, collections = generate_payments(cfg, customers, loans, schedule)
-
-    customers.to_csv(os.path.join(cfg.out_dir, "dim_customers.csv"), index=False)
-    loans.to_csv(os.path.join(cfg.out_dir, "fct_loans.csv"), index=False)
-    schedule.to_csv(os.path.join(cfg.out_dir, "fct_schedule.csv"), index=False)
-    payments.to_csv(os.path.join(cfg.out_dir, "fct_payments.csv"), index=False)
-    collections.to_csv(os.path.join(cfg.out_dir, "fct_collections.csv"), index=False)
-
-    dim_products = pd.DataFrame([
-        {"product_type":"Personal","secured_flag":False,"base_risk_tier":"High"},
-        {"product_type":"Auto","secured_flag":True,"base_risk_tier":"Medium"},
-        {"product_type":"Mortgage","secured_flag":True,"base_risk_tier":"Low"},
-        {"product_type":"SME","secured_flag":False,"base_risk_tier":"High"},
-    ])
-    dim_channels = pd.DataFrame([
-        {"channel":"Online","channel_group":"Direct"},
-        {"channel":"Branch","channel_group":"Direct"},
-        {"channel":"Broker","channel_group":"Indirect"},
-        {"channel":"Partner","channel_group":"Indirect"},
-    ])
-    dim_products.to_csv(os.path.join(cfg.out_dir, "dim_products.csv"), index=False)
-    dim_channels.to_csv(os.path.join(cfg.out_dir, "dim_channels.csv"), index=False)
+    with instrument("generate_data") as rec:
+        with rec.step("customers") as st:
+            customers = make_customers(cfg)
+            st.rows = len(customers)
+        with rec.step("loans") as st:
+            loans = make_loans(cfg, customers)
+            st.rows = len(loans)
+        with rec.step("schedule") as st:
+            schedule = build_schedule(loans)
+            st.rows = len(schedule)
+        with rec.step("payments") as st:
+            payments, collections = generate_payments(cfg, customers, loans, schedule)
+            st.rows = len(payments) + len(collections)
+
+        # integer month keys alongside the ISO dates (see month_keys.py)
+        add_month_keys("fct_loans", loans)
+        add_month_keys("fct_schedule", schedule)
+        add_month_keys("fct_payments", payments)
+        add_month_keys("fct_collections", collections)
+
+        dim_products = pd.DataFrame([
+            {"product_type":"Personal","secured_flag":False,"base_risk_tier":"High"},
+            {"product_type":"Auto","secured_flag":True,"base_risk_tier":"Medium"},
+            {"product_type":"Mortgage","secured_flag":True,"base_risk_tier":"Low"},
+            {"product_type":"SME","secured_flag":False,"base_risk_tier":"High"},
+        ])
+        dim_channels = pd.DataFrame([
+            {"channel":"Online","channel_group":"Direct"},
+            {"channel":"Branch","channel_group":"Direct"},
+            {"channel":"Broker","channel_group":"Indirect"},
+            {"channel":"Partner","channel_group":"Indirect"},
+        ])
+        outputs = {
+            "dim_customers": customers,
+            "fct_loans": loans,
+            "fct_schedule": schedule,
+            "fct_payments": payments,
+            "fct_collections": collections,
+            "dim_products": dim_products,
+            "dim_channels": dim_channels,
+        }
+        with rec.step("write_csv") as st:
+            for name, df in outputs.items():
+                df.to_csv(os.path.join(cfg.out_dir, f"{name}.csv"), index=False)
+            st.rows = sum(len(df) for df in outputs.values())
 
     print("Data generated:", os.path.abspath(cfg.out_dir))
 
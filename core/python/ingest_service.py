@@ -0,0 +1,493 @@
+"""
+Local ingestion service for payment and collection events.
+
+load_data.py clears and reloads every table, so it cannot take new events
+while the book is in use. This service appends them instead:
+
+  POST /payments      {"loan_id": 100042, "payment_date": "2026-05-03", "paid_amount": 412.50}
+  POST /collections   {"loan_id": 100042, "event_date": "2026-05-04", "action_type": "Call",
+                       "promised_to_pay_date": "2026-05-11"}
+  GET  /stats         counters, queue depth and batch timings
+
+A body is one event, a JSON array of events, or NDJSON (one event per line).
+Events are validated against an in-memory index of fct_loans:
+- the loan must exist;
+- dates are ISO and not before origination;
+- amounts are positive;
+- action types are known.
+A request is accepted or rejected as a whole (422 with the errors).
+
+Accepted events are queued and written in micro-batches, one transaction per
+batch. A batch is written when it reaches --batch-size events or when its
+oldest event has waited --max-latency-ms. The response is sent once the
+batch has committed, so a 200 means the events are in the database. The
+month keys are filled in, and dim_month is extended in the batch's
+transaction when it reaches a new month.
+
+Backpressure: at most --max-pending events may wait for a commit. A request
+that does not fit within --queue-timeout seconds gets 503 with Retry-After.
+
+Payments reach loan_state.py on its next refresh (it reads payment_ids after
+its watermark). With the SQLite views they also reach the marts on their next
+read. Marts built by duckdb_marts.py are tables (mv_*) and stay as built: the
+service detects them at start-up, reports "marts_stale" in /stats once it has
+written events, and they must be rebuilt with duckdb_marts.py after ingesting.
+
+Typical usage (from core/python):
+  python ingest_service.py                              # http://127.0.0.1:8765
+  python ingest_service.py --unix /tmp/ingest.sock --batch-size 2000 --max-latency-ms 20
+  curl -s localhost:8765/payments -d '{"loan_id": 100042, "payment_date": "2026-05-03", "paid_amount": 412.5}'
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import json
+import math
+import os
+import signal
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from sqlalchemy import text
+
+from db_engine import get_engine
+from instrumentation import instrument
+from month_keys import BASE_YEAR, extend_dim_month
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+BATCH_SIZE = 5_000
+MAX_LATENCY_MS = 10
+MAX_PENDING = 50_000
+QUEUE_TIMEOUT = 5.0
+MAX_BODY_BYTES = 16 * 1024 * 1024
+LOAN_RELOAD_S = 30.0  # unknown loan ids re-read fct_loans at most this often
+
+ACTION_TYPES = {"SMS", "Call", "Email", "Agent", "Hardship"}
+
+# route -> (table, columns in insert order)
+TABLES = {
+    "/payments": ("fct_payments", ["loan_id", "payment_date", "payment_month_key", "paid_amount"]),
+    "/collections": ("fct_collections", ["loan_id", "event_date", "event_month_key", "action_type",
+                                         "promised_to_pay_date"]),
+}
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+
+class ValidationError(ValueError):
+    pass
+
+
+class Busy(Exception):
+    """The pending-event limit was not freed within the queue timeout."""
+
+
+# -- validation --------------------------------------------------------------------
+
+class LoanIndex:
+    """loan_id -> origination_date (ISO) for every loan in fct_loans."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.origination: dict[int, str] = {}
+        self.loaded_at = 0.0
+        self.reload()
+
+    def reload(self) -> None:
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT loan_id, origination_date FROM fct_loans")).fetchall()
+        self.origination = {int(r[0]): str(r[1])[:10] for r in rows}
+        self.loaded_at = time.monotonic()
+
+    def get(self, loan_id: int) -> str | None:
+        orig = self.origination.get(loan_id)
+        if orig is None and time.monotonic() - self.loaded_at > LOAN_RELOAD_S:
+            self.reload()  # loans booked since start-up
+            orig = self.origination.get(loan_id)
+        return orig
+
+
+def _loan(ev: dict, loans: LoanIndex) -> tuple[int, str]:
+    loan_id = ev.get("loan_id")
+    if isinstance(loan_id, bool) or not isinstance(loan_id, int):
+        raise ValidationError("loan_id must be an integer")
+    orig = loans.get(loan_id)
+    if orig is None:
+        raise ValidationError(f"unknown loan_id {loan_id}")
+    return loan_id, orig
+
+
+def _date(ev: dict, key: str, required: bool = True) -> dt.date | None:
+    value = ev.get(key)
+    if value is None and not required:
+        return None
+    try:
+        return dt.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"{key} must be an ISO date (YYYY-MM-DD)")
+
+
+def _month_key(d: dt.date) -> int:
+    return (d.year - BASE_YEAR) * 12 + d.month - 1
+
+
+def validate_payment(ev: dict, loans: LoanIndex) -> tuple:
+    loan_id, orig = _loan(ev, loans)
+    day = _date(ev, "payment_date")
+    if day.isoformat() < orig:
+        raise ValidationError(f"payment_date {day} is before origination {orig}")
+    amount = ev.get("paid_amount")
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount) or amount <= 0:
+        raise ValidationError("paid_amount must be a positive number")
+    return loan_id, day.isoformat(), _month_key(day), float(amount)
+
+
+def validate_collection(ev: dict, loans: LoanIndex) -> tuple:
+    loan_id, orig = _loan(ev, loans)
+    day = _date(ev, "event_date")
+    if day.isoformat() < orig:
+        raise ValidationError(f"event_date {day} is before origination {orig}")
+    action = ev.get("action_type")
+    if action not in ACTION_TYPES:
+        raise ValidationError(f"action_type must be one of {', '.join(sorted(ACTION_TYPES))}")
+    promised = _date(ev, "promised_to_pay_date", required=False)
+    if promised is not None and promised < day:
+        raise ValidationError("promised_to_pay_date is before event_date")
+    return loan_id, day.isoformat(), _month_key(day), action, promised.isoformat() if promised else None
+
+
+VALIDATORS = {"/payments": validate_payment, "/collections": validate_collection}
+
+
+def parse_events(body: bytes) -> list[dict]:
+    """One JSON event, a JSON array, or NDJSON."""
+    try:
+        data = json.loads(body)
+    except json.JSONDecodeError:
+        try:
+            data = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            raise ValidationError(f"body is not JSON or NDJSON: {e}")
+    events = data if isinstance(data, list) else [data]
+    if not events or not all(isinstance(e, dict) for e in events):
+        raise ValidationError("expected an event object, an array of them, or NDJSON")
+    return events
+
+
+def frozen_marts(engine) -> list[str]:
+    """Views served from DuckDB-built mv_* tables (duckdb_marts.py), which ingested events do not reach."""
+    if engine.dialect.name != "sqlite":
+        return []  # duckdb_marts.py publishes into SQLite only
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'view' AND sql LIKE '%SELECT * FROM mv\\_%' ESCAPE '\\' "
+            "ORDER BY name")).fetchall()
+    return [r[0] for r in rows]
+
+
+# -- batching ----------------------------------------------------------------------
+
+@dataclass
+class _Request:
+    table: str
+    rows: list[tuple]
+    done: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class Batcher:
+    """Queues validated rows and writes them in micro-batches, one transaction each."""
+
+    def __init__(self, engine, batch_size: int = BATCH_SIZE, max_latency_ms: float = MAX_LATENCY_MS,
+                 max_pending: int = MAX_PENDING, queue_timeout: float = QUEUE_TIMEOUT):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.queue: deque[_Request] = deque()
+        self.queued = 0      # rows in self.queue
+        self.pending = 0     # rows queued or being written
+        self.max_month_key = self._max_month_key()
+        self.stats = {"events": 0, "batches": 0, "rejected_busy": 0, "write_s": 0.0, "max_batch": 0}
+        self._wake: asyncio.Event | None = None
+        self._space: asyncio.Condition | None = None
+        self._closing = False
+
+    def _max_month_key(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT COALESCE(MAX(month_key), -1) FROM dim_month")).scalar()
+
+    async def submit(self, table: str, rows: list[tuple]) -> int:
+        """Queue rows and wait until their batch has committed."""
+        n = len(rows)
+        async with self._space:
+            try:
+                # an oversized request is admitted alone, once everything before it is written
+                await asyncio.wait_for(
+                    self._space.wait_for(lambda: self.pending == 0 or self.pending + n <= self.max_pending),
+                    self.queue_timeout,
+                )
+            except asyncio.TimeoutError:
+                self.stats["rejected_busy"] += n
+                raise Busy()
+            self.pending += n
+        req = _Request(table, rows, asyncio.get_running_loop().create_future())
+        self.queue.append(req)
+        self.queued += n
+        self._wake.set()
+        return await req.done
+
+    def _take(self) -> list[_Request]:
+        """Whole requests up to batch_size rows (at least one request)."""
+        batch, rows = [], 0
+        while self.queue and (not batch or rows + len(self.queue[0].rows) <= self.batch_size):
+            req = self.queue.popleft()
+            batch.append(req)
+            rows += len(req.rows)
+        self.queued -= rows
+        return batch
+
+    def _write(self, batch: list[_Request]) -> int:
+        """Insert a batch in one transaction (runs in a worker thread)."""
+        by_table: dict[str, list[tuple]] = {}
+        for req in batch:
+            by_table.setdefault(req.table, []).extend(req.rows)
+        # month key is the third column of both tables
+        top = max(r[2] for rows in by_table.values() for r in rows)
+        with self.engine.begin() as conn:
+            for route, rows in by_table.items():
+                table, cols = TABLES[route]
+                conn.execute(
+                    text(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join(':' + c for c in cols)})"),
+                    [dict(zip(cols, r)) for r in rows],
+                )
+            if top > self.max_month_key:
+                # same transaction: a failure rolls the batch back, so a 500 never covers stored rows
+                extend_dim_month(conn)
+        if top > self.max_month_key:
+            self.max_month_key = self._max_month_key()
+        return sum(len(rows) for rows in by_table.values())
+
+    async def run(self) -> None:
+        """Writer loop; returns after close() once the queue is drained."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.queue:
+                if self._closing:
+                    return
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            wait = self.queue[0].queued_at + self.max_latency - time.monotonic()
+            if self.queued < self.batch_size and wait > 0 and not self._closing:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            batch = self._take()
+            t0 = time.perf_counter()
+            try:
+                n = await loop.run_in_executor(None, self._write, batch)
+            except Exception as e:  # the whole batch failed: every request in it gets the error
+                n = 0
+                for req in batch:
+                    req.done.set_exception(e)
+            else:
+                for req in batch:
+                    req.done.set_result(len(req.rows))
+                self.stats["events"] += n
+                self.stats["batches"] += 1
+                self.stats["max_batch"] = max(self.stats["max_batch"], n)
+            self.stats["write_s"] += time.perf_counter() - t0
+            async with self._space:
+                self.pending -= sum(len(r.rows) for r in batch)
+                self._space.notify_all()
+
+    async def start(self) -> asyncio.Task:
+        self._wake = asyncio.Event()
+        self._space = asyncio.Condition()
+        return asyncio.get_running_loop().create_task(self.run())
+
+    def close(self) -> None:
+        self._closing = True
+        self._wake.set()
+
+    def snapshot(self) -> dict:
+        s = dict(self.stats)
+        s["pending"] = self.pending
+        s["queued"] = self.queued
+        s["avg_batch"] = round(s["events"] / s["batches"], 1) if s["batches"] else 0.0
+        s["avg_write_ms"] = round(1000 * s["write_s"] / s["batches"], 2) if s["batches"] else 0.0
+        s["write_s"] = round(s["write_s"], 3)
+        return s
+
+
+# -- HTTP --------------------------------------------------------------------------
+
+class IngestServer:
+    """Minimal HTTP/1.1 (keep-alive, Content-Length bodies) over TCP or a Unix socket."""
+
+    def __init__(self, batcher: Batcher, loans: LoanIndex, frozen: list[str] | None = None):
+        self.batcher = batcher
+        self.loans = loans
+        self.frozen = frozen or []
+        self.rejected = 0
+        self.started = time.monotonic()
+
+    async def route(self, method: str, path: str, body: bytes) -> tuple[int, dict, dict]:
+        path = path.split("?", 1)[0]
+        if path == "/stats":
+            if method != "GET":
+                return 405, {"error": "use GET"}, {}
+            return 200, {**self.batcher.snapshot(), "rejected_invalid": self.rejected,
+                         "loans": len(self.loans.origination),
+                         "marts_stale": bool(self.frozen) and self.batcher.stats["events"] > 0,
+                         "uptime_s": round(time.monotonic() - self.started, 1)}, {}
+        validator = VALIDATORS.get(path)
+        if validator is None:
+            return 404, {"error": f"unknown path {path}"}, {}
+        if method != "POST":
+            return 405, {"error": "use POST"}, {}
+        try:
+            events = parse_events(body)
+        except ValidationError as e:
+            return 400, {"error": str(e)}, {}
+        rows, errors = [], []
+        for i, ev in enumerate(events):
+            try:
+                rows.append(validator(ev, self.loans))
+            except ValidationError as e:
+                errors.append({"index": i, "error": str(e)})
+        if errors:
+            self.rejected += len(events)
+            return 422, {"accepted": 0, "errors": errors[:100]}, {}
+        try:
+            n = await self.batcher.submit(path, rows)
+        except Busy:
+            return 503, {"error": "ingest queue full, retry later"}, {"Retry-After": "1"}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}, {}
+        return 200, {"accepted": n}, {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, path, version = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length") or 0)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                if length > MAX_BODY_BYTES:
+                    status, payload, extra = 413, {"error": f"body over {MAX_BODY_BYTES:,} bytes"}, {}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload, extra = await self.route(method.upper(), path, body)
+                data = json.dumps(payload).encode()
+                head = [f"HTTP/1.1 {status} {REASONS[status]}", "Content-Type: application/json",
+                        f"Content-Length: {len(data)}"]
+                head += [f"{k}: {v}" for k, v in extra.items()]
+                if not keep_alive:
+                    head.append("Connection: close")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # client went away or sent something that is not HTTP
+        finally:
+            writer.close()
+
+
+async def serve(engine, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, unix: str | None = None,
+                batch_size: int = BATCH_SIZE, max_latency_ms: float = MAX_LATENCY_MS,
+                max_pending: int = MAX_PENDING, queue_timeout: float = QUEUE_TIMEOUT,
+                ready: threading.Event | None = None, stop: asyncio.Event | None = None) -> dict:
+    """Run until SIGINT / SIGTERM (or `stop` is set), drain the queue, return the final stats."""
+    loans = LoanIndex(engine)
+    batcher = Batcher(engine, batch_size, max_latency_ms, max_pending, queue_timeout)
+    writer_task = await batcher.start()
+    app = IngestServer(batcher, loans, frozen_marts(engine))
+    if unix:
+        if os.path.exists(unix):
+            os.unlink(unix)
+        server = await asyncio.start_unix_server(app.handle, path=unix)
+        where = f"unix:{unix}"
+    else:
+        server = await asyncio.start_server(app.handle, host, port)
+        where = "http://{}:{}".format(*server.sockets[0].getsockname()[:2])
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows, or not the main thread
+            pass
+    print(f"Ingesting on {where}: {len(loans.origination):,} loans, batch {batch_size:,} / "
+          f"{max_latency_ms:g} ms, max pending {max_pending:,}")
+    if app.frozen:
+        print(f"Note: {len(app.frozen)} marts are DuckDB-built tables; events written here do not reach them "
+              f"until duckdb_marts.py is run again")
+    if ready is not None:
+        ready.set()
+    async with server:
+        await stop.wait()
+        server.close()
+        await server.wait_closed()
+    batcher.close()
+    await writer_task
+    if unix and os.path.exists(unix):
+        os.unlink(unix)
+    return {**batcher.snapshot(), "rejected_invalid": app.rejected,
+            "marts_stale": bool(app.frozen) and batcher.stats["events"] > 0}
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-batched local ingestion of payment and collection events.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Listen address (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Listen port (default: {DEFAULT_PORT})")
+    parser.add_argument("--unix", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help=f"Events per transaction (default: {BATCH_SIZE})")
+    parser.add_argument("--max-latency-ms", type=float, default=MAX_LATENCY_MS,
+                        help=f"Longest an event waits for its batch to fill (default: {MAX_LATENCY_MS})")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help=f"Events queued or being written before requests wait (default: {MAX_PENDING})")
+    parser.add_argument("--queue-timeout", type=float, default=QUEUE_TIMEOUT,
+                        help=f"Seconds a request waits for queue space before 503 (default: {QUEUE_TIMEOUT:g})")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    engine = get_engine()
+    with instrument("ingest_service") as rec:
+        stats = asyncio.run(serve(engine, args.host, args.port, args.unix, args.batch_size, args.max_latency_ms,
+                                  args.max_pending, args.queue_timeout))
+        rec.record("write", stats["write_s"], stats["events"], stats["batches"])
+    print(f"Ingested {stats['events']:,} events in {stats['batches']:,} batches "
+          f"(avg {stats['avg_batch']:,}, {stats['avg_write_ms']} ms per commit); "
+          f"rejected {stats['rejected_invalid']:,} invalid, {stats['rejected_busy']:,} busy")
+    if stats["marts_stale"]:
+        print("The DuckDB-built marts do not include these events: rebuild them with python duckdb_marts.py")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
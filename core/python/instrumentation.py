@@ -0,0 +1,234 @@
+"""
+Per-stage metrics for the pipeline scripts: wall time, CPU time, peak RSS,
+rows processed and DB round-trips, for the stage and each named step in it.
+
+  from instrumentation import instrument
+
+  with instrument("load_data") as rec:
+      with rec.step("fct_loans") as s:
+          df = ...
+          s.rows = len(df)
+
+Every instrumented script prints a step table when it finishes. Environment
+variables switch on the rest, so they also reach stages run by run_pipeline.py:
+
+  METRICS_DIR=path     write <stage>.json (or .csv with METRICS_FORMAT=csv) there
+  PROFILE=cprofile     dump <stage>.prof (pstats) to METRICS_DIR or the cwd
+  PROFILE=pyinstrument write <stage>.html (needs `pip install pyinstrument`)
+
+DB round-trips are SQLAlchemy cursor executions on the current thread (the
+listener is attached to every Engine); code that drives a raw DBAPI cursor,
+like run_sql.py, adds its own count with `count_db_calls(n)`. CPU time is
+process-wide, so steps running concurrently in other threads inflate it.
+Peak RSS is the process high-water mark when the step ends; `peak_rss_delta_mb`
+is how much that step raised it.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@dataclass
+class StepMetrics:
+    stage: str
+    step: str
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    peak_rss_mb: float | None = None
+    peak_rss_delta_mb: float | None = None
+    rows: int | None = None
+    db_calls: int = 0
+    started_at: str = ""
+
+
+def peak_rss_mb() -> float | None:
+    """Process peak resident set size in MB (None when it can't be read)."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB elsewhere
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+
+
+# -- DB round-trips ----------------------------------------------------------------
+
+_local = threading.local()
+_listening = False
+_listen_lock = threading.Lock()
+
+
+def _count_execute(conn, cursor, statement, parameters, context, executemany):
+    _local.db_calls = getattr(_local, "db_calls", 0) + 1
+
+
+def _ensure_listener() -> None:
+    global _listening
+    with _listen_lock:
+        if not _listening:
+            event.listen(Engine, "before_cursor_execute", _count_execute)
+            _listening = True
+
+
+def count_db_calls(n: int) -> None:
+    """Add round-trips made outside SQLAlchemy to the current thread's count."""
+    _local.db_calls = getattr(_local, "db_calls", 0) + n
+
+
+def db_calls() -> int:
+    """SQLAlchemy cursor executions so far on this thread."""
+    return getattr(_local, "db_calls", 0)
+
+
+# -- recorder ----------------------------------------------------------------------
+
+class Recorder:
+    """Collects StepMetrics for one stage; steps nest as 'outer/inner'."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.steps: list[StepMetrics] = []
+        self._stack: list[str] = []
+
+    @contextmanager
+    def step(self, name: str, rows: int | None = None) -> Iterator[StepMetrics]:
+        path = "/".join(self._stack + [name])
+        m = StepMetrics(self.stage, path, rows=rows, started_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        self.steps.append(m)  # start order: a stage is listed before its steps
+        self._stack.append(name)
+        rss0 = peak_rss_mb()
+        calls0 = db_calls()
+        t0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield m
+        finally:
+            m.wall_s = time.perf_counter() - t0
+            m.cpu_s = time.process_time() - c0
+            m.db_calls += db_calls() - calls0
+            m.peak_rss_mb = peak_rss_mb()
+            if rss0 is not None and m.peak_rss_mb is not None:
+                m.peak_rss_delta_mb = m.peak_rss_mb - rss0
+            self._stack.pop()
+
+    def record(self, name: str, wall_s: float, rows: int | None = None, db_calls: int = 0) -> StepMetrics:
+        """Add a step timed elsewhere, e.g. in a worker thread (no CPU figure)."""
+        m = StepMetrics(self.stage, "/".join(self._stack + [name]), wall_s=wall_s, rows=rows, db_calls=db_calls,
+                        peak_rss_mb=peak_rss_mb(), started_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        self.steps.append(m)
+        return m
+
+    def summary(self) -> str:
+        w = max([len(s.step) for s in self.steps] + [4]) + 2
+        lines = [f"{'step':<{w}}{'wall s':>9}{'cpu s':>9}{'peak MB':>9}{'rows':>12}{'db':>7}"]
+        for s in self.steps:
+            rss = "" if s.peak_rss_mb is None else f"{s.peak_rss_mb:.0f}"
+            rows = "" if s.rows is None else f"{s.rows:,}"
+            lines.append(f"{s.step:<{w}}{s.wall_s:>9.2f}{s.cpu_s:>9.2f}{rss:>9}{rows:>12}{s.db_calls:>7}")
+        return "\n".join(lines)
+
+    def write(self, path: Path | str) -> Path:
+        """Write the steps to JSON, or CSV when the path ends in .csv."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rows = [asdict(s) for s in self.steps]
+        if path.suffix.lower() == ".csv":
+            import csv
+
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                w = csv.DictWriter(f, fieldnames=list(StepMetrics.__dataclass_fields__))
+                w.writeheader()
+                w.writerows(rows)
+        else:
+            path.write_text(json.dumps(rows, indent=2), encoding="utf-8")
+        return path
+
+
+# -- profilers ---------------------------------------------------------------------
+
+_profiling = threading.Lock()  # held while a profile is recorded
+
+
+@contextmanager
+def _profiled(kind: str | None, out_base: Path) -> Iterator[None]:
+    # only one profiler can be active per process: nested or concurrent
+    # instrumented stages are covered by the profile already running
+    if not kind or not _profiling.acquire(blocking=False):
+        yield
+        return
+    try:
+        with _profiled_locked(kind.lower(), out_base):
+            yield
+    finally:
+        _profiling.release()
+
+
+@contextmanager
+def _profiled_locked(kind: str, out_base: Path) -> Iterator[None]:
+    if kind == "cprofile":
+        import cProfile
+
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            out_base.parent.mkdir(parents=True, exist_ok=True)
+            prof.dump_stats(out_base.with_suffix(".prof"))
+            print(f"Saved profile: {out_base.with_suffix('.prof')}")
+    elif kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise SystemExit("PROFILE=pyinstrument needs `pip install pyinstrument`")
+        prof = Profiler()
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            out_base.parent.mkdir(parents=True, exist_ok=True)
+            out_base.with_suffix(".html").write_text(prof.output_html(), encoding="utf-8")
+            print(f"Saved profile: {out_base.with_suffix('.html')}")
+    else:
+        raise SystemExit(f"Unknown PROFILE={kind!r}; use cprofile or pyinstrument")
+
+
+@contextmanager
+def instrument(stage: str) -> Iterator[Recorder]:
+    """
+    Record a whole stage as step `stage`, print the step table, and write
+    metrics / profiles as requested by METRICS_DIR, METRICS_FORMAT and PROFILE.
+    """
+    _ensure_listener()
+    rec = Recorder(stage)
+    out_dir = Path(os.getenv("METRICS_DIR") or ".")
+    try:
+        with _profiled(os.getenv("PROFILE"), out_dir / stage):
+            with rec.step(stage):
+                yield rec
+    finally:
+        print(f"\n[{stage}] metrics\n{rec.summary()}")
+        if os.getenv("METRICS_DIR"):
+            ext = ".csv" if os.getenv("METRICS_FORMAT", "json").lower() == "csv" else ".json"
+            print(f"Saved metrics: {rec.write(out_dir / f'{stage}{ext}')}")
@@ -0,0 +1,355 @@
+"""
+Approximate portfolio KPIs from a persisted stratified loan sample.
+
+Loans are stratified by product_type x channel x vintage (origination month).
+In each stratum the sample takes --fraction of the loans, at least
+--min-per-stratum (all of them in small strata). Loans are picked in a fixed
+pseudo-random order of loan_id, so the sample is stable between runs. The
+sampled loans' snapshot rows are read once per loaded book and saved with the
+sample to core/data/kpi_sample.npz. Drafts then never scan the marts.
+
+Estimates are weighted by N_h / n_h, using the usual stratified estimators:
+- rates (30+/60+/90+, vintage 60+) are ratio estimates with a linearised
+  variance;
+- counts (loans, migrations, DPD mix) and balances are estimates of totals.
+Both use the finite-population correction and come with 95% confidence
+intervals. With --fraction 1 every loan is sampled, the estimates equal the
+mart figures and the intervals have zero width.
+
+  sample = load_sample(get_engine(read_only=True))
+  sample.rates(by=["month"])                         # rate_30p, rate_30p_lo, rate_30p_hi, ...
+  sample.rates(by=["product_type"], month="2024-06-30")
+  sample.migration()                                 # from_bucket x to_bucket counts
+  sample.vintage_curves()                            # 60+ rate by vintage x months on books
+
+Typical usage (from core/python):
+  python kpi_sample.py                               # build / load, latest month by product
+  python kpi_sample.py --fraction 0.02 --min-per-stratum 3 --rebuild
+  python kpi_sample.py --compare                     # monthly and per-vintage estimates vs the exact mart rates
+  python create_report.py --approx                   # report and charts from the sample
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from db_engine import get_engine
+from month_keys import month_end_from_key, month_key
+from portfolio_cube import BUCKETS, DELINQUENT, book_fingerprint
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_SAMPLE_PATH = ROOT_DIR / "core" / "data" / "kpi_sample.npz"
+
+DEFAULT_FRACTION = 0.05
+MIN_PER_STRATUM = 5
+Z = 1.959964  # two-sided 95%
+DIMS = ["month", "product_type", "channel", "vintage", "months_on_books", "dpd_bucket"]
+
+LOANS_SQL = "SELECT loan_id, product_type, channel, orig_month_key FROM fct_loans"
+ROWS_SQL = "SELECT loan_id, month_key, dpd_bucket{balance} FROM {view}"
+READ_CHUNK = 200_000
+
+
+def select_sample(loans: pd.DataFrame, fraction: float, min_per_stratum: int) -> tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """(sampled loan_ids sorted, their stratum codes, strata table with N and n)."""
+    strata_keys = ["product_type", "channel", "orig_month_key"]
+    h = loans.groupby(strata_keys, sort=True).ngroup().to_numpy()
+    strata = loans.groupby(strata_keys, sort=True).size().rename("N").reset_index()
+    N = strata["N"].to_numpy()
+    n = np.minimum(N, np.maximum(min_per_stratum, np.ceil(fraction * N).astype(np.int64)))
+    strata["n"] = n
+    ids = loans["loan_id"].to_numpy(dtype=np.int64)
+    scramble = (ids.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2**32)
+    order = np.lexsort((scramble, h))
+    first = np.r_[0, np.cumsum(N)[:-1]]
+    rank = np.empty(len(ids), dtype=np.int64)
+    rank[order] = np.arange(len(ids)) - first[h[order]]
+    keep = rank < n[h]
+    chosen = np.argsort(ids[keep], kind="stable")
+    return ids[keep][chosen], h[keep][chosen], strata
+
+
+class KpiSample:
+    """Sampled loans with their strata and snapshot rows, plus the estimators."""
+
+    def __init__(self, loan_ids: np.ndarray, stratum: np.ndarray, strata: pd.DataFrame,
+                 row_slot: np.ndarray, row_month: np.ndarray, row_bucket: np.ndarray, row_balance: np.ndarray,
+                 fingerprint: str = ""):
+        self.loan_ids = loan_ids        # sorted sampled loan_ids
+        self.stratum = stratum          # stratum code per sampled loan
+        self.strata = strata            # product_type, channel, orig_month_key, N, n
+        self.row_slot = row_slot        # snapshot rows: index into loan_ids, sorted by (slot, month)
+        self.row_month = row_month
+        self.row_bucket = row_bucket    # code into BUCKETS
+        self.row_balance = row_balance  # eop_balance (NaN when the snapshot has none)
+        self.fingerprint = fingerprint
+        self.N = strata["N"].to_numpy(dtype=np.float64)
+        self.n = strata["n"].to_numpy(dtype=np.float64)
+        self.row_stratum = stratum[row_slot]
+
+    @classmethod
+    def build(cls, engine, fraction: float = DEFAULT_FRACTION, min_per_stratum: int = MIN_PER_STRATUM,
+              fingerprint: str = "") -> "KpiSample":
+        loans = pd.read_sql_query(text(LOANS_SQL), engine)
+        ids, stratum, strata = select_sample(loans, fraction, min_per_stratum)
+        try:
+            chunks = pd.read_sql_query(text(ROWS_SQL.format(view="mart_portfolio_snapshot_v2", balance=", eop_balance")),
+                                       engine, chunksize=READ_CHUNK)
+            parts = [c[np.isin(c["loan_id"].to_numpy(), ids)] for c in chunks]
+        except Exception:
+            chunks = pd.read_sql_query(text(ROWS_SQL.format(view="mart_portfolio_snapshot", balance="")),
+                                       engine, chunksize=READ_CHUNK)
+            parts = [c[np.isin(c["loan_id"].to_numpy(), ids)] for c in chunks]
+        rows = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["loan_id", "month_key", "dpd_bucket"])
+        slot = np.searchsorted(ids, rows["loan_id"].to_numpy(dtype=np.int64))
+        months = rows["month_key"].to_numpy(dtype=np.int32)
+        order = np.lexsort((months, slot))
+        bucket = pd.Categorical(rows["dpd_bucket"], categories=BUCKETS).codes.astype(np.int8)
+        balance = rows["eop_balance"].to_numpy(dtype=np.float64) if "eop_balance" in rows else np.full(len(rows), np.nan)
+        return cls(ids, stratum, strata, slot[order].astype(np.int32), months[order], bucket[order], balance[order],
+                   fingerprint)
+
+    # -- state -------------------------------------------------------------
+
+    def save(self, path: Path | str = DEFAULT_SAMPLE_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path, loan_ids=self.loan_ids, stratum=self.stratum, row_slot=self.row_slot, row_month=self.row_month,
+            row_bucket=self.row_bucket, row_balance=self.row_balance, fingerprint=np.array(self.fingerprint),
+            strata_product=self.strata["product_type"].to_numpy(dtype=str),
+            strata_channel=self.strata["channel"].to_numpy(dtype=str),
+            strata_vintage=self.strata["orig_month_key"].to_numpy(dtype=np.int32),
+            strata_N=self.strata["N"].to_numpy(dtype=np.int64), strata_n=self.strata["n"].to_numpy(dtype=np.int64))
+
+    @classmethod
+    def load(cls, path: Path | str = DEFAULT_SAMPLE_PATH) -> "KpiSample":
+        with np.load(Path(path), allow_pickle=False) as z:
+            strata = pd.DataFrame({"product_type": z["strata_product"].astype(object),
+                                   "channel": z["strata_channel"].astype(object),
+                                   "orig_month_key": z["strata_vintage"], "N": z["strata_N"], "n": z["strata_n"]})
+            return cls(z["loan_ids"], z["stratum"], strata, z["row_slot"], z["row_month"], z["row_bucket"],
+                       z["row_balance"], str(z["fingerprint"]))
+
+    # -- estimators ----------------------------------------------------------
+
+    @property
+    def has_balance(self) -> bool:
+        return bool(len(self.row_balance)) and not np.isnan(self.row_balance).all()
+
+    def _pairs(self, g: np.ndarray, h: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The (group, stratum) pairs present, and each unit's pair index; absent pairs contribute nothing."""
+        H = len(self.N)
+        uniq, inv = np.unique(g.astype(np.int64) * H + h, return_inverse=True)
+        return uniq // H, uniq % H, inv
+
+    def _variance(self, pg, ph, s_e: np.ndarray, s_ee: np.ndarray, G: int) -> np.ndarray:
+        """Stratified variance of a total per group, from per-pair sums of e and e^2 over sampled units."""
+        N, n = self.N[ph], self.n[ph]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            s2 = np.where(n > 1, (s_ee - s_e**2 / n) / (n - 1), 0.0)
+        return np.bincount(pg, weights=np.clip(s2, 0, None) * N**2 * (1 - n / N) / n, minlength=G)
+
+    def _total(self, pairs, y: np.ndarray, G: int) -> tuple[np.ndarray, np.ndarray]:
+        pg, ph, inv = pairs
+        s_y = np.bincount(inv, weights=y, minlength=len(pg))
+        s_yy = np.bincount(inv, weights=y * y, minlength=len(pg))
+        est = np.bincount(pg, weights=s_y * (self.N / self.n)[ph], minlength=G)
+        return est, np.sqrt(self._variance(pg, ph, s_y, s_yy, G))
+
+    def _ratio(self, pairs, y: np.ndarray, x: np.ndarray, G: int) -> tuple[np.ndarray, np.ndarray]:
+        pg, ph, inv = pairs
+        w = (self.N / self.n)[ph]
+        s_y, s_x, s_yy, s_xy, s_xx = (np.bincount(inv, weights=v, minlength=len(pg)) for v in (y, x, y * y, x * y, x * x))
+        t_y = np.bincount(pg, weights=s_y * w, minlength=G)
+        t_x = np.bincount(pg, weights=s_x * w, minlength=G)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            r = t_y / t_x
+            rp = r[pg]
+            var = self._variance(pg, ph, s_y - rp * s_x, s_yy - 2 * rp * s_xy + rp**2 * s_xx, G) / t_x**2
+        return r, np.sqrt(var)
+
+    def _row_dims(self) -> dict[str, np.ndarray]:
+        st = self.strata
+        vintage = st["orig_month_key"].to_numpy()[self.row_stratum]
+        return {
+            "month": self.row_month,
+            "product_type": st["product_type"].to_numpy()[self.row_stratum],
+            "channel": st["channel"].to_numpy()[self.row_stratum],
+            "vintage": vintage,
+            "months_on_books": self.row_month - vintage,
+            "dpd_bucket": np.array(BUCKETS, dtype=object)[self.row_bucket],
+        }
+
+    def rates(self, by: Iterable[str] = ("month",), month: str | None = None) -> pd.DataFrame:
+        """
+        Estimated loans, 30+/60+/90+ rates and EOP balance (with _lo / _hi 95%
+        bounds) per combination of `by` (DIMS), optionally for one month_end.
+        "loans" counts loan-months, i.e. loans when `month` is in `by`. A loan
+        is the sampled unit: its rows in a group are summed before the variance,
+        so a grouping without month gets the loan-clustered interval.
+        """
+        by = list(by)
+        unknown = [d for d in by if d not in DIMS]
+        if unknown:
+            raise KeyError(f"unknown dimension {', '.join(unknown)}; use one of {', '.join(DIMS)}")
+        dims = self._row_dims()
+        mask = np.ones(len(self.row_month), dtype=bool)
+        if month is not None:
+            mask = self.row_month == int(month_key([month])[0])
+        keys = pd.DataFrame({d: dims[d][mask] for d in by}) if by else pd.DataFrame(index=np.arange(mask.sum()))
+        g = keys.groupby(by, sort=True).ngroup().to_numpy() if by else np.zeros(mask.sum(), dtype=np.int64)
+        groups = keys.drop_duplicates().sort_values(by).reset_index(drop=True) if by else pd.DataFrame(index=[0])
+        G = len(groups) if mask.any() else 0
+        # one unit per (group, loan), as in migration()
+        L = len(self.loan_ids)
+        units, unit = np.unique(g.astype(np.int64) * L + self.row_slot[mask], return_inverse=True)
+        pairs = self._pairs(units // L, self.stratum[units % L])
+
+        def per_unit(v: np.ndarray) -> np.ndarray:
+            return np.bincount(unit, weights=v, minlength=len(units))
+
+        one = per_unit(np.ones(mask.sum()))
+
+        out = groups.iloc[:G].copy()
+        if "month" in out:
+            out["month"] = month_end_from_key(out["month"].to_numpy()) if G else []
+        if "vintage" in out:
+            out["vintage"] = month_end_from_key(out["vintage"].to_numpy()) if G else []
+        out["sample_rows"] = np.bincount(g, minlength=G).astype(np.int64)
+        est, se = self._total(pairs, one, G)
+        out["loans"], out["loans_lo"], out["loans_hi"] = est, np.maximum(est - Z * se, 0), est + Z * se
+        bucket = self.row_bucket[mask]
+        for name, codes in DELINQUENT.items():
+            r, se = self._ratio(pairs, per_unit(np.isin(bucket, codes).astype(np.float64)), one, G)
+            out[f"rate_{name}"] = r
+            out[f"rate_{name}_lo"] = np.clip(r - Z * se, 0, 1)
+            out[f"rate_{name}_hi"] = np.clip(r + Z * se, 0, 1)
+        if self.has_balance:
+            est, se = self._total(pairs, per_unit(np.nan_to_num(self.row_balance[mask])), G)
+            out["eop_balance"], out["eop_balance_lo"], out["eop_balance_hi"] = est, np.maximum(est - Z * se, 0), est + Z * se
+        return out.reset_index(drop=True)
+
+    def migration(self) -> pd.DataFrame:
+        """Estimated month-on-month bucket transitions over all months (as mart_dpd_migration summed)."""
+        L, K = len(self.loan_ids), len(BUCKETS)
+        cont = (self.row_slot[1:] == self.row_slot[:-1]) & (self.row_month[1:] == self.row_month[:-1] + 1)
+        cell = (self.row_bucket[:-1].astype(np.int64) * K + self.row_bucket[1:])[cont]
+        # one unit per (transition, loan): how often that loan made that transition
+        units, count = np.unique(cell * L + self.row_slot[1:][cont], return_counts=True)
+        c, slot = units // L, units % L
+        est, se = self._total(self._pairs(c, self.stratum[slot]), count.astype(np.float64), K * K)
+        out = pd.DataFrame({
+            "from_bucket": np.repeat(BUCKETS, K),
+            "to_bucket": np.tile(BUCKETS, K),
+            "sample_count": np.bincount(c, weights=count, minlength=K * K).astype(np.int64),
+            "loan_count": est,
+            "loan_count_lo": np.maximum(est - Z * se, 0),
+            "loan_count_hi": est + Z * se,
+        })
+        return out[out["sample_count"] > 0].reset_index(drop=True)
+
+    def vintage_curves(self) -> pd.DataFrame:
+        """Estimated 60+ rate by vintage_month x months_on_books (as mart_vintage_60plus)."""
+        df = self.rates(by=["vintage", "months_on_books"])
+        df = df[df["months_on_books"] >= 0]
+        return df.rename(columns={
+            "vintage": "vintage_month", "loans": "loan_cnt", "rate_60p": "rate_60plus",
+            "rate_60p_lo": "rate_60plus_lo", "rate_60p_hi": "rate_60plus_hi",
+        })[["vintage_month", "months_on_books", "sample_rows", "loan_cnt", "rate_60plus", "rate_60plus_lo",
+            "rate_60plus_hi"]].reset_index(drop=True)
+
+    def describe(self) -> str:
+        return (f"{len(self.loan_ids):,} of {int(self.N.sum()):,} loans ({len(self.N):,} strata), "
+                f"{len(self.row_month):,} loan-months")
+
+
+def load_sample(engine, path: Path | str | None = DEFAULT_SAMPLE_PATH, rebuild: bool = False,
+                fraction: float = DEFAULT_FRACTION, min_per_stratum: int = MIN_PER_STRATUM) -> KpiSample:
+    """The saved sample if it matches the loaded book and settings (and not `rebuild`); otherwise draw and save one."""
+    fp = f"{book_fingerprint(engine)}|{fraction}|{min_per_stratum}"
+    if path and not rebuild and Path(path).exists():
+        sample = KpiSample.load(path)
+        if sample.fingerprint == fp:
+            return sample
+    sample = KpiSample.build(engine, fraction, min_per_stratum, fp)
+    if path:
+        sample.save(path)
+    return sample
+
+
+# exact figures for compare(): group key and the join it needs
+COMPARE_BY = {
+    "month": ("s.month_end", ""),
+    "vintage": ("l.orig_month_key", "JOIN fct_loans l ON l.loan_id = s.loan_id"),
+}
+
+
+def compare(engine, sample: KpiSample, by: str = "month") -> pd.DataFrame:
+    """Estimates per month (or vintage, which spans many months per loan) next to the exact mart_portfolio_snapshot figures."""
+    key, join = COMPARE_BY[by]
+    exact = pd.read_sql_query(text(
+        f"SELECT {key} AS {by}, COUNT(*) AS exact_loans, "
+        "AVG(CASE WHEN s.dpd_bucket IN ('DPD_30_59','DPD_60_89','DPD_90_PLUS') THEN 1.0 ELSE 0 END) AS exact_30p, "
+        "AVG(CASE WHEN s.dpd_bucket IN ('DPD_60_89','DPD_90_PLUS') THEN 1.0 ELSE 0 END) AS exact_60p, "
+        "AVG(CASE WHEN s.dpd_bucket = 'DPD_90_PLUS' THEN 1.0 ELSE 0 END) AS exact_90p "
+        f"FROM mart_portfolio_snapshot s {join} GROUP BY {key}"), engine)
+    if by == "vintage":
+        exact["vintage"] = month_end_from_key(exact["vintage"].to_numpy())
+    return sample.rates(by=[by]).merge(exact, on=by, how="inner")
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or load the stratified KPI sample and print estimates.")
+    parser.add_argument("--sample", default=str(DEFAULT_SAMPLE_PATH), help=f"Sample file (default: {DEFAULT_SAMPLE_PATH})")
+    parser.add_argument("--fraction", type=float, default=DEFAULT_FRACTION,
+                        help=f"Share of each stratum to sample (default: {DEFAULT_FRACTION})")
+    parser.add_argument("--min-per-stratum", type=int, default=MIN_PER_STRATUM,
+                        help=f"Minimum loans per stratum (default: {MIN_PER_STRATUM})")
+    parser.add_argument("--rebuild", action="store_true", help="Draw a new sample even if the saved one matches")
+    parser.add_argument("--compare", action="store_true", help="Compare monthly and per-vintage estimates with the exact mart rates")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    engine = get_engine(read_only=True)
+    t0 = time.perf_counter()
+    sample = load_sample(engine, args.sample, args.rebuild, args.fraction, args.min_per_stratum)
+    print(f"Sample: {sample.describe()}, ready in {time.perf_counter() - t0:.2f}s")
+    if not len(sample.row_month):
+        print("Sample is empty.")
+        return 0
+
+    if args.compare:
+        # by vintage, each loan contributes many months to a group: checks the loan-clustered intervals
+        for by in COMPARE_BY:
+            df = compare(engine, sample, by)
+            df = df[df["exact_loans"] >= 100]
+            inside = ((df["exact_loans"] >= df["loans_lo"] - 1e-9) & (df["exact_loans"] <= df["loans_hi"] + 1e-9)).mean()
+            print(f"by {by}: loans {inside:.0%} of {len(df)} inside the 95% interval")
+            for r in ("30p", "60p", "90p"):
+                inside = ((df[f"exact_{r}"] >= df[f"rate_{r}_lo"] - 1e-12) & (df[f"exact_{r}"] <= df[f"rate_{r}_hi"] + 1e-12)).mean()
+                err = (df[f"rate_{r}"] - df[f"exact_{r}"]).abs()
+                print(f"  rate_{r}: {inside:.0%} inside the 95% interval, "
+                      f"mean |error| {err.mean() * 100:.2f} pts, max {err.max() * 100:.2f} pts")
+        return 0
+
+    latest = month_end_from_key([sample.row_month.max()])[0]
+    busiest = month_end_from_key([np.bincount(sample.row_month).argmax()])[0]
+    t0 = time.perf_counter()
+    df = sample.rates(by=["product_type"], month=busiest)
+    ms = (time.perf_counter() - t0) * 1000
+    print(f"{busiest} (month with the most sampled loans; latest is {latest}):")
+    with pd.option_context("display.width", 200, "display.max_columns", 30):
+        print(df.round(4).to_string(index=False))
+    print(f"({ms:.1f} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,214 @@
+"""
+Pre-load integrity checks for the raw CSV chunks.
+
+load_data.py checks each chunk with array operations before inserting it:
+- primary keys are non-null and unique, both within the chunk and against
+  earlier chunks;
+- NOT NULL columns have no missing values;
+- foreign keys exist in the parent rows validated so far (loan_id in
+  fct_loans, customer_id in dim_customers);
+- dates are ISO YYYY-MM-DD within DATE_RANGE, and schedule, payment and
+  collection dates are not before the loan's origination_date.
+
+Rows that pass all four checks cannot break a constraint. So the load runs
+with foreign-key enforcement off (SQLite, MySQL) and checks every foreign
+key with one query at the end (verify_foreign_keys), before the transaction
+commits.
+
+  validator = LoadValidator()
+  problems = validator.check("fct_payments", chunk)   # [] when the chunk is clean
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# Must match core/sql/01_schema.sql. Fact tables without a key here get AUTOINCREMENT ids.
+PRIMARY_KEYS = {
+    "dim_customers": "customer_id",
+    "dim_products": "product_type",
+    "dim_channels": "channel",
+    "fct_loans": "loan_id",
+}
+# table -> {column: (parent table, parent column)}
+FOREIGN_KEYS = {
+    "fct_loans": {"customer_id": ("dim_customers", "customer_id")},
+    "fct_schedule": {"loan_id": ("fct_loans", "loan_id")},
+    "fct_payments": {"loan_id": ("fct_loans", "loan_id")},
+    "fct_collections": {"loan_id": ("fct_loans", "loan_id")},
+}
+# NOT NULL source columns (month keys are derived from the dates by the loader)
+NOT_NULL = {
+    "fct_loans": ["customer_id", "product_type", "origination_date", "principal_nzd",
+                  "interest_rate_apr", "term_months", "channel"],
+    "fct_schedule": ["loan_id", "installment_no", "due_date", "scheduled_amount",
+                     "scheduled_principal", "scheduled_interest"],
+    "fct_payments": ["loan_id", "payment_date", "paid_amount"],
+    "fct_collections": ["loan_id", "event_date"],
+}
+DATE_COLUMNS = {
+    "fct_loans": ["origination_date"],
+    "fct_schedule": ["due_date"],
+    "fct_payments": ["payment_date"],
+    "fct_collections": ["event_date", "promised_to_pay_date"],
+}
+# table -> date column that may not precede the loan's origination_date
+AFTER_ORIGINATION = {
+    "fct_schedule": "due_date",
+    "fct_payments": "payment_date",
+    "fct_collections": "event_date",
+}
+DATE_RANGE = ("1990-01-01", "2100-12-31")
+SAMPLE = 5  # CSV lines quoted per problem
+
+# dialect -> (read the current setting, set it to {value})
+FK_ENFORCEMENT = {
+    "sqlite": ("PRAGMA foreign_keys", "PRAGMA foreign_keys={value}"),
+    "mysql": ("SELECT @@FOREIGN_KEY_CHECKS", "SET FOREIGN_KEY_CHECKS={value}"),
+    "mariadb": ("SELECT @@FOREIGN_KEY_CHECKS", "SET FOREIGN_KEY_CHECKS={value}"),
+}
+
+
+class LoadValidationError(ValueError):
+    """Rows that would violate a constraint; .problems lists one line per check."""
+
+    def __init__(self, problems: list[str]):
+        super().__init__("\n".join(problems))
+        self.problems = problems
+
+
+def _lines(df: pd.DataFrame, mask: np.ndarray) -> str:
+    # read_csv chunks keep a running RangeIndex; +2 for the header and 1-based lines
+    idx = df.index[mask][:SAMPLE]
+    more = ", ..." if mask.sum() > SAMPLE else ""
+    return ", ".join(str(i + 2) for i in idx) + more
+
+
+def _iso_days(values: pd.Series) -> np.ndarray:
+    """ISO date strings -> days since epoch (int64); NaT (missing or malformed) -> INT64 min."""
+    parsed = pd.to_datetime(values, format="%Y-%m-%d", errors="coerce")
+    return parsed.to_numpy(dtype="datetime64[D]").astype(np.int64)
+
+
+_NAT = np.datetime64("NaT", "D").astype(np.int64)
+_LO, _HI = (np.datetime64(d, "D").astype(np.int64) for d in DATE_RANGE)
+
+
+class LoadValidator:
+    """Checks chunks table by table (parents first) and remembers the primary keys seen so far."""
+
+    def __init__(self):
+        self.keys: dict[str, np.ndarray] = {}       # table -> sorted unique primary keys loaded so far
+        self._origination: np.ndarray | None = None  # origination days aligned with keys["fct_loans"]
+
+    def check(self, table: str, df: pd.DataFrame) -> list[str]:
+        """Problems in this chunk (empty when it is clean); its new keys are recorded either way."""
+        problems: list[str] = []
+        required = list(NOT_NULL.get(table, []))
+        pk = PRIMARY_KEYS.get(table)
+        if pk:
+            required.insert(0, pk)
+        missing = [c for c in required if c not in df.columns]
+        if missing:
+            return [f"{table}: missing column(s) {', '.join(missing)}"]
+
+        for col in required:
+            null = df[col].isna().to_numpy()
+            if null.any():
+                problems.append(f"{table}: {null.sum():,} rows with NULL {col} (lines {_lines(df, null)})")
+
+        fresh = None
+        if pk:
+            keys = df[pk].to_numpy()
+            dup = df[pk].duplicated(keep="first").to_numpy()
+            if table in self.keys:
+                dup |= np.isin(keys, self.keys[table])
+            if dup.any():
+                problems.append(f"{table}: {dup.sum():,} rows with duplicate {pk} (lines {_lines(df, dup)})")
+            fresh = ~dup & df[pk].notna().to_numpy()
+
+        for col, (parent, _) in FOREIGN_KEYS.get(table, {}).items():
+            if col not in df.columns:
+                continue
+            orphan = ~np.isin(df[col].to_numpy(), self.keys.get(parent, np.empty(0))) & df[col].notna().to_numpy()
+            if orphan.any():
+                problems.append(f"{table}: {orphan.sum():,} rows with {col} not in {parent} (lines {_lines(df, orphan)})")
+
+        days: dict[str, np.ndarray] = {}
+        for col in DATE_COLUMNS.get(table, []):
+            if col not in df.columns:
+                continue
+            d = days[col] = _iso_days(df[col])
+            bad = df[col].notna().to_numpy() & ((d == _NAT) | (d < _LO) | (d > _HI))
+            if bad.any():
+                problems.append(f"{table}: {bad.sum():,} rows with {col} not an ISO date in "
+                                f"{DATE_RANGE[0]}..{DATE_RANGE[1]} (lines {_lines(df, bad)})")
+
+        col = AFTER_ORIGINATION.get(table)
+        if col in days and self._origination is not None:
+            loan_keys = self.keys["fct_loans"]
+            ids = df["loan_id"].to_numpy()
+            pos = np.clip(np.searchsorted(loan_keys, ids), 0, max(len(loan_keys) - 1, 0))
+            found = (loan_keys[pos] == ids) if len(loan_keys) else np.zeros(len(ids), dtype=bool)
+            early = found & (days[col] != _NAT) & (days[col] < self._origination[pos])
+            if early.any():
+                problems.append(f"{table}: {early.sum():,} rows with {col} before the loan's "
+                                f"origination_date (lines {_lines(df, early)})")
+
+        if fresh is not None:
+            # new keys are remembered even from a bad chunk, so --check-only reports
+            # the bad rows themselves rather than every child of the chunk
+            self._record(table, df, days, fresh)
+        return problems
+
+    def _record(self, table: str, df: pd.DataFrame, days: dict[str, np.ndarray], fresh: np.ndarray) -> None:
+        keys = df[PRIMARY_KEYS[table]].to_numpy()[fresh]
+        if table == "fct_loans":
+            keys, orig = keys.astype(np.int64), days["origination_date"][fresh]
+            if self._origination is not None:
+                keys = np.concatenate([self.keys[table], keys])
+                orig = np.concatenate([self._origination, orig])
+            order = np.argsort(keys, kind="stable")
+            self.keys[table], self._origination = keys[order], orig[order]
+            return
+        self.keys[table] = np.union1d(self.keys[table], keys) if table in self.keys else np.unique(keys)
+
+
+def verify_foreign_keys(conn) -> list[str]:
+    """Every FOREIGN_KEYS reference checked against the loaded tables in one query."""
+    parts = [
+        f"SELECT '{table}.{col} -> {parent}' AS fk, COUNT(*) AS n FROM {table} c "
+        f"WHERE c.{col} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {parent} p WHERE p.{pcol} = c.{col})"
+        for table, cols in FOREIGN_KEYS.items()
+        for col, (parent, pcol) in cols.items()
+    ]
+    rows = conn.execute(text(" UNION ALL ".join(parts))).fetchall()
+    return [f"{fk}: {n:,} orphan rows" for fk, n in rows if n]
+
+
+@contextmanager
+def foreign_keys_relaxed(conn):
+    """
+    Foreign-key enforcement off on this connection (SQLite, MySQL) until exit,
+    then back to its previous setting. Call outside a transaction: SQLite ignores
+    the pragma inside one. Other dialects keep enforcing.
+    """
+    statements = FK_ENFORCEMENT.get(conn.dialect.name)
+    if statements is None:
+        yield
+        return
+    read, write = statements
+    previous = int(conn.execute(text(read)).scalar() or 0)
+    conn.execute(text(write.format(value=0)))
+    conn.commit()
+    try:
+        yield
+    finally:
+        if conn.in_transaction():
+            conn.rollback()
+        conn.execute(text(write.format(value=previous)))
+        conn.commit()
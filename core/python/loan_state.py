@@ -0,0 +1,457 @@
+"""
+Streaming loan-state engine: arrears and DPD per loan, updated per event.
+
+mart_loan_arrears / mart_loan_dpd_bucket recompute arrears from the whole
+payment history every time they are read. This keeps the same state per
+loan in NumPy arrays and updates it as events arrive, so the intraday
+arrears status is available without running a mart:
+
+  cum_scheduled, cum_paid   running sums (as in mart_loan_arrears)
+  arrears_amt, missed_inst  rounded to cents / 6 decimals
+  dpd_bucket                same thresholds as mart_loan_dpd_bucket
+
+Events, each O(1):
+  add_instalment(loan_id, due_month_key, amount)   a schedule row, known at booking;
+                                                   it counts once its month is reached
+  apply_payment(loan_id, payment_month_key, amount)
+  advance_to(month_key)                            moves the clock; instalments falling due are added
+
+As in the marts, a payment only counts when the loan has an instalment due in
+its month, and avg_inst is the mean of all the loan's instalments. The state
+at month M equals the mart rows for month_key M: the loans with an instalment
+due in M. Matured loans keep their final state and are counted separately.
+
+The state is checkpointed to core/data/loan_state.npz (uncompressed, so a
+restore is a few array reads) together with the last schedule_id / payment_id
+applied, and a refresh only reads rows after those. The checkpoint also holds
+the row count, id range and amount total of the rows at or below those
+watermarks. load_data.py re-inserts every fact row under new ids, so after a
+reload (or a deleted or changed row) these no longer match and the state is
+rebuilt from all events and checked against the mart instead of adding the
+reloaded rows on top.
+
+Typical usage (from core/python):
+  python loan_state.py                     # restore, apply new rows, save, print the bucket mix
+  python loan_state.py --loan 100042       # one loan's current state
+  python loan_state.py --rebuild --verify  # replay from scratch, compare with mart_loan_dpd_bucket
+  python loan_state.py --as-of 2025-06 --verify --no-save
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import time
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from db_engine import get_engine
+from month_keys import month_end_from_key, month_key
+from vintage_engine import loans_fingerprint
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_STATE_PATH = ROOT_DIR / "core" / "data" / "loan_state.npz"
+
+BUCKETS = ["DPD_0", "DPD_1_29", "DPD_30_59", "DPD_60_89", "DPD_90_PLUS"]
+MISSED_THRESHOLDS = (1.0, 2.0, 3.0)  # missed_inst upper bounds of DPD_1_29 .. DPD_60_89
+NO_DUE = np.iinfo(np.int32).max
+ARRAYS = ["loan_ids", "sched_total", "n_inst", "first_due", "last_due",
+          "cum_scheduled", "cum_paid", "arrears_amt", "missed_inst", "dpd"]
+
+
+def _round(x: float, digits: int) -> float:
+    """SQLite ROUND: half away from zero."""
+    f = 10.0 ** digits
+    return math.copysign(math.floor(abs(x) * f + 0.5), x) / f
+
+
+def _round_array(x: np.ndarray, digits: int) -> np.ndarray:
+    f = 10.0 ** digits
+    return np.copysign(np.floor(np.abs(x) * f + 0.5), x) / f
+
+
+class LoanStateStore:
+    """Per-loan arrears state in growable arrays, indexed by a loan_id -> slot dict."""
+
+    def __init__(self, capacity: int = 1024):
+        self.n = 0
+        self.slot: dict[int, int] = {}
+        self.loan_ids = np.zeros(capacity, dtype=np.int64)
+        self.sched_total = np.zeros(capacity)                        # sum of all instalments
+        self.n_inst = np.zeros(capacity, dtype=np.int32)
+        self.first_due = np.full(capacity, NO_DUE, dtype=np.int32)   # month keys with instalments
+        self.last_due = np.full(capacity, -1, dtype=np.int32)
+        self.cum_scheduled = np.zeros(capacity)
+        self.cum_paid = np.zeros(capacity)
+        self.arrears_amt = np.zeros(capacity)
+        self.missed_inst = np.zeros(capacity)
+        self.dpd = np.zeros(capacity, dtype=np.int8)                 # index into BUCKETS
+        # instalments not yet due: month key -> [(slots, amounts), ...]
+        self.pending: dict[int, list[tuple[np.ndarray, np.ndarray]]] = {}
+        self.as_of = -1                                              # clock (month key)
+        self.last_schedule_id = 0
+        self.last_payment_id = 0
+        self.events = 0
+        self.ignored_payments = 0                                    # outside the loan's due months
+        self.fingerprint = ""                                        # loans_fingerprint
+        self.marks = ""                                              # applied_marks at the watermarks
+        self.source_changed = False                                  # checkpoint discarded as stale
+
+    # -- slots -------------------------------------------------------------
+
+    def _grow(self, need: int) -> None:
+        cap = len(self.loan_ids)
+        if need <= cap:
+            return
+        new_cap = max(need, 2 * cap)
+        for name in ARRAYS:
+            old = getattr(self, name)
+            fill = NO_DUE if name == "first_due" else (-1 if name == "last_due" else 0)
+            arr = np.full(new_cap, fill, dtype=old.dtype)
+            arr[:cap] = old
+            setattr(self, name, arr)
+
+    def _slot(self, loan_id: int) -> int:
+        i = self.slot.get(loan_id)
+        if i is None:
+            i = self.n
+            self._grow(i + 1)
+            self.loan_ids[i] = loan_id
+            self.slot[loan_id] = i
+            self.n += 1
+        return i
+
+    def _slots(self, loan_ids: np.ndarray) -> np.ndarray:
+        """Slots for an array of loan ids, adding unknown loans."""
+        uniq, inverse = np.unique(loan_ids, return_inverse=True)
+        get = self.slot.get
+        pos = np.fromiter((get(int(l), -1) for l in uniq), dtype=np.int64, count=len(uniq))
+        new = pos < 0
+        if new.any():
+            k = int(new.sum())
+            self._grow(self.n + k)
+            pos[new] = np.arange(self.n, self.n + k)
+            self.loan_ids[self.n:self.n + k] = uniq[new]
+            self.slot.update(zip(uniq[new].tolist(), range(self.n, self.n + k)))
+            self.n += k
+        return pos[inverse]
+
+    # -- status ------------------------------------------------------------
+
+    def _refresh_one(self, i: int) -> None:
+        arrears = _round(float(self.cum_scheduled[i] - self.cum_paid[i]), 2)
+        n = int(self.n_inst[i])
+        avg = float(self.sched_total[i]) / n if n else 1.0
+        missed = _round(max(0.0, arrears / avg), 6) if avg else math.nan
+        self.arrears_amt[i] = arrears
+        self.missed_inst[i] = missed
+        # NaN missed (zero instalment) falls through to DPD_90_PLUS, as in the mart's CASE
+        self.dpd[i] = 0 if arrears <= 0 else (len(BUCKETS) - 1 if missed != missed
+                                              else bisect_right(MISSED_THRESHOLDS, missed) + 1)
+
+    def _refresh(self, slots: np.ndarray) -> None:
+        arrears = _round_array(self.cum_scheduled[slots] - self.cum_paid[slots], 2)
+        n = self.n_inst[slots]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            avg = np.where(n > 0, self.sched_total[slots] / np.maximum(n, 1), 1.0)
+            missed = np.where(avg != 0, _round_array(np.maximum(0.0, arrears / avg), 6), np.nan)
+        self.arrears_amt[slots] = arrears
+        self.missed_inst[slots] = missed
+        bucket = np.searchsorted(MISSED_THRESHOLDS, missed, side="right") + 1  # NaN sorts last
+        self.dpd[slots] = np.where(arrears <= 0, 0, bucket)
+
+    # -- events ------------------------------------------------------------
+
+    def add_instalment(self, loan_id: int, due_month_key: int, amount: float) -> None:
+        """Register one schedule row; it is added to cum_scheduled once the clock reaches its month."""
+        i = self._slot(loan_id)
+        self.sched_total[i] += amount
+        self.n_inst[i] += 1
+        self.first_due[i] = min(int(self.first_due[i]), due_month_key)
+        self.last_due[i] = max(int(self.last_due[i]), due_month_key)
+        if due_month_key <= self.as_of:
+            self.cum_scheduled[i] += amount
+        else:
+            self.pending.setdefault(due_month_key, []).append((np.array([i]), np.array([amount])))
+        self._refresh_one(i)
+        self.events += 1
+
+    def apply_payment(self, loan_id: int, payment_month_key: int, amount: float) -> None:
+        """Apply one payment; moves the clock forward if the payment is in a later month."""
+        if payment_month_key > self.as_of:
+            self.advance_to(payment_month_key)
+        i = self._slot(loan_id)
+        self.events += 1
+        if not self.first_due[i] <= payment_month_key <= self.last_due[i]:
+            self.ignored_payments += 1
+            return
+        self.cum_paid[i] += amount
+        self._refresh_one(i)
+
+    def advance_to(self, month_key: int) -> int:
+        """Move the clock to `month_key`, adding the instalments that fall due. Returns loans touched."""
+        if month_key <= self.as_of:
+            return 0
+        due = [k for k in self.pending if k <= month_key]
+        touched = 0
+        if due:
+            chunks = [c for k in sorted(due) for c in self.pending.pop(k)]
+            slots = np.concatenate([s for s, _ in chunks])
+            amounts = np.concatenate([a for _, a in chunks])
+            np.add.at(self.cum_scheduled, slots, amounts)
+            slots = np.unique(slots)
+            self._refresh(slots)
+            touched = len(slots)
+        self.as_of = month_key
+        return touched
+
+    # -- batches (replay / catch-up) -----------------------------------------
+
+    def add_schedule(self, loan_id: np.ndarray, due_month_key: np.ndarray, amount: np.ndarray) -> None:
+        """Vectorised add_instalment for many schedule rows."""
+        if len(loan_id) == 0:
+            return
+        slots = self._slots(np.asarray(loan_id, dtype=np.int64))
+        due_month_key = np.asarray(due_month_key, dtype=np.int32)
+        amount = np.asarray(amount, dtype=np.float64)
+        np.add.at(self.sched_total, slots, amount)
+        np.add.at(self.n_inst, slots, 1)
+        np.minimum.at(self.first_due, slots, due_month_key)
+        np.maximum.at(self.last_due, slots, due_month_key)
+        now = due_month_key <= self.as_of
+        np.add.at(self.cum_scheduled, slots[now], amount[now])
+        later = ~now
+        if later.any():
+            keys, s, a = due_month_key[later], slots[later], amount[later]
+            order = np.argsort(keys, kind="stable")
+            keys, s, a = keys[order], s[order], a[order]
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            for k, lo, hi in zip(keys[starts], starts, np.r_[starts[1:], len(keys)]):
+                self.pending.setdefault(int(k), []).append((s[lo:hi], a[lo:hi]))
+        self._refresh(np.unique(slots))
+        self.events += len(slots)
+
+    def apply_payments(self, loan_id: np.ndarray, payment_month_key: np.ndarray, amount: np.ndarray) -> None:
+        """Vectorised apply_payment; same end state as applying the rows one by one in any order."""
+        if len(loan_id) == 0:
+            return
+        payment_month_key = np.asarray(payment_month_key, dtype=np.int32)
+        self.advance_to(int(payment_month_key.max()))
+        slots = self._slots(np.asarray(loan_id, dtype=np.int64))
+        ok = (self.first_due[slots] <= payment_month_key) & (payment_month_key <= self.last_due[slots])
+        np.add.at(self.cum_paid, slots[ok], np.asarray(amount, dtype=np.float64)[ok])
+        self._refresh(np.unique(slots[ok]))
+        self.ignored_payments += int((~ok).sum())
+        self.events += len(slots)
+
+    # -- outputs -----------------------------------------------------------
+
+    def get(self, loan_id: int) -> dict | None:
+        """Current state of one loan, or None if it has no events."""
+        i = self.slot.get(loan_id)
+        if i is None:
+            return None
+        return {
+            "loan_id": loan_id,
+            "month_key": self.as_of,
+            "cum_scheduled": float(self.cum_scheduled[i]),
+            "cum_paid": float(self.cum_paid[i]),
+            "arrears_amt": float(self.arrears_amt[i]),
+            "missed_inst": float(self.missed_inst[i]),
+            "dpd_bucket": BUCKETS[self.dpd[i]],
+        }
+
+    def _live(self) -> np.ndarray:
+        """Loans with an instalment due in the clock month (the mart's rows for it)."""
+        return (self.first_due[:self.n] <= self.as_of) & (self.as_of <= self.last_due[:self.n])
+
+    def matured(self) -> int:
+        """Loans whose last instalment fell due before the clock month."""
+        return int((self.last_due[:self.n] < self.as_of).sum())
+
+    def snapshot(self) -> pd.DataFrame:
+        """One row per loan with an instalment due in the clock month."""
+        n = self.n
+        live = self._live()
+        return pd.DataFrame({
+            "loan_id": self.loan_ids[:n][live],
+            "cum_scheduled": self.cum_scheduled[:n][live],
+            "cum_paid": self.cum_paid[:n][live],
+            "arrears_amt": self.arrears_amt[:n][live],
+            "missed_inst": self.missed_inst[:n][live],
+            "dpd_bucket": np.array(BUCKETS)[self.dpd[:n][live]],
+            "month_key": self.as_of,
+        })
+
+    def bucket_counts(self) -> dict[str, int]:
+        live = self._live()
+        counts = np.bincount(self.dpd[:self.n][live], minlength=len(BUCKETS))
+        return dict(zip(BUCKETS, counts.tolist()))
+
+    # -- checkpoint ----------------------------------------------------------
+
+    def save(self, path: Path | str = DEFAULT_STATE_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        keys = sorted(self.pending)
+        chunks = [c for k in keys for c in self.pending[k]]
+        sizes = [len(s) for k in keys for s, _ in self.pending[k]]
+        pend_keys = np.repeat([k for k in keys for _ in self.pending[k]], sizes).astype(np.int32)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:  # a file object: np.savez would append .npz to the name
+            np.savez(
+                f,
+                **{name: getattr(self, name)[:self.n] for name in ARRAYS},
+                pend_keys=pend_keys,
+                pend_slots=np.concatenate([s for s, _ in chunks]) if chunks else np.zeros(0, dtype=np.int64),
+                pend_amounts=np.concatenate([a for _, a in chunks]) if chunks else np.zeros(0),
+                counters=np.array([self.as_of, self.last_schedule_id, self.last_payment_id,
+                                   self.events, self.ignored_payments], dtype=np.int64),
+                fingerprint=np.array(self.fingerprint),
+                marks=np.array(self.marks),
+            )
+        tmp.replace(path)  # readers never see a half-written checkpoint
+
+    @classmethod
+    def load(cls, path: Path | str = DEFAULT_STATE_PATH) -> "LoanStateStore":
+        store = cls(capacity=1)
+        with np.load(Path(path), allow_pickle=False) as z:
+            for name in ARRAYS:
+                setattr(store, name, z[name])
+            keys, slots, amounts = z["pend_keys"], z["pend_slots"], z["pend_amounts"]
+            (store.as_of, store.last_schedule_id, store.last_payment_id,
+             store.events, store.ignored_payments) = (int(v) for v in z["counters"])
+            store.fingerprint = str(z["fingerprint"])
+            store.marks = str(z["marks"]) if "marks" in z.files else ""
+        store.n = len(store.loan_ids)
+        store.slot = dict(zip(store.loan_ids.tolist(), range(store.n)))
+        if len(keys):
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            for k, lo, hi in zip(keys[starts], starts, np.r_[starts[1:], len(keys)]):
+                store.pending[int(k)] = [(slots[lo:hi], amounts[lo:hi])]
+        return store
+
+
+def applied_marks(engine, last_schedule_id: int, last_payment_id: int) -> str:
+    """Row count, id range and amount total of the schedule and payment rows at or below the watermarks."""
+    with engine.connect() as conn:
+        sched = conn.execute(text(
+            "SELECT COUNT(*), MIN(schedule_id), MAX(schedule_id), SUM(scheduled_amount) FROM fct_schedule "
+            "WHERE schedule_id <= :after"), {"after": last_schedule_id}).one()
+        pays = conn.execute(text(
+            "SELECT COUNT(*), MIN(payment_id), MAX(payment_id), SUM(paid_amount) FROM fct_payments "
+            "WHERE payment_id <= :after"), {"after": last_payment_id}).one()
+    return "|".join(f"{n}:{lo}:{hi}:{round(total or 0, 2)}" for n, lo, hi, total in (sched, pays))
+
+
+def refresh(engine, state_path: Path | str | None = DEFAULT_STATE_PATH, rebuild: bool = False,
+            as_of: int | None = None) -> LoanStateStore:
+    """
+    Restore the checkpoint (unless stale or `rebuild`) and apply the schedule
+    and payment rows added since. The checkpoint is stale when the loans or
+    the rows at or below its watermarks changed (a reload); the store is then
+    rebuilt with `source_changed` set. `as_of` replays only events up to that
+    month key and is meant for verification; such a state is not saved.
+    """
+    fp = loans_fingerprint(engine)
+    store, source_changed = None, False
+    if state_path and not rebuild and as_of is None and Path(state_path).exists():
+        store = LoanStateStore.load(state_path)
+        if (store.fingerprint != fp
+                or store.marks != applied_marks(engine, store.last_schedule_id, store.last_payment_id)):
+            store, source_changed = None, True
+    if store is None:
+        store = LoanStateStore()
+        store.fingerprint = fp
+        store.source_changed = source_changed
+
+    month_filter = "" if as_of is None else "AND {col} <= :as_of"
+    params = {"as_of": as_of} if as_of is not None else {}
+    sched = pd.read_sql_query(
+        text("SELECT schedule_id, loan_id, due_month_key, scheduled_amount FROM fct_schedule "
+             "WHERE schedule_id > :after " + month_filter.format(col="due_month_key")),
+        engine, params={"after": store.last_schedule_id, **params},
+    )
+    if as_of is not None:
+        # instalments after the cut-off still count towards avg_inst and the due-month range
+        later = pd.read_sql_query(
+            text("SELECT schedule_id, loan_id, due_month_key, scheduled_amount FROM fct_schedule "
+                 "WHERE due_month_key > :as_of"),
+            engine, params=params,
+        )
+        sched = pd.concat([sched, later], ignore_index=True)
+        store.advance_to(as_of)
+    pay = pd.read_sql_query(
+        text("SELECT payment_id, loan_id, payment_month_key, paid_amount FROM fct_payments "
+             "WHERE payment_id > :after " + month_filter.format(col="payment_month_key")),
+        engine, params={"after": store.last_payment_id, **params},
+    )
+    # instalments first: a payment only counts in months the loan has one
+    store.add_schedule(sched["loan_id"].to_numpy(), sched["due_month_key"].to_numpy(),
+                       sched["scheduled_amount"].to_numpy())
+    store.apply_payments(pay["loan_id"].to_numpy(), pay["payment_month_key"].to_numpy(),
+                         pay["paid_amount"].to_numpy())
+    if len(sched):
+        store.last_schedule_id = max(store.last_schedule_id, int(sched["schedule_id"].max()))
+    if len(pay):
+        store.last_payment_id = max(store.last_payment_id, int(pay["payment_id"].max()))
+    if state_path and as_of is None:
+        store.marks = applied_marks(engine, store.last_schedule_id, store.last_payment_id)
+        store.save(state_path)
+    return store
+
+
+def verify(engine, store: LoanStateStore) -> int:
+    """Loans missing on either side, or whose bucket or arrears differ from mart_loan_dpd_bucket at the clock month."""
+    mart = pd.read_sql_query(
+        text("SELECT loan_id, arrears_amt, dpd_bucket FROM mart_loan_dpd_bucket WHERE month_key = :k"),
+        engine, params={"k": store.as_of},
+    )
+    m = mart.merge(store.snapshot(), on="loan_id", how="outer", suffixes=("_mart", ""), indicator=True)
+    bad = ((m["_merge"] != "both") | (m["dpd_bucket"] != m["dpd_bucket_mart"])
+           | ~np.isclose(m["arrears_amt"].to_numpy(dtype=np.float64),
+                         m["arrears_amt_mart"].to_numpy(dtype=np.float64), atol=0.005))
+    print(f"Verified {len(m):,} loans against mart_loan_dpd_bucket for {month_end_from_key([store.as_of])[0]}: "
+          f"{int(bad.sum()):,} differ")
+    if bad.any():
+        print(m[bad].head(10).to_string(index=False))
+    return int(bad.sum())
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Keep per-loan arrears and DPD state up to date from schedule and payment events.")
+    parser.add_argument("--state", default=str(DEFAULT_STATE_PATH), help=f"Checkpoint path (default: {DEFAULT_STATE_PATH})")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the checkpoint and replay all events")
+    parser.add_argument("--as-of", help="Replay events up to this month (YYYY-MM); implies --rebuild, not saved")
+    parser.add_argument("--no-save", action="store_true", help="Do not write the checkpoint")
+    parser.add_argument("--loan", type=int, action="append", help="Print this loan's state (repeatable)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Compare with mart_loan_dpd_bucket; exit 1 on differences (always done after a reload)")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    engine = get_engine(read_only=True)  # only the checkpoint file is written
+    as_of = int(month_key([args.as_of + "-01"])[0]) if args.as_of else None
+    t0 = time.perf_counter()
+    store = refresh(engine, None if args.no_save else args.state, rebuild=args.rebuild, as_of=as_of)
+    if store.source_changed:
+        print("Checkpoint does not match the loaded schedule / payments (reloaded?): rebuilt from all events")
+    print(f"Loan state as of {month_end_from_key([store.as_of])[0]}: {store.n:,} loans, "
+          f"{store.events:,} events ({store.ignored_payments:,} payments outside due months), "
+          f"{time.perf_counter() - t0:.2f}s")
+    for bucket, n in store.bucket_counts().items():
+        print(f"  {bucket:<12}{n:>10,}")
+    print(f"  {'matured':<12}{store.matured():>10,}")
+    for loan_id in args.loan or []:
+        print(store.get(loan_id) or f"Loan {loan_id}: no events")
+    if (args.verify or store.source_changed) and verify(engine, store):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
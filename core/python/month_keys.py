@@ -0,0 +1,97 @@
+"""
+Integer month keys (months since 2000-01) for the fact tables.
+
+The marts join and group on these keys instead of calling
+date(x, 'start of month', '+1 month', '-1 day') on every row. The ISO date
+columns stay in place for Power BI and ad-hoc SQL; dim_month maps each key back
+to its ISO month_start / month_end.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+BASE_YEAR = 2000
+
+# table -> {ISO date column: month key column}
+MONTH_KEY_COLUMNS = {
+    "fct_loans": {"origination_date": "orig_month_key"},
+    "fct_schedule": {"due_date": "due_month_key"},
+    "fct_payments": {"payment_date": "payment_month_key"},
+    "fct_collections": {"event_date": "event_month_key"},
+}
+
+
+def month_key(dates) -> np.ndarray:
+    """ISO dates (strings, dates or timestamps) -> months since 2000-01, without datetime parsing."""
+    s = pd.Series(dates).astype(str)
+    return ((s.str[:4].astype(np.int32) - BASE_YEAR) * 12 + s.str[5:7].astype(np.int32) - 1).to_numpy(dtype=np.int32)
+
+
+def month_end_from_key(keys) -> np.ndarray:
+    """Months since 2000-01 -> ISO month-end strings."""
+    keys = np.asarray(keys, dtype=np.int64)
+    first = pd.to_datetime({"year": BASE_YEAR + keys // 12, "month": keys % 12 + 1, "day": 1})
+    return (first + pd.offsets.MonthEnd(0)).dt.strftime("%Y-%m-%d").to_numpy()
+
+
+def dim_month_frame(lo: int, hi: int) -> pd.DataFrame:
+    """dim_month rows for month keys lo..hi inclusive."""
+    keys = np.arange(lo, hi + 1, dtype=np.int64)
+    return pd.DataFrame({
+        "month_key": keys,
+        "month_start": [f"{BASE_YEAR + k // 12:04d}-{k % 12 + 1:02d}-01" for k in keys],
+        "month_end": month_end_from_key(keys),
+        "year": BASE_YEAR + keys // 12,
+        "month": keys % 12 + 1,
+    })
+
+
+def extend_dim_month(bind) -> int:
+    """
+    Add any missing dim_month rows between the earliest and latest fact month keys.
+    Same result as the INSERT at the top of 03_mart_views.sql, for any dialect.
+    `bind` is an engine (own transaction) or a connection (the caller's
+    transaction). Returns the number of months added.
+    """
+    if isinstance(bind, Connection):
+        return _extend_dim_month(bind)
+    with bind.begin() as conn:
+        return _extend_dim_month(conn)
+
+
+def _extend_dim_month(conn) -> int:
+    bounds = [
+        ("fct_loans", "orig_month_key"),
+        ("fct_schedule", "due_month_key"),
+        ("fct_payments", "payment_month_key"),
+    ]
+    sql = " UNION ALL ".join(f"SELECT MIN({c}) AS lo, MAX({c}) AS hi FROM {t}" for t, c in bounds)
+    rows = conn.execute(text(sql)).fetchall()
+    los = [r[0] for r in rows if r[0] is not None]
+    his = [r[1] for r in rows if r[1] is not None]
+    if not los:
+        return 0
+    existing = {r[0] for r in conn.execute(text("SELECT month_key FROM dim_month"))}
+    cal = dim_month_frame(int(min(los)), int(max(his)))
+    cal = cal[~cal["month_key"].isin(existing)]
+    if len(cal):
+        conn.execute(
+            text(
+                "INSERT INTO dim_month (month_key, month_start, month_end, year, month) "
+                "VALUES (:month_key, :month_start, :month_end, :year, :month)"
+            ),
+            cal.astype(object).to_dict("records"),
+        )
+    return len(cal)
+
+
+def add_month_keys(table_name: str, df: pd.DataFrame) -> pd.DataFrame:
+    """(Re)compute the month key columns for `table_name` from its ISO date columns."""
+    for date_col, key_col in MONTH_KEY_COLUMNS.get(table_name, {}).items():
+        if date_col in df.columns:
+            df[key_col] = month_key(df[date_col])
+    return df
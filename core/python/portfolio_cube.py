@@ -0,0 +1,269 @@
+"""
+In-process OLAP cube of the portfolio KPIs.
+
+Loan counts and EOP balance sums from mart_portfolio_snapshot_v2 are held in
+two dense NumPy arrays with the axes
+
+  month x product_type x channel x region x employment_type x dpd_bucket
+
+(region / employment_type from dim_customers). The cube is built with one
+GROUP BY, usually once after each month-end load. It is saved to
+core/data/portfolio_cube.npz and reused until the loaded loans, schedule,
+payments, mart SQL or mart backend change (book_fingerprint). Slicing and
+roll-ups are array indexing and axis sums, so report tables and ad-hoc
+questions never go back to the database.
+
+Measures follow package_risk/powerbi/measures_dax.md: loans, loans_30p,
+loans_60p, loans_90p, rate_30p, rate_60p, rate_90p (NPL), eop_balance,
+eop_balance_60p and eop_rate_60p.
+
+  cube = load_cube(get_engine(read_only=True))
+  cube.kpis(by=["product_type"], month="2024-06-30")
+  auto = cube.slice(product_type="Auto", region=["Auckland", "Wellington"])
+  auto.kpis(by=["month"])                                # monthly series
+  cube.slice(month=("2024-01-31", "2024-12-31")).total("loans_60p")
+
+Typical usage (from core/python):
+  python portfolio_cube.py                               # build / load, latest month by product
+  python portfolio_cube.py --by channel --by region --month 2024-06-30
+  python portfolio_cube.py --rebuild
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import time
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from db_engine import get_engine
+from month_keys import month_end_from_key
+from vintage_engine import source_fingerprint
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_CUBE_PATH = ROOT_DIR / "core" / "data" / "portfolio_cube.npz"
+
+DIMS = ["month", "product_type", "channel", "region", "employment_type", "dpd_bucket"]
+BUCKETS = ["DPD_0", "DPD_1_29", "DPD_30_59", "DPD_60_89", "DPD_90_PLUS"]
+# bucket codes counted by each delinquency measure
+DELINQUENT = {"30p": [2, 3, 4], "60p": [3, 4], "90p": [4]}
+MEASURES = ["loans", "loans_30p", "loans_60p", "loans_90p", "rate_30p", "rate_60p", "rate_90p",
+            "eop_balance", "eop_balance_60p", "eop_rate_60p"]
+
+CUBE_SQL = """
+SELECT
+  s.month_key,
+  s.product_type,
+  s.channel,
+  COALESCE(c.region, 'Unknown') AS region,
+  COALESCE(c.employment_type, 'Unknown') AS employment_type,
+  s.dpd_bucket,
+  COUNT(*) AS loans,
+  SUM(COALESCE(s.eop_balance, 0)) AS eop_balance
+FROM mart_portfolio_snapshot_v2 s
+LEFT JOIN dim_customers c
+  ON c.customer_id = s.customer_id
+GROUP BY s.month_key, s.product_type, s.channel, COALESCE(c.region, 'Unknown'),
+         COALESCE(c.employment_type, 'Unknown'), s.dpd_bucket
+"""
+
+
+def book_fingerprint(engine) -> str:
+    """
+    Identity of what mart_portfolio_snapshot_v2 returns: the loans, schedule,
+    payments and mart SQL (vintage_engine.source_fingerprint) plus the
+    deployed view definition, which differs between the SQLite view and the
+    DuckDB-published mv_ table.
+    """
+    view = inspect(engine).get_view_definition("mart_portfolio_snapshot_v2") or ""
+    return f"{source_fingerprint(engine)}|{hashlib.sha256(view.encode()).hexdigest()[:16]}"
+
+
+class PortfolioCube:
+    """Dense loan-count and balance arrays over DIMS, with label lists per axis."""
+
+    def __init__(self, labels: dict[str, list[str]], loans: np.ndarray, balance: np.ndarray, fingerprint: str = ""):
+        self.labels = labels        # dim -> labels along that axis (month: ISO month_end)
+        self.loans = loans          # int32, shape = [len(labels[d]) for d in DIMS]
+        self.balance = balance      # float64, same shape
+        self.fingerprint = fingerprint
+        self._pos = {d: {v: i for i, v in enumerate(labels[d])} for d in DIMS}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, fingerprint: str = "") -> "PortfolioCube":
+        """Build from CUBE_SQL rows; the month axis covers every month from first to last."""
+        keys = df["month_key"].to_numpy(dtype=np.int64)
+        lo = int(keys.min()) if len(keys) else 0
+        n_months = int(keys.max()) - lo + 1 if len(keys) else 0
+        labels = {"month": list(month_end_from_key(np.arange(lo, lo + n_months))) if n_months else []}
+        codes = [keys - lo]
+        for dim in DIMS[1:]:
+            cat = pd.Categorical(df[dim].astype(str), categories=BUCKETS if dim == "dpd_bucket" else None)
+            labels[dim] = [str(v) for v in cat.categories]
+            codes.append(cat.codes.astype(np.int64))
+        shape = tuple(len(labels[d]) for d in DIMS)
+        flat = np.ravel_multi_index(codes, shape) if len(keys) else np.zeros(0, dtype=np.int64)
+        size = int(np.prod(shape))
+        loans = np.bincount(flat, weights=df["loans"].to_numpy(dtype=np.float64), minlength=size)
+        balance = np.bincount(flat, weights=df["eop_balance"].to_numpy(dtype=np.float64), minlength=size)
+        return cls(labels, loans.astype(np.int32).reshape(shape), balance.reshape(shape), fingerprint)
+
+    # -- state -------------------------------------------------------------
+
+    def save(self, path: Path | str = DEFAULT_CUBE_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, loans=self.loans, balance=self.balance, fingerprint=np.array(self.fingerprint),
+                 **{f"labels_{d}": np.array(self.labels[d]) for d in DIMS})
+
+    @classmethod
+    def load(cls, path: Path | str = DEFAULT_CUBE_PATH) -> "PortfolioCube":
+        with np.load(Path(path), allow_pickle=False) as z:
+            return cls({d: [str(v) for v in z[f"labels_{d}"]] for d in DIMS}, z["loans"], z["balance"],
+                       str(z["fingerprint"]))
+
+    # -- queries -----------------------------------------------------------
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.loans.shape
+
+    def _index(self, dim: str, value) -> slice | list[int]:
+        pos = self._pos[dim]
+        if dim == "month" and isinstance(value, tuple):  # inclusive (first, last) month_end range
+            first, last = value
+            return slice(pos[first] if first else 0, pos[last] + 1 if last else None)
+        values = [value] if isinstance(value, str) else list(value)
+        missing = [v for v in values if v not in pos]
+        if missing:
+            raise KeyError(f"unknown {dim}: {', '.join(map(str, missing))}")
+        idx = [pos[v] for v in values]
+        if len(idx) == 1:
+            return slice(idx[0], idx[0] + 1)  # a view, no copy
+        return idx
+
+    def slice(self, **filters) -> "PortfolioCube":
+        """
+        Sub-cube for dim=value, dim=[values] or month=(first, last) (inclusive
+        month_end range; None for open ends). The axes are kept.
+        """
+        loans, balance, labels = self.loans, self.balance, dict(self.labels)
+        for dim, value in filters.items():
+            if dim not in self._pos:
+                raise KeyError(f"unknown dimension {dim}; use one of {', '.join(DIMS)}")
+            axis = DIMS.index(dim)
+            idx = self._index(dim, value)
+            if isinstance(idx, slice):
+                sl = (slice(None),) * axis + (idx,)
+                loans, balance = loans[sl], balance[sl]
+                labels[dim] = labels[dim][idx]
+            else:
+                loans, balance = np.take(loans, idx, axis=axis), np.take(balance, idx, axis=axis)
+                labels[dim] = [labels[dim][i] for i in idx]
+        return PortfolioCube(labels, loans, balance, self.fingerprint)
+
+    def rollup(self, by: Iterable[str] = ()) -> dict[str, np.ndarray]:
+        """Additive measures summed over every axis not in `by` (arrays shaped by `by`, in DIMS order)."""
+        by = [d for d in DIMS if d in set(by)]
+        bucket_axis = DIMS.index("dpd_bucket")
+        keep_bucket = "dpd_bucket" in by
+        other = tuple(i for i, d in enumerate(DIMS) if d not in by and d != "dpd_bucket")
+        loans = self.loans.sum(axis=other, dtype=np.int64)
+        balance = self.balance.sum(axis=other)
+        bucket_axis -= sum(1 for i in other if i < bucket_axis)
+        labels = self.labels["dpd_bucket"]
+        out = {}
+        for name, codes in DELINQUENT.items():
+            # a bucket sliced out of the cube counts as zero
+            mask = np.array([BUCKETS.index(b) in codes for b in labels])
+            shape = [1] * loans.ndim
+            shape[bucket_axis] = len(labels)
+            m = mask.reshape(shape)
+            out[f"loans_{name}"] = loans * m if keep_bucket else (loans * m).sum(axis=bucket_axis)
+            if name == "60p":
+                out["eop_balance_60p"] = balance * m if keep_bucket else (balance * m).sum(axis=bucket_axis)
+        out["loans"] = loans if keep_bucket else loans.sum(axis=bucket_axis)
+        out["eop_balance"] = balance if keep_bucket else balance.sum(axis=bucket_axis)
+        return out
+
+    def total(self, measure: str) -> float:
+        """One measure (MEASURES) over the whole (sliced) cube."""
+        r = {k: v.sum() for k, v in self.rollup().items()}
+        return float(_with_rates(r)[measure])
+
+    def kpis(self, by: Iterable[str] = (), **filters) -> pd.DataFrame:
+        """
+        MEASURES for every combination of `by` with loans, after slicing by
+        `filters`, e.g. kpis(by=["month", "product_type"], channel="Online").
+        """
+        by = list(by)
+        unknown = [d for d in by if d not in DIMS]
+        if unknown:
+            raise KeyError(f"unknown dimension {', '.join(unknown)}; use one of {', '.join(DIMS)}")
+        cube = self.slice(**filters) if filters else self
+        r = cube.rollup(by)
+        ordered = [d for d in DIMS if d in set(by)]
+        grid = np.indices(r["loans"].shape).reshape(len(ordered), -1) if ordered else np.zeros((0, 1), dtype=int)
+        keep = r["loans"].ravel() > 0
+        df = pd.DataFrame({d: np.array(cube.labels[d], dtype=object)[grid[k][keep]] for k, d in enumerate(ordered)})
+        cols = _with_rates({k: v.ravel()[keep] for k, v in r.items()})
+        for m in MEASURES:
+            df[m] = cols[m]
+        return df[by + MEASURES].reset_index(drop=True)
+
+
+def _with_rates(r: dict) -> dict:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r["rate_30p"] = r["loans_30p"] / r["loans"]
+        r["rate_60p"] = r["loans_60p"] / r["loans"]
+        r["rate_90p"] = r["loans_90p"] / r["loans"]
+        r["eop_rate_60p"] = r["eop_balance_60p"] / r["eop_balance"]
+    return r
+
+
+def load_cube(engine, path: Path | str | None = DEFAULT_CUBE_PATH, rebuild: bool = False) -> PortfolioCube:
+    """The saved cube if it matches the loaded book (and not `rebuild`); otherwise build and save it."""
+    fp = book_fingerprint(engine)
+    if path and not rebuild and Path(path).exists():
+        cube = PortfolioCube.load(path)
+        if cube.fingerprint == fp:
+            return cube
+    cube = PortfolioCube.from_frame(pd.read_sql_query(text(CUBE_SQL), engine), fp)
+    if path:
+        cube.save(path)
+    return cube
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or load the portfolio KPI cube and print a slice.")
+    parser.add_argument("--cube", default=str(DEFAULT_CUBE_PATH), help=f"Cube file (default: {DEFAULT_CUBE_PATH})")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild even if the saved cube matches the book")
+    parser.add_argument("--by", action="append", choices=DIMS, help="Group by this dimension (repeatable; default: product_type)")
+    parser.add_argument("--month", help="Month end to show (YYYY-MM-DD; default: latest; 'all' for every month)")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    t0 = time.perf_counter()
+    cube = load_cube(get_engine(read_only=True), args.cube, rebuild=args.rebuild)
+    print(f"Cube {' x '.join(map(str, cube.shape))} ({cube.loans.nbytes + cube.balance.nbytes:,} bytes), "
+          f"ready in {time.perf_counter() - t0:.2f}s")
+    if not cube.labels["month"]:
+        print("Cube is empty.")
+        return 0
+    month = args.month or cube.labels["month"][-1]
+    filters = {} if month == "all" else {"month": month}
+    t0 = time.perf_counter()
+    df = cube.kpis(by=args.by or ["product_type"], **filters)
+    ms = (time.perf_counter() - t0) * 1000
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(df.round(4).to_string(index=False))
+    print(f"({len(df):,} rows in {ms:.2f} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,12 +1,463 @@
-import subprocess
+"""
+End-to-end pipeline: generate -> schema/load -> marts -> risk / commercial -> score -> visualize -> report.
 
-def run(cmd):
-    print(">", " ".join(cmd))
-    subprocess.check_call(cmd)
+Stages run in-process as a small DAG. Each stage has an input fingerprint
+(content hash of its SQL files and of every local module its scripts import,
+found by parsing the imports, the DB URL and the output fingerprints of the
+stages it depends on) and an output fingerprint (content hash of the files
+it writes; for stages that only write to the database, the input fingerprint).
+Both are stored in core/data/pipeline_state.json, and a stage whose input
+fingerprint is unchanged and whose outputs are still in place is skipped.
+Because downstream stages hash their upstream *outputs*, regenerating
+identical CSVs does not force a reload.
+
+Independent branches (risk features vs. the commercial package) run
+concurrently; every stage reports its wall time.
+
+Typical usage (from core/python):
+  python run_pipeline.py                     # run whatever is out of date
+  python run_pipeline.py --dry-run           # show what would run
+  python run_pipeline.py --force marts       # rebuild the marts and everything after them
+  python run_pipeline.py --until score       # stop after scoring
+  python run_pipeline.py --skip generate     # keep the CSVs already in core/data/raw
+  python run_pipeline.py --backend duckdb    # marts / risk features / commercial on DuckDB (see duckdb_marts.py)
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable
+
+from sqlalchemy import inspect, make_url
+
+from db_engine import dispose_engines, get_db_url, get_engine
+
+HERE = Path(__file__).resolve().parent
+ROOT_DIR = HERE.parents[1]
+CORE_SQL = ROOT_DIR / "core" / "sql"
+RISK_DIR = ROOT_DIR / "package_risk"
+COMM_DIR = ROOT_DIR / "package_commercial"
+RAW_DIR = ROOT_DIR / "core" / "data" / "raw"
+VIS_DIR = ROOT_DIR / "visualizations"
+DEFAULT_STATE_PATH = ROOT_DIR / "core" / "data" / "pipeline_state.json"
+SQLITE_BUSY_TIMEOUT = 600  # seconds; a commercial_engine write can hold the lock for minutes
+
+RAW_FILES = ["dim_customers", "dim_products", "dim_channels", "fct_loans", "fct_schedule", "fct_payments", "fct_collections"]
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[["Context"], None]
+    deps: list[str] = field(default_factory=list)
+    sources: list[Path] = field(default_factory=list)   # code / SQL the stage executes
+    files: list[Path] = field(default_factory=list)     # files it writes
+    objects: list[str] = field(default_factory=list)    # tables / views it leaves in the DB
+
+
+@dataclass
+class StageResult:
+    name: str
+    status: str          # ran | skipped | failed | blocked
+    seconds: float = 0.0
+    error: str = ""
+
+
+@dataclass
+class Context:
+    engine: object
+    db_url: str
+    backend: str = "sqlite"
+
+
+# -- stage bodies --------------------------------------------------------------
+# Modules are imported inside the stages so `--dry-run` and skipped stages
+# never pay for pandas/sklearn/matplotlib imports they don't need.
+
+def _run_sql(ctx: Context, *paths: Path) -> None:
+    from run_sql import run_file
+
+    for p in paths:
+        timings = run_file(ctx.engine, p)
+        print(f"  {p.name}: {sum(1 for t in timings if t.index)} statements, {sum(t.seconds for t in timings):.2f}s")
+
+
+def _duckdb(ctx: Context, name: str, *paths: Path) -> None:
+    import duckdb_marts
+    from instrumentation import instrument
+
+    with instrument(f"duckdb_{name}") as rec:
+        published = duckdb_marts.build(paths, ctx.engine, rec=rec)
+    print(f"  DuckDB: published {len(published)} tables, {sum(published.values()):,} rows")
+
+
+def _generate(ctx: Context) -> None:
+    import generate_data
+
+    generate_data.main()
+
+
+def _schema(ctx: Context) -> None:
+    _run_sql(ctx, CORE_SQL / "01_schema.sql")
+
+
+def _load(ctx: Context) -> None:
+    import load_data
+
+    load_data.main([])
+
+
+def _marts(ctx: Context) -> None:
+    if ctx.backend == "duckdb":
+        return _duckdb(ctx, "marts", CORE_SQL / "03_mart_views.sql", CORE_SQL / "03_mart_views_plus_balance.sql")
+    _run_sql(ctx, CORE_SQL / "03_mart_views.sql", CORE_SQL / "03_mart_views_plus_balance.sql")
+
+
+def _risk_features(ctx: Context) -> None:
+    if ctx.backend == "duckdb":
+        return _duckdb(ctx, "risk_features", RISK_DIR / "sql" / "10_risk_features.sql")
+    _run_sql(ctx, RISK_DIR / "sql" / "10_risk_features.sql")
+
+
+def _commercial(ctx: Context) -> None:
+    if ctx.backend == "duckdb":  # comm_loan_month is filled in the same DuckDB pass
+        return _duckdb(ctx, "commercial", COMM_DIR / "sql" / "20_commercial_marts.sql")
+    import commercial_engine
+
+    _run_sql(ctx, COMM_DIR / "sql" / "20_commercial_marts.sql")
+    n = commercial_engine.materialize(ctx.engine)
+    print(f"  Saved {commercial_engine.COMM_TABLE}: {n:,}")
+
+
+def _score(ctx: Context) -> None:
+    import train_risk_model
+
+    train_risk_model.main([])
+    _run_sql(ctx, RISK_DIR / "sql" / "11_risk_score_view.sql")
+
+
+def _visualize(ctx: Context) -> None:
+    import create_visualizations
+
+    create_visualizations.main([])
+
+
+def _report(ctx: Context) -> None:
+    import create_report
+
+    create_report.main(["--skip-visualizations"])
+
+
+def local_modules(*entries: Path) -> list[Path]:
+    """
+    The entry scripts and every local module they import, directly or inside a
+    function, resolved like the scripts' sys.path: their own folder, then the
+    core, risk and commercial python folders.
+    """
+    search = [HERE, RISK_DIR / "python", COMM_DIR / "python"]
+    seen: set[Path] = set()
+    todo = list(entries)
+    while todo:
+        path = todo.pop()
+        if path in seen or not path.exists():
+            continue
+        seen.add(path)
+        for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"), filename=str(path))):
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                found = next((d / f"{name.split('.')[0]}.py" for d in [path.parent, *search]
+                              if (d / f"{name.split('.')[0]}.py").exists()), None)
+                if found is not None:
+                    todo.append(found)
+    return sorted(seen)
+
+
+def build_stages(backend: str = "sqlite") -> dict[str, Stage]:
+    py, risk_py, comm_py = HERE, RISK_DIR / "python", COMM_DIR / "python"
+    # switching backends (or editing the DuckDB module) changes the SQL stages' fingerprints
+    sql_py = [py / "run_sql.py"] + ([py / "duckdb_marts.py"] if backend == "duckdb" else [])
+    stages = [
+        Stage("generate", _generate,
+              sources=local_modules(py / "generate_data.py"),
+              files=[RAW_DIR / f"{t}.csv" for t in RAW_FILES]),
+        Stage("schema", _schema,
+              sources=[CORE_SQL / "01_schema.sql"] + local_modules(py / "run_sql.py"),
+              objects=RAW_FILES + ["dim_month"]),
+        Stage("load", _load, deps=["generate", "schema"],
+              sources=local_modules(py / "load_data.py"),
+              objects=["fct_loans", "fct_schedule", "fct_payments"]),
+        Stage("marts", _marts, deps=["load"],
+              sources=[CORE_SQL / "03_mart_views.sql", CORE_SQL / "03_mart_views_plus_balance.sql"]
+              + local_modules(*sql_py),
+              objects=["mart_portfolio_snapshot", "mart_dpd_migration", "mart_portfolio_snapshot_v2"]),
+        Stage("risk_features", _risk_features, deps=["marts"],
+              sources=[RISK_DIR / "sql" / "10_risk_features.sql"] + local_modules(*sql_py),
+              objects=["risk_features_3m", "risk_labels_60p_3m"]),
+        Stage("commercial", _commercial, deps=["marts"],
+              sources=[COMM_DIR / "sql" / "20_commercial_marts.sql"] + local_modules(comm_py / "commercial_engine.py", *sql_py),
+              objects=["comm_loan_month", "comm_rar_monthly"]),
+        Stage("score", _score, deps=["risk_features"],
+              sources=[RISK_DIR / "sql" / "11_risk_score_view.sql"]
+              + local_modules(risk_py / "train_risk_model.py", py / "run_sql.py"),
+              objects=["risk_scores", "risk_watchlist", "risk_watchlist_topk"]),
+        Stage("visualize", _visualize, deps=["marts", "score", "commercial"],
+              sources=local_modules(py / "create_visualizations.py"),
+              files=[VIS_DIR / f for f in ("delinquency_trends.png", "dpd_by_product.png", "migration_matrix.png",
+                                           "vintage_analysis.png", "risk_scores.png", "commercial_metrics.png",
+                                           "interactive_dashboard.html")]),
+        Stage("report", _report, deps=["visualize"],
+              sources=local_modules(py / "create_report.py"),
+              files=[ROOT_DIR / "reports" / "financial_risk_report.html"]),
+    ]
+    return {s.name: s for s in stages}
+
+
+# -- fingerprints ----------------------------------------------------------------
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def input_fingerprint(stage: Stage, db_url: str, upstream: dict[str, str]) -> str:
+    h = hashlib.sha256(f"{stage.name}\0{db_url}".encode())
+    for p in stage.sources:
+        h.update(f"\0{p.relative_to(ROOT_DIR).as_posix()}\0{file_digest(p) if p.exists() else '-'}".encode())
+    for d in stage.deps:
+        h.update(f"\0{d}\0{upstream[d]}".encode())
+    return h.hexdigest()
+
+
+def output_fingerprint(stage: Stage, input_fp: str) -> str:
+    """
+    Hash of the files a stage writes; DB-only stages reuse the input hash.
+    Missing files hash as absent (the dashboard HTML needs plotly), so deleting
+    an output still makes the stage out of date.
+    """
+    if not stage.files:
+        return input_fp
+    h = hashlib.sha256()
+    for p in stage.files:
+        h.update(f"{p.name}\0{file_digest(p) if p.exists() else '-'}\0".encode())
+    return h.hexdigest()
+
+
+def missing_objects(engine, names: Iterable[str]) -> list[str]:
+    insp = inspect(engine)
+    have = {n.lower() for n in insp.get_table_names() + insp.get_view_names()}
+    return [n for n in names if n.lower() not in have]
+
+
+def load_state(path: Path) -> dict:
+    if path.exists():
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass
+    return {}
+
+
+def save_state(path: Path, state: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2, sort_keys=True), encoding="utf-8")
+    tmp.replace(path)
+
+
+# -- scheduler -------------------------------------------------------------------
+
+def select(stages: dict[str, Stage], until: str | None) -> list[str]:
+    """Stage names to consider, in definition (topological) order."""
+    if until is None:
+        return list(stages)
+    keep, todo = set(), [until]
+    while todo:
+        n = todo.pop()
+        if n not in keep:
+            keep.add(n)
+            todo.extend(stages[n].deps)
+    return [n for n in stages if n in keep]
+
+
+def downstream(stages: dict[str, Stage], names: Iterable[str]) -> set[str]:
+    out = set(names)
+    for n, s in stages.items():  # definition order is topological
+        if any(d in out for d in s.deps):
+            out.add(n)
+    return out
+
+
+class Pipeline:
+    def __init__(self, stages: dict[str, Stage], ctx: Context, state_path: Path,
+                 force: set[str], skip: set[str], jobs: int, dry_run: bool = False):
+        self.stages = stages
+        self.ctx = ctx
+        self.state_path = state_path
+        self.state = load_state(state_path)
+        self.force = force
+        self.skip = skip
+        self.jobs = max(1, jobs)
+        self.dry_run = dry_run
+        self.outputs: dict[str, str] = {}
+        self.results: dict[str, StageResult] = {}
+        self._lock = threading.Lock()
+
+    def _up_to_date(self, stage: Stage, fp: str) -> bool:
+        prev = self.state.get(stage.name)
+        if stage.name in self.force or not prev or prev.get("input") != fp:
+            return False
+        if output_fingerprint(stage, fp) != prev.get("output"):
+            return False  # a file was removed or edited since the last run
+        return not (stage.objects and missing_objects(self.ctx.engine, stage.objects))
+
+    def _finish(self, stage: Stage, fp: str) -> None:
+        out = output_fingerprint(stage, fp)
+        with self._lock:
+            self.outputs[stage.name] = out
+            self.state[stage.name] = {"input": fp, "output": out, "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+            save_state(self.state_path, self.state)
+
+    def _execute(self, stage: Stage, fp: str) -> StageResult:
+        t0 = time.perf_counter()
+        try:
+            stage.run(self.ctx)
+            self._finish(stage, fp)
+        except BaseException as e:  # stage mains call sys.exit on failure
+            if isinstance(e, KeyboardInterrupt):
+                raise
+            traceback.print_exc()
+            return StageResult(stage.name, "failed", time.perf_counter() - t0, f"{type(e).__name__}: {e}")
+        return StageResult(stage.name, "ran", time.perf_counter() - t0)
+
+    def _resolve(self, name: str) -> tuple[str, str] | StageResult:
+        """('run', fp) for a stage that must run, or its result when it needs no work."""
+        stage = self.stages[name]
+        fp = input_fingerprint(stage, self.ctx.db_url, self.outputs)
+        if name in self.skip:
+            self.outputs[name] = output_fingerprint(stage, fp)
+            return StageResult(name, "skipped")
+        if self._up_to_date(stage, fp):
+            self.outputs[name] = self.state[name]["output"]
+            return StageResult(name, "skipped")
+        if self.dry_run:
+            self.outputs[name] = fp  # downstream stages are then out of date too
+            return StageResult(name, "would run")
+        return ("run", fp)
+
+    def run(self, names: list[str]) -> bool:
+        pending = list(names)
+        running: dict = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while True:
+                progressed = True
+                while progressed and len(running) < self.jobs:
+                    progressed = False
+                    for name in list(pending):
+                        deps = [self.results.get(d) for d in self.stages[name].deps]
+                        if any(r is not None and r.status in ("failed", "blocked") for r in deps):
+                            self.results[name] = StageResult(name, "blocked")
+                        elif any(r is None for r in deps):
+                            continue
+                        elif len(running) >= self.jobs:
+                            break
+                        else:
+                            r = self._resolve(name)
+                            if isinstance(r, StageResult):
+                                self.results[name] = r
+                                print(f"= {name}: {r.status}")
+                            else:
+                                print(f"> {name}", flush=True)
+                                running[pool.submit(self._execute, self.stages[name], r[1])] = name
+                        pending.remove(name)
+                        progressed = True
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    res = fut.result()
+                    self.results[running.pop(fut)] = res
+                    print(f"< {res.name}: {res.status} in {res.seconds:.2f}s" + (f" ({res.error})" if res.error else ""))
+        return all(r.status not in ("failed", "blocked") for r in self.results.values())
+
+
+def print_summary(results: dict[str, StageResult], names: list[str], wall: float) -> None:
+    print("\nStage            status      seconds")
+    for n in names:
+        r = results.get(n)
+        if r is not None:
+            print(f"  {n:<15}{r.status:<11}{r.seconds:>8.2f}")
+    busy = sum(r.seconds for r in results.values())
+    print(f"  {'total':<15}{'':<11}{wall:>8.2f}  (stage time {busy:.2f}s)")
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    stages = build_stages()
+    parser = argparse.ArgumentParser(description="Run the end-to-end pipeline, skipping stages whose inputs are unchanged.")
+    parser.add_argument("--until", choices=list(stages), help="Stop after this stage (and the stages it needs)")
+    parser.add_argument("--force", nargs="*", choices=list(stages), metavar="STAGE",
+                        help="Re-run these stages and everything downstream (no names: all stages)")
+    parser.add_argument("--skip", nargs="+", choices=list(stages), default=[], metavar="STAGE",
+                        help="Treat these stages as done and use their current outputs")
+    parser.add_argument("--jobs", type=int, default=2, help="Stages run concurrently (default: 2)")
+    parser.add_argument("--state", default=str(DEFAULT_STATE_PATH), help=f"Fingerprint file (default: {DEFAULT_STATE_PATH})")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which stages are out of date")
+    parser.add_argument("--metrics-dir", help="Write per-stage step metrics here (sets METRICS_DIR, see instrumentation.py)")
+    parser.add_argument("--backend", choices=["sqlite", "duckdb"], default="sqlite",
+                        help="Engine for the marts, risk features and commercial tables (default: sqlite)")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+    stages = build_stages(args.backend)
+
+    db_url = get_db_url()
+
+    if args.metrics_dir:
+        os.environ["METRICS_DIR"] = str(Path(args.metrics_dir).expanduser().resolve())
+
+    # generate_data / load_data resolve ../data/raw against the working directory,
+    # and the package modules are imported by name
+    os.chdir(HERE)
+    for p in (HERE, RISK_DIR / "python", COMM_DIR / "python"):
+        if str(p) not in sys.path:
+            sys.path.insert(0, str(p))
+
+    names = select(stages, args.until)
+    force = set(stages) if args.force == [] else downstream(stages, args.force or [])
+    run_url = db_url
+    url = make_url(db_url)
+    if url.get_backend_name() == "sqlite" and "timeout" not in url.query:
+        # concurrent branches wait on each other's SQLite locks instead of failing;
+        # the stage modules get their engine from DB_URL, so pass it there
+        run_url = url.update_query_dict({"timeout": str(SQLITE_BUSY_TIMEOUT)}).render_as_string(hide_password=False)
+        os.environ["DB_URL"] = run_url
+    engine = get_engine(run_url)  # the same pooled engine the stages get from db_engine
+    t0 = time.perf_counter()
+    try:
+        pipeline = Pipeline(stages, Context(engine, db_url, args.backend), Path(args.state).expanduser().resolve(),
+                            force, set(args.skip), args.jobs, args.dry_run)
+        ok = pipeline.run(names)
+    finally:
+        dispose_engines()
+    print_summary(pipeline.results, names, time.perf_counter() - t0)
+    return 0 if ok else 1
 
-def main():
-    run(["python", "generate_data.py"])
-    run(["python", "load_data.py"])
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
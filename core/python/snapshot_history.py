@@ -0,0 +1,258 @@
+"""
+Compact loan-month history of mart_portfolio_snapshot_v2.
+
+The snapshot repeats each loan's attributes in every month, and most months
+change little. This store keeps:
+- the loan attributes once per loan, with its first and last month;
+- the DPD bucket and arrears as runs: a new run starts when the bucket changes
+  or when the month-on-month arrears change differs from the previous month's
+  (a loan that keeps missing the same instalment is one run);
+- EOP balance, which amortises every month, as int64 cent deltas per
+  loan-month (a first-month delta is the whole balance, and int32 cents stop
+  at $21.4M; compressed, the wider type adds about 4%).
+
+Arrears and balances are whole cents in the mart, so reconstruction is exact.
+Rows are addressed by loan and month, so reading a month (or a range) is a
+vectorised lookup over the active loans. Nothing is rebuilt by the read.
+
+  hist = load_history(get_engine(read_only=True))
+  hist.month("2024-06-30")                    # DataFrame shaped like the mart for that month
+  hist.range("2024-01-31", "2024-12-31")      # several months, ordered by month_key, loan_id
+  hist.loan(100042)                           # one loan's history
+
+The store is saved to core/data/snapshot_history.npz and rebuilt when the
+loaded loans, schedule, payments, mart SQL or mart backend change
+(portfolio_cube.book_fingerprint).
+
+Typical usage (from core/python):
+  python snapshot_history.py                         # build / load, print sizes
+  python snapshot_history.py --month 2024-06-30 --out ../../reports/snapshot_2024_06.csv
+  python snapshot_history.py --rebuild --verify      # compare every month with the mart
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from db_engine import get_engine
+from month_keys import month_end_from_key, month_key
+from portfolio_cube import BUCKETS, book_fingerprint
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_HISTORY_PATH = ROOT_DIR / "core" / "data" / "snapshot_history.npz"
+
+COLUMNS = ["month_end", "loan_id", "customer_id", "product_type", "channel", "origination_date",
+           "principal_nzd", "interest_rate_apr", "term_months", "arrears_amt", "dpd_bucket",
+           "eop_balance", "month_key", "orig_month_key"]
+STATIC = ["loan_id", "customer_id", "product_type", "channel", "origination_date",
+          "principal_nzd", "interest_rate_apr", "term_months", "orig_month_key"]
+SNAPSHOT_SQL = f"SELECT {', '.join(COLUMNS[1:])} FROM mart_portfolio_snapshot_v2 ORDER BY loan_id, month_key"
+
+
+def _cents(values) -> np.ndarray:
+    return np.round(np.nan_to_num(np.asarray(values, dtype=np.float64)) * 100).astype(np.int64)
+
+
+class SnapshotHistory:
+    """Per-loan attributes, (bucket, arrears) runs and balance deltas; rows are loan-major."""
+
+    def __init__(self, loans: dict[str, np.ndarray], first_key: np.ndarray, n_months: np.ndarray,
+                 run_row: np.ndarray, run_bucket: np.ndarray, run_arrears: np.ndarray, run_step: np.ndarray,
+                 balance_delta: np.ndarray, fingerprint: str = ""):
+        self.loans = loans                  # STATIC column -> array, one entry per loan (sorted by loan_id)
+        self.first_key = first_key          # int32 month_key of each loan's first row
+        self.n_months = n_months            # int32 rows per loan (contiguous months)
+        self.run_row = run_row              # int64 global row index where each run starts
+        self.run_bucket = run_bucket        # int8 code into BUCKETS
+        self.run_arrears = run_arrears      # int64 arrears cents at the run's first row
+        self.run_step = run_step            # int64 arrears cents added per month within the run
+        self.balance_delta = balance_delta  # int64 cents vs the previous month (first month: the balance)
+        self.fingerprint = fingerprint
+        self.row_ptr = np.concatenate([[0], np.cumsum(n_months, dtype=np.int64)])
+        self._balance: np.ndarray | None = None
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, fingerprint: str = "") -> "SnapshotHistory":
+        """Encode snapshot rows sorted by loan_id, month_key (each loan's months contiguous)."""
+        loan_ids = df["loan_id"].to_numpy(dtype=np.int64)
+        keys = df["month_key"].to_numpy(dtype=np.int64)
+        start = np.r_[True, loan_ids[1:] != loan_ids[:-1]] if len(df) else np.zeros(0, dtype=bool)
+        if len(df) and (np.any(np.diff(keys)[~start[1:]] != 1)):
+            raise ValueError("snapshot rows must be sorted by loan_id, month_key with no missing months")
+        first = np.flatnonzero(start)
+        n_months = np.diff(np.r_[first, len(df)]).astype(np.int32)
+        loans = {c: df[c].to_numpy()[first] for c in STATIC}
+
+        bucket = pd.Categorical(df["dpd_bucket"], categories=BUCKETS).codes.astype(np.int8)
+        if (bucket < 0).any():
+            raise ValueError("unknown dpd_bucket values in the snapshot")
+        arrears = _cents(df["arrears_amt"])
+        step = np.diff(arrears, prepend=0)
+        step[start] = 0
+        # a run continues while the bucket and the monthly arrears change stay the same,
+        # so every row of a run shares the step of its first row
+        same = np.r_[False, (bucket[1:] == bucket[:-1]) & (step[1:] == step[:-1])] if len(df) else start
+        run_row = np.flatnonzero(start | ~same)
+        run_step = step[run_row]
+        balance = _cents(df["eop_balance"])
+        delta = np.diff(balance, prepend=0)
+        delta[start] = balance[start]
+        return cls(loans, keys[first].astype(np.int32), n_months, run_row.astype(np.int64),
+                   bucket[run_row], arrears[run_row], run_step.astype(np.int64), delta, fingerprint)
+
+    # -- state -------------------------------------------------------------
+
+    def save(self, path: Path | str = DEFAULT_HISTORY_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez_compressed(
+                f, first_key=self.first_key, n_months=self.n_months, run_row=self.run_row,
+                run_bucket=self.run_bucket, run_arrears=self.run_arrears, run_step=self.run_step,
+                balance_delta=self.balance_delta, fingerprint=np.array(self.fingerprint),
+                **{f"loan_{c}": np.asarray(v, dtype=str if v.dtype == object else v.dtype) for c, v in self.loans.items()})
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path | str = DEFAULT_HISTORY_PATH) -> "SnapshotHistory":
+        with np.load(Path(path), allow_pickle=False) as z:
+            loans = {c: z[f"loan_{c}"] for c in STATIC}
+            for c in ("product_type", "channel", "origination_date"):
+                loans[c] = loans[c].astype(object)
+            return cls(loans, z["first_key"], z["n_months"], z["run_row"], z["run_bucket"], z["run_arrears"],
+                       z["run_step"], z["balance_delta"], str(z["fingerprint"]))
+
+    # -- reads -------------------------------------------------------------
+
+    @property
+    def rows(self) -> int:
+        return int(self.row_ptr[-1])
+
+    def _balance_cents(self) -> np.ndarray:
+        if self._balance is None:  # segmented prefix sum, once per process
+            total = np.cumsum(self.balance_delta, dtype=np.int64)
+            before = np.repeat(total[self.row_ptr[:-1]] - self.balance_delta[self.row_ptr[:-1]], self.n_months)
+            self._balance = total - before
+        return self._balance
+
+    def _rows(self, lo: int, hi: int, slots: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Global row indices and loan slots for months lo..hi (loan-major)."""
+        slots = np.arange(len(self.first_key)) if slots is None else slots
+        first = self.first_key[slots].astype(np.int64)
+        a = np.maximum(first, lo)
+        b = np.minimum(first + self.n_months[slots] - 1, hi)
+        n = np.clip(b - a + 1, 0, None)
+        which = np.repeat(np.arange(len(slots)), n)
+        offset = np.arange(int(n.sum())) - np.repeat(np.cumsum(n) - n, n)
+        rows = self.row_ptr[slots][which] + (a - first)[which] + offset
+        return rows, slots[which]
+
+    def _frame(self, rows: np.ndarray, slots: np.ndarray) -> pd.DataFrame:
+        run = np.searchsorted(self.run_row, rows, side="right") - 1
+        arrears = self.run_arrears[run] + self.run_step[run] * (rows - self.run_row[run])
+        keys = self.first_key[slots].astype(np.int64) + (rows - self.row_ptr[slots])
+        out = {c: v[slots] for c, v in self.loans.items()}
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        out.update(
+            month_key=keys,
+            month_end=month_end_from_key(uniq)[inverse] if len(keys) else np.array([], dtype=object),
+            arrears_amt=arrears / 100.0,
+            dpd_bucket=np.array(BUCKETS, dtype=object)[self.run_bucket[run]],
+            eop_balance=self._balance_cents()[rows] / 100.0,
+        )
+        return pd.DataFrame(out)[COLUMNS]
+
+    def range(self, first: str | None = None, last: str | None = None) -> pd.DataFrame:
+        """Snapshot rows for month_end first..last (inclusive; None = open), ordered by month_key, loan_id."""
+        lo = int(month_key([first])[0]) if first else -(2**31)
+        hi = (lo if last == first else int(month_key([last])[0])) if last else 2**31
+        rows, slots = self._rows(lo, hi)
+        df = self._frame(rows, slots)
+        return df.sort_values(["month_key", "loan_id"], kind="stable").reset_index(drop=True)
+
+    def month(self, month_end: str) -> pd.DataFrame:
+        """Snapshot rows for one month_end."""
+        return self.range(month_end, month_end)
+
+    def loan(self, loan_id: int) -> pd.DataFrame:
+        """Every month of one loan."""
+        slot = np.searchsorted(self.loans["loan_id"], loan_id)
+        if slot >= len(self.first_key) or self.loans["loan_id"][slot] != loan_id:
+            raise KeyError(f"loan {loan_id} is not in the history")
+        rows, slots = self._rows(-(2**31), 2**31, np.array([slot]))
+        return self._frame(rows, slots)
+
+
+def load_history(engine, path: Path | str | None = DEFAULT_HISTORY_PATH, rebuild: bool = False) -> SnapshotHistory:
+    """The saved history if it matches the loaded book (and not `rebuild`); otherwise build and save it."""
+    fp = book_fingerprint(engine)
+    if path and not rebuild and Path(path).exists():
+        hist = SnapshotHistory.load(path)
+        if hist.fingerprint == fp:
+            return hist
+    hist = SnapshotHistory.from_frame(pd.read_sql_query(text(SNAPSHOT_SQL), engine), fp)
+    if path:
+        hist.save(path)
+    return hist
+
+
+def verify(engine, hist: SnapshotHistory) -> int:
+    """Rows where the reconstruction differs from the mart (all months)."""
+    mart = pd.read_sql_query(text(SNAPSHOT_SQL), engine)
+    mine = hist.range().sort_values(["loan_id", "month_key"], kind="stable").reset_index(drop=True)
+    if len(mine) != len(mart):
+        return abs(len(mine) - len(mart))
+    diff = np.zeros(len(mart), dtype=bool)
+    for c in COLUMNS[1:]:
+        a, b = mine[c].to_numpy(), mart[c].to_numpy()
+        if c in ("principal_nzd", "interest_rate_apr", "arrears_amt", "eop_balance"):
+            diff |= ~np.isclose(a.astype(float), b.astype(float), rtol=0, atol=0.005, equal_nan=True)
+        else:
+            diff |= a.astype(str) != b.astype(str)
+    return int(diff.sum())
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or load the compact snapshot history and read from it.")
+    parser.add_argument("--history", default=str(DEFAULT_HISTORY_PATH), help=f"History file (default: {DEFAULT_HISTORY_PATH})")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild even if the saved history matches the book")
+    parser.add_argument("--month", help="Reconstruct this month_end (YYYY-MM-DD)")
+    parser.add_argument("--out", help="Write the reconstructed month to this CSV")
+    parser.add_argument("--verify", action="store_true", help="Compare every reconstructed row with the mart")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    engine = get_engine(read_only=True)
+    t0 = time.perf_counter()
+    hist = load_history(engine, args.history, rebuild=args.rebuild)
+    size = Path(args.history).stat().st_size if Path(args.history).exists() else 0
+    print(f"History: {len(hist.first_key):,} loans, {hist.rows:,} loan-months, {len(hist.run_row):,} status runs, "
+          f"{size:,} bytes on disk ({size / max(hist.rows, 1):.1f} per loan-month), ready in {time.perf_counter() - t0:.2f}s")
+
+    if args.month:
+        t0 = time.perf_counter()
+        df = hist.month(args.month)
+        print(f"{args.month}: {len(df):,} rows in {(time.perf_counter() - t0) * 1000:.1f} ms")
+        if args.out:
+            out = Path(args.out)
+            out.parent.mkdir(parents=True, exist_ok=True)
+            df.to_csv(out, index=False)
+            print(f"Saved: {out}")
+        else:
+            print(df.head(10).to_string(index=False))
+    if args.verify:
+        bad = verify(engine, hist)
+        print(f"Verify: {bad:,} rows differ from mart_portfolio_snapshot_v2")
+        return 1 if bad else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,265 @@
+"""
+Incremental vintage-curve engine (replacement for mart_vintage_60plus).
+
+Months are the integer month keys from the marts (months since 2000-01,
+see month_keys.py), so months on books is a subtraction, and the
+vintage x MOB matrices are built with a single np.bincount per measure.
+State is checkpointed to disk. Only months up to the data cut-off (the
+month of the latest payment) are folded in: the mart runs every loan to its
+last scheduled due date, and a month past the cut-off is revised by each
+payment ingested for it. On refresh only months after the last folded one and
+up to the new cut-off are read. The checkpoint is keyed on the loaded loans
+and schedule, the payments dated up to its last month and the mart SQL
+(source_fingerprint), so a reload, a payment back-dated into a folded month
+or a mart change rebuild it, while payments for later months only add months.
+
+Curves, each loan-weighted and balance-weighted:
+- marginal:   share of loans (balance) in 60+ at that MOB (= mart_vintage_60plus.rate_60plus up to the cut-off)
+- cumulative: share of loans (balance) that have been 60+ at any MOB up to that one
+
+Typical usage (from core/python):
+  python vintage_engine.py                 # refresh checkpoint, print latest curves
+  python vintage_engine.py --rebuild --to-db
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from db_engine import get_engine
+from month_keys import month_end_from_key
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_STATE_PATH = ROOT_DIR / "core" / "data" / "vintage_state.npz"
+CURVES_TABLE = "mart_vintage_curves"
+# SQL behind mart_portfolio_snapshot_v2; part of the checkpoint fingerprint
+MART_SQL = [ROOT_DIR / "core" / "sql" / "03_mart_views.sql", ROOT_DIR / "core" / "sql" / "03_mart_views_plus_balance.sql"]
+
+BAD_BUCKETS = ("DPD_60_89", "DPD_90_PLUS")
+MEASURES = ["loan_cnt", "bad_60plus_cnt", "ever_60plus_cnt", "eop_balance", "bal_60plus", "ever_bal_60plus"]
+NO_BAD = np.iinfo(np.int32).max
+
+
+class VintageEngine:
+    """Vintage x MOB count and balance matrices with per-loan first-60+ tracking."""
+
+    def __init__(self):
+        self.vintage0 = 0                              # month index of row 0
+        self.counts = np.zeros((len(MEASURES), 0, 0))  # (measure, vintage, mob)
+        self.loan_ids = np.zeros(0, dtype=np.int64)    # sorted
+        self.first_bad = np.zeros(0, dtype=np.int32)   # month index of first 60+, NO_BAD if never
+        self.last_month = -1
+        self.fingerprint = ""
+
+    # -- state -------------------------------------------------------------
+
+    def save(self, path: Path | str = DEFAULT_STATE_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            vintage0=self.vintage0,
+            counts=self.counts,
+            loan_ids=self.loan_ids,
+            first_bad=self.first_bad,
+            last_month=self.last_month,
+            fingerprint=np.array(self.fingerprint),
+        )
+
+    @classmethod
+    def load(cls, path: Path | str = DEFAULT_STATE_PATH) -> "VintageEngine":
+        eng = cls()
+        with np.load(Path(path), allow_pickle=False) as z:
+            eng.vintage0 = int(z["vintage0"])
+            eng.counts = z["counts"]
+            eng.loan_ids = z["loan_ids"]
+            eng.first_bad = z["first_bad"]
+            eng.last_month = int(z["last_month"])
+            eng.fingerprint = str(z["fingerprint"])
+        return eng
+
+    # -- updates -----------------------------------------------------------
+
+    def _grow(self, v_min: int, v_max: int, mob_max: int) -> None:
+        """Extend the matrices to cover vintages v_min..v_max and MOB 0..mob_max."""
+        _, V, M = self.counts.shape
+        if V == 0:
+            self.vintage0 = v_min
+            self.counts = np.zeros((len(MEASURES), v_max - v_min + 1, mob_max + 1))
+            return
+        before = max(0, self.vintage0 - v_min)
+        after = max(0, v_max - (self.vintage0 + V - 1))
+        right = max(0, mob_max + 1 - M)
+        if before or after or right:
+            self.counts = np.pad(self.counts, ((0, 0), (before, after), (0, right)))
+            self.vintage0 -= before
+
+    def _track_loans(self, loan_id: np.ndarray) -> np.ndarray:
+        new = np.setdiff1d(np.unique(loan_id), self.loan_ids, assume_unique=True)
+        if len(new):
+            ids = np.concatenate([self.loan_ids, new])
+            order = np.argsort(ids, kind="stable")
+            self.loan_ids = ids[order]
+            self.first_bad = np.concatenate([self.first_bad, np.full(len(new), NO_BAD, dtype=np.int32)])[order]
+        return np.searchsorted(self.loan_ids, loan_id)
+
+    def update(self, rows: pd.DataFrame) -> int:
+        """
+        Add loan-month rows (loan_id, month_key, orig_month_key, dpd_bucket, eop_balance)
+        for months after the last processed one. Returns the number of rows counted.
+        """
+        if rows.empty:
+            return 0
+        month = rows["month_key"].to_numpy(dtype=np.int32)
+        vintage = rows["orig_month_key"].to_numpy(dtype=np.int32)
+        keep = (month >= vintage) & (month > self.last_month)
+        if not keep.any():
+            return 0
+        month, vintage = month[keep], vintage[keep]
+        loan_id = rows["loan_id"].to_numpy(dtype=np.int64)[keep]
+        bad = rows["dpd_bucket"].isin(BAD_BUCKETS).to_numpy()[keep]
+        bal = rows["eop_balance"].fillna(0.0).to_numpy(dtype=np.float64)[keep]
+        mob = month - vintage
+
+        pos = self._track_loans(loan_id)
+        # earliest 60+ month per loan, folding this batch into the stored state
+        np.minimum.at(self.first_bad, pos[bad], month[bad])
+        ever = self.first_bad[pos] <= month
+
+        self._grow(int(vintage.min()), int(vintage.max()), int(mob.max()))
+        _, V, M = self.counts.shape
+        flat = (vintage - self.vintage0).astype(np.int64) * M + mob
+        size = V * M
+        for k, w in enumerate([
+            None,
+            bad.astype(np.float64),
+            ever.astype(np.float64),
+            bal,
+            bal * bad,
+            bal * ever,
+        ]):
+            self.counts[k] += np.bincount(flat, weights=w, minlength=size).reshape(V, M)
+        self.last_month = max(self.last_month, int(month.max()))
+        return int(keep.sum())
+
+    # -- outputs -----------------------------------------------------------
+
+    def curves(self) -> pd.DataFrame:
+        """Long vintage_month x months_on_books table with all measures and rates."""
+        v, m = np.nonzero(self.counts[0])
+        c = self.counts[:, v, m]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            df = pd.DataFrame({
+                "vintage_idx": (v + self.vintage0).astype(np.int32),
+                "vintage_month": month_end_from_key(v + self.vintage0),
+                "months_on_books": m.astype(np.int32),
+                **{name: c[k] for k, name in enumerate(MEASURES)},
+                "rate_60plus": c[1] / c[0],
+                "cum_rate_60plus": c[2] / c[0],
+                "bal_rate_60plus": np.where(c[3] > 0, c[4] / c[3], np.nan),
+                "bal_cum_rate_60plus": np.where(c[3] > 0, c[5] / c[3], np.nan),
+            })
+        df[MEASURES[:3]] = df[MEASURES[:3]].astype(np.int64)
+        return df
+
+
+def loans_fingerprint(engine) -> str:
+    """Cheap identity of the loaded loans (fct_loans only)."""
+    r = pd.read_sql_query(
+        text("SELECT COUNT(*) AS n, MAX(loan_id) AS mx, MIN(origination_date) AS mn FROM fct_loans"), engine
+    ).iloc[0]
+    return f"{r['n']}|{r['mx']}|{r['mn']}"
+
+
+def mart_sql_digest() -> str:
+    h = hashlib.sha256()
+    for p in MART_SQL:
+        h.update(p.read_bytes() if p.exists() else b"-")
+    return h.hexdigest()[:16]
+
+
+def source_fingerprint(engine, through: int | None = None) -> str:
+    """
+    Identity of everything the snapshot mart is computed from: the loans, the
+    schedule and payments (row counts, id ranges, amount totals) and the mart
+    SQL. A reload, an ingested or changed payment or a mart change alters it.
+    With `through` (a month key) only payments up to that month count.
+    """
+    where, params = "", {}
+    if through is not None:
+        where, params = "WHERE payment_month_key <= :through", {"through": through}
+    with engine.connect() as conn:
+        sched = conn.execute(text(
+            "SELECT COUNT(*), MIN(schedule_id), MAX(schedule_id), SUM(scheduled_amount) FROM fct_schedule")).one()
+        pays = conn.execute(text(
+            f"SELECT COUNT(*), MIN(payment_id), MAX(payment_id), SUM(paid_amount) FROM fct_payments {where}"),
+            params).one()
+    facts = [f"{n}:{lo}:{hi}:{round(total or 0, 2)}" for n, lo, hi, total in (sched, pays)]
+    return "|".join([loans_fingerprint(engine), *facts, mart_sql_digest()])
+
+
+def data_cutoff(engine) -> int:
+    """Month key of the latest payment, the last month with observed data (-1 without payments)."""
+    with engine.connect() as conn:
+        hi = conn.execute(text("SELECT MAX(payment_month_key) FROM fct_payments")).scalar()
+    return -1 if hi is None else int(hi)
+
+
+def refresh(engine, state_path: Path | str | None = DEFAULT_STATE_PATH, rebuild: bool = False) -> VintageEngine:
+    """Load the checkpoint (unless stale or `rebuild`), add the months up to the data cut-off, save."""
+    cutoff = data_cutoff(engine)
+    vint = None
+    if state_path and not rebuild and Path(state_path).exists():
+        vint = VintageEngine.load(state_path)
+        if vint.last_month > cutoff or vint.fingerprint != source_fingerprint(engine, through=vint.last_month):
+            vint = None
+    if vint is None:
+        vint = VintageEngine()
+
+    if cutoff > vint.last_month:
+        rows = pd.read_sql_query(
+            text(
+                """
+                SELECT loan_id, month_key, orig_month_key, dpd_bucket, eop_balance
+                FROM mart_portfolio_snapshot_v2
+                WHERE month_key > :after AND month_key <= :cutoff
+                """
+            ),
+            engine,
+            params={"after": vint.last_month, "cutoff": cutoff},
+        )
+        vint.update(rows)
+        vint.last_month = cutoff
+    vint.fingerprint = source_fingerprint(engine, through=vint.last_month)
+    if state_path:
+        vint.save(state_path)
+    return vint
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Refresh vintage curves incrementally from mart_portfolio_snapshot_v2.")
+    parser.add_argument("--state", default=str(DEFAULT_STATE_PATH), help=f"Checkpoint path (default: {DEFAULT_STATE_PATH})")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore the checkpoint and rebuild from all months")
+    parser.add_argument("--to-db", action="store_true", help=f"Write curves to the {CURVES_TABLE} table (replaced)")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    engine = get_engine()
+    vint = refresh(engine, args.state, rebuild=args.rebuild)
+    curves = vint.curves()
+    print(f"Vintages: {curves['vintage_idx'].nunique():,}  cells: {len(curves):,}  "
+          f"through: {month_end_from_key([vint.last_month])[0]}")
+    if args.to_db:
+        curves.to_sql(CURVES_TABLE, engine, if_exists="replace", index=False, chunksize=10000)
+        print(f"Saved {CURVES_TABLE}: {len(curves):,}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,8 @@
 -- 01_schema.sql
 -- SQLite-first schema (no PostgreSQL-only features).
 -- Tables are created WITHOUT a schema prefix to keep SQLite simple.
+-- *_month_key columns are months since 2000-01 (core/python/month_keys.py),
+-- filled by the loader/generators; marts join and group on them.
 
 PRAGMA foreign_keys = ON;
 
@@ -12,6 +14,7 @@ DROP TABLE IF EXISTS dim_channels;
 DROP TABLE IF EXISTS dim_products;
 DROP TABLE IF EXISTS dim_customers;
 DROP TABLE IF EXISTS dim_macro_monthly;
+DROP TABLE IF EXISTS dim_month;
 
 -- Dimension: customers
 CREATE TABLE dim_customers (
@@ -44,6 +47,7 @@ CREATE TABLE fct_loans (
   customer_id        INTEGER NOT NULL REFERENCES dim_customers(customer_id),
   product_type       TEXT NOT NULL,
   origination_date   TEXT NOT NULL,      -- ISO date string YYYY-MM-DD
+  orig_month_key     INTEGER NOT NULL,   -- months since 2000-01
   principal_nzd      REAL NOT NULL,
   interest_rate_apr  REAL NOT NULL,
   term_months        INTEGER NOT NULL,
@@ -54,6 +58,7 @@ CREATE TABLE fct_loans (
 
 CREATE INDEX idx_loans_customer ON fct_loans(customer_id);
 CREATE INDEX idx_loans_origdate ON fct_loans(origination_date);
+CREATE INDEX idx_loans_orig_month ON fct_loans(orig_month_key);
 
 -- Fact: schedule
 CREATE TABLE fct_schedule (
@@ -61,34 +66,51 @@ CREATE TABLE fct_schedule (
   loan_id             INTEGER NOT NULL REFERENCES fct_loans(loan_id),
   installment_no      INTEGER NOT NULL,
   due_date            TEXT NOT NULL,     -- ISO date string YYYY-MM-DD
+  due_month_key       INTEGER NOT NULL,  -- months since 2000-01
   scheduled_amount    REAL NOT NULL,
   scheduled_principal REAL NOT NULL,
   scheduled_interest  REAL NOT NULL
 );
 
 CREATE INDEX idx_schedule_loan_due ON fct_schedule(loan_id, due_date);
+CREATE INDEX idx_schedule_loan_month ON fct_schedule(loan_id, due_month_key);
 
 -- Fact: payments
 CREATE TABLE fct_payments (
   payment_id         INTEGER PRIMARY KEY AUTOINCREMENT,
   loan_id            INTEGER NOT NULL REFERENCES fct_loans(loan_id),
   payment_date       TEXT NOT NULL,      -- ISO date string YYYY-MM-DD
+  payment_month_key  INTEGER NOT NULL,   -- months since 2000-01
   paid_amount        REAL NOT NULL
 );
 
 CREATE INDEX idx_payments_loan_date ON fct_payments(loan_id, payment_date);
+CREATE INDEX idx_payments_loan_month ON fct_payments(loan_id, payment_month_key);
 
 -- Optional: collections
 CREATE TABLE fct_collections (
   collection_id       INTEGER PRIMARY KEY AUTOINCREMENT,
   loan_id             INTEGER NOT NULL REFERENCES fct_loans(loan_id),
   event_date          TEXT NOT NULL,
+  event_month_key     INTEGER,           -- months since 2000-01
   action_type         TEXT,
   promised_to_pay_date TEXT
 );
 
 CREATE INDEX idx_collections_loan_date ON fct_collections(loan_id, event_date);
 
+-- Dimension: month calendar (one row per month between the earliest and latest
+-- fact dates; extended by 03_mart_views.sql and load_data.py)
+CREATE TABLE dim_month (
+  month_key          INTEGER PRIMARY KEY,  -- months since 2000-01
+  month_start        TEXT NOT NULL,        -- YYYY-MM-01
+  month_end          TEXT NOT NULL,        -- ISO date string YYYY-MM-DD
+  year               INTEGER NOT NULL,
+  month              INTEGER NOT NULL
+);
+
+CREATE UNIQUE INDEX idx_month_end ON dim_month(month_end);
+
 -- Optional: macro monthly
 CREATE TABLE dim_macro_monthly (
   month              TEXT PRIMARY KEY,   -- month start YYYY-MM-01
@@ -1,7 +1,10 @@
 -- 03_mart_views.sql
 -- SQLite-compatible marts (no PostgreSQL-only functions).
+-- Months are joined, grouped and ordered on integer month keys (months since 2000-01);
+-- the ISO month_end for Power BI comes from dim_month.
 
 DROP VIEW IF EXISTS mart_vintage_60plus;
+DROP VIEW IF EXISTS mart_dpd_migration_segment;
 DROP VIEW IF EXISTS mart_dpd_migration;
 DROP VIEW IF EXISTS mart_portfolio_snapshot;
 DROP VIEW IF EXISTS mart_loan_dpd_bucket;
@@ -9,22 +12,43 @@ DROP VIEW IF EXISTS mart_loan_arrears;
 DROP VIEW IF EXISTS mart_loan_due_paid;
 DROP VIEW IF EXISTS v_month_ends;
 
--- Month ends (calendar)
-CREATE VIEW v_month_ends AS
-WITH RECURSIVE months(m) AS (
-  SELECT date('2022-01-01')
+-- Month calendar: extend dim_month to cover every month between the earliest
+-- and latest fact dates (existing months are kept)
+INSERT OR IGNORE INTO dim_month (month_key, month_start, month_end, year, month)
+WITH RECURSIVE bounds AS (
+  SELECT MIN(lo) AS lo, MAX(hi) AS hi
+  FROM (
+    SELECT MIN(orig_month_key) AS lo, MAX(orig_month_key) AS hi FROM fct_loans
+    UNION ALL
+    SELECT MIN(due_month_key), MAX(due_month_key) FROM fct_schedule
+    UNION ALL
+    SELECT MIN(payment_month_key), MAX(payment_month_key) FROM fct_payments
+  )
+),
+keys(k) AS (
+  SELECT lo FROM bounds WHERE lo IS NOT NULL
   UNION ALL
-  SELECT date(m, '+1 month') FROM months WHERE m < date('2026-12-01')
+  SELECT k + 1 FROM keys, bounds WHERE k < bounds.hi
 )
-SELECT date(m, 'start of month', '+1 month', '-1 day') AS month_end
-FROM months;
+SELECT
+  k,
+  date('2000-01-01', '+' || k || ' months'),
+  date('2000-01-01', '+' || (k + 1) || ' months', '-1 day'),
+  2000 + k / 12,
+  k % 12 + 1
+FROM keys;
+
+-- Month ends (compatibility view over dim_month)
+CREATE VIEW v_month_ends AS
+SELECT month_end
+FROM dim_month;
 
 -- Scheduled vs paid same-month by loan
 CREATE VIEW mart_loan_due_paid AS
 WITH sch AS (
   SELECT
     loan_id,
-    date(due_date, 'start of month', '+1 month', '-1 day') AS due_month_end,
+    due_month_key,
     SUM(scheduled_amount) AS scheduled_amt
   FROM fct_schedule
   GROUP BY 1,2
@@ -32,20 +56,23 @@ WITH sch AS (
 pay AS (
   SELECT
     loan_id,
-    date(payment_date, 'start of month', '+1 month', '-1 day') AS pay_month_end,
+    payment_month_key,
     SUM(paid_amount) AS paid_amt
   FROM fct_payments
   GROUP BY 1,2
 )
 SELECT
   s.loan_id,
-  s.due_month_end,
+  m.month_end AS due_month_end,
   s.scheduled_amt,
-  COALESCE(p.paid_amt, 0) AS paid_amt_same_month
+  COALESCE(p.paid_amt, 0) AS paid_amt_same_month,
+  s.due_month_key
 FROM sch s
+JOIN dim_month m
+  ON m.month_key = s.due_month_key
 LEFT JOIN pay p
   ON p.loan_id = s.loan_id
- AND p.pay_month_end = s.due_month_end;
+ AND p.payment_month_key = s.due_month_key;
 
 -- Cumulative arrears
 CREATE VIEW mart_loan_arrears AS
@@ -53,6 +80,7 @@ WITH base AS (
   SELECT
     loan_id,
     due_month_end AS month_end,
+    due_month_key AS month_key,
     scheduled_amt,
     paid_amt_same_month
   FROM mart_loan_due_paid
@@ -61,10 +89,11 @@ cum AS (
   SELECT
     loan_id,
     month_end,
+    month_key,
     scheduled_amt,
     paid_amt_same_month,
-    SUM(scheduled_amt) OVER (PARTITION BY loan_id ORDER BY month_end) AS cum_scheduled,
-    SUM(paid_amt_same_month) OVER (PARTITION BY loan_id ORDER BY month_end) AS cum_paid
+    SUM(scheduled_amt) OVER (PARTITION BY loan_id ORDER BY month_key) AS cum_scheduled,
+    SUM(paid_amt_same_month) OVER (PARTITION BY loan_id ORDER BY month_key) AS cum_paid
   FROM base
 )
 SELECT
@@ -72,7 +101,8 @@ SELECT
   month_end,
   scheduled_amt,
   paid_amt_same_month,
-  (cum_scheduled - cum_paid) AS arrears_amt
+  (cum_scheduled - cum_paid) AS arrears_amt,
+  month_key
 FROM cum;
 
 -- DPD bucket approximation via missed-installments proxy
@@ -86,18 +116,26 @@ a AS (
   SELECT
     ar.loan_id,
     ar.month_end,
+    ar.month_key,
     ar.arrears_amt,
     COALESCE(s.avg_inst, 1) AS avg_inst
   FROM mart_loan_arrears ar
   LEFT JOIN s ON s.loan_id = ar.loan_id
 ),
+r AS (
+  -- rounded to cents: float noise in the running sums must not pick the bucket
+  SELECT loan_id, month_end, month_key, ROUND(arrears_amt, 2) AS arrears_amt, avg_inst
+  FROM a
+),
 b AS (
   SELECT
     loan_id,
     month_end,
+    month_key,
     arrears_amt,
-    MAX(0, (arrears_amt * 1.0 / NULLIF(avg_inst,0))) AS missed_inst
-  FROM a
+    -- rounded so an exact multiple of the instalment lands in the same bucket on every engine
+    ROUND(MAX(0, (arrears_amt * 1.0 / NULLIF(avg_inst,0))), 6) AS missed_inst
+  FROM r
 )
 SELECT
   loan_id,
@@ -110,7 +148,8 @@ SELECT
     WHEN missed_inst < 2.0 THEN 'DPD_30_59'
     WHEN missed_inst < 3.0 THEN 'DPD_60_89'
     ELSE 'DPD_90_PLUS'
-  END AS dpd_bucket
+  END AS dpd_bucket,
+  month_key
 FROM b;
 
 -- Portfolio snapshot v1
@@ -126,7 +165,9 @@ SELECT
   l.interest_rate_apr,
   l.term_months,
   b.arrears_amt,
-  b.dpd_bucket
+  b.dpd_bucket,
+  b.month_key,
+  l.orig_month_key
 FROM mart_loan_dpd_bucket b
 JOIN fct_loans l
   ON l.loan_id = b.loan_id;
@@ -138,7 +179,7 @@ WITH x AS (
     loan_id,
     month_end,
     dpd_bucket,
-    LAG(dpd_bucket) OVER (PARTITION BY loan_id ORDER BY month_end) AS prev_bucket
+    LAG(dpd_bucket) OVER (PARTITION BY loan_id ORDER BY month_key) AS prev_bucket
   FROM mart_loan_dpd_bucket
 )
 SELECT
@@ -150,37 +191,54 @@ FROM x
 WHERE prev_bucket IS NOT NULL
 GROUP BY 1,2,3;
 
--- Vintage 60+ rate by MOB
+-- Migration matrix by product x channel (input to the migration simulation)
+CREATE VIEW mart_dpd_migration_segment AS
+WITH x AS (
+  SELECT
+    b.loan_id,
+    b.month_end,
+    b.dpd_bucket,
+    LAG(b.dpd_bucket) OVER (PARTITION BY b.loan_id ORDER BY b.month_key) AS prev_bucket
+  FROM mart_loan_dpd_bucket b
+)
+SELECT
+  x.month_end,
+  l.product_type,
+  l.channel,
+  x.prev_bucket AS from_bucket,
+  x.dpd_bucket AS to_bucket,
+  COUNT(*) AS loan_count
+FROM x
+JOIN fct_loans l ON l.loan_id = x.loan_id
+WHERE x.prev_bucket IS NOT NULL
+GROUP BY 1,2,3,4,5;
+
+-- Vintage 60+ rate by MOB (see also core/python/vintage_engine.py)
 CREATE VIEW mart_vintage_60plus AS
-WITH orig AS (
+WITH mob AS (
   SELECT
-    loan_id,
-    date(origination_date, 'start of month', '+1 month', '-1 day') AS vintage_month
-  FROM fct_loans
-),
-snap AS (
-  SELECT loan_id, month_end, dpd_bucket
-  FROM mart_loan_dpd_bucket
+    l.orig_month_key AS vintage_key,
+    s.month_key - l.orig_month_key AS months_on_books,
+    s.dpd_bucket
+  FROM mart_loan_dpd_bucket s
+  JOIN fct_loans l ON l.loan_id = s.loan_id
+  WHERE s.month_key >= l.orig_month_key
 ),
-mob AS (
+agg AS (
   SELECT
-    s.loan_id,
-    o.vintage_month,
-    s.month_end,
-    (
-      (CAST(strftime('%Y', s.month_end) AS INTEGER) - CAST(strftime('%Y', o.vintage_month) AS INTEGER)) * 12
-      + (CAST(strftime('%m', s.month_end) AS INTEGER) - CAST(strftime('%m', o.vintage_month) AS INTEGER))
-    ) AS months_on_books,
-    s.dpd_bucket
-  FROM snap s
-  JOIN orig o ON o.loan_id = s.loan_id
-  WHERE s.month_end >= o.vintage_month
+    vintage_key,
+    months_on_books,
+    COUNT(*) AS loan_cnt,
+    SUM(CASE WHEN dpd_bucket IN ('DPD_60_89','DPD_90_PLUS') THEN 1 ELSE 0 END) AS bad_60plus_cnt
+  FROM mob
+  GROUP BY 1,2
 )
 SELECT
-  vintage_month,
-  months_on_books,
-  COUNT(*) AS loan_cnt,
-  SUM(CASE WHEN dpd_bucket IN ('DPD_60_89','DPD_90_PLUS') THEN 1 ELSE 0 END) AS bad_60plus_cnt,
-  (SUM(CASE WHEN dpd_bucket IN ('DPD_60_89','DPD_90_PLUS') THEN 1 ELSE 0 END) * 1.0 / NULLIF(COUNT(*),0)) AS rate_60plus
-FROM mob
-GROUP BY 1,2;
+  m.month_end AS vintage_month,
+  a.months_on_books,
+  a.loan_cnt,
+  a.bad_60plus_cnt,
+  (a.bad_60plus_cnt * 1.0 / NULLIF(a.loan_cnt,0)) AS rate_60plus
+FROM agg a
+JOIN dim_month m
+  ON m.month_key = a.vintage_key;
@@ -5,39 +5,53 @@ DROP VIEW IF EXISTS mart_principal_paid_by_month;
 
 -- Monthly principal repaid from schedule (proxy)
 CREATE VIEW mart_principal_paid_by_month AS
+WITH s AS (
+  SELECT
+    loan_id,
+    due_month_key AS month_key,
+    SUM(scheduled_principal) AS sched_principal
+  FROM fct_schedule
+  GROUP BY loan_id, due_month_key
+)
 SELECT
-  loan_id,
-  date(due_date, 'start of month', '+1 month', '-1 day') AS month_end,
-  SUM(scheduled_principal) AS sched_principal
-FROM fct_schedule
-GROUP BY 1,2;
+  s.loan_id,
+  m.month_end,
+  s.sched_principal,
+  s.month_key
+FROM s
+JOIN dim_month m
+  ON m.month_key = s.month_key;
 
--- EOP balance = orig principal - cumulative scheduled principal (clamped)
+-- EOP balance = orig principal - cumulative scheduled principal (clamped),
+-- for every dim_month month from origination onwards
 CREATE VIEW mart_balance_eop AS
 WITH p AS (
   SELECT
     l.loan_id,
     l.principal_nzd,
     m.month_end,
+    m.month_key,
     COALESCE(pp.sched_principal, 0) AS sched_principal
   FROM fct_loans l
-  JOIN (SELECT DISTINCT month_end FROM mart_loan_dpd_bucket) m ON 1=1
+  JOIN dim_month m
+    ON m.month_key >= l.orig_month_key
   LEFT JOIN mart_principal_paid_by_month pp
-    ON pp.loan_id = l.loan_id AND pp.month_end = m.month_end
-  WHERE m.month_end >= date(l.origination_date, 'start of month', '+1 month', '-1 day')
+    ON pp.loan_id = l.loan_id AND pp.month_key = m.month_key
 ),
 cum AS (
   SELECT
     loan_id,
     month_end,
+    month_key,
     principal_nzd,
-    SUM(sched_principal) OVER (PARTITION BY loan_id ORDER BY month_end) AS cum_principal
+    SUM(sched_principal) OVER (PARTITION BY loan_id ORDER BY month_key) AS cum_principal
   FROM p
 )
 SELECT
   loan_id,
   month_end,
-  ROUND(MAX(0, (principal_nzd - cum_principal)), 2) AS eop_balance
+  ROUND(MAX(0, (principal_nzd - cum_principal)), 2) AS eop_balance,
+  month_key
 FROM cum;
 
 -- Upgraded snapshot v2 (use this for Power BI)
@@ -54,7 +68,9 @@ SELECT
   s.term_months,
   s.arrears_amt,
   s.dpd_bucket,
-  b.eop_balance
+  b.eop_balance,
+  s.month_key,
+  s.orig_month_key
 FROM mart_portfolio_snapshot s
 LEFT JOIN mart_balance_eop b
-  ON b.loan_id = s.loan_id AND b.month_end = s.month_end;
+  ON b.loan_id = s.loan_id AND b.month_key = s.month_key;
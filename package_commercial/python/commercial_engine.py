@@ -0,0 +1,168 @@
+"""
+Commercial engine: interest income, funding cost, NII, expected loss and RAR
+per loan-month, computed in one vectorised pass and materialised into
+comm_loan_month.
+
+The EOP balance is derived directly from fct_schedule (original principal
+minus cumulative scheduled principal, clamped at 0 -- the same definition as
+mart_balance_eop) with a grouped cumulative sum, so the commercial marts use
+the real balance instead of the `principal_nzd` proxy without paying for the
+mart_balance_eop cross-join.
+
+Typical usage (from repo root, after package_commercial/sql/20_commercial_marts.sql):
+  python package_commercial/python/commercial_engine.py
+  python package_commercial/python/commercial_engine.py --month-end 2025-12-31
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+COMM_TABLE = "comm_loan_month"
+
+# Assumptions documented in docs/methodology_commercial.md
+FUNDING_RATE = 0.055
+LGD_ASSUMPTION = 0.55
+PD_PROXY = {
+    "DPD_0": 0.01,
+    "DPD_1_29": 0.03,
+    "DPD_30_59": 0.10,
+    "DPD_60_89": 0.30,
+    "DPD_90_PLUS": 0.55,
+}
+
+COMM_COLS = [
+    "month_end", "loan_id", "product_type", "channel", "dpd_bucket",
+    "eop_balance", "interest_rate_apr",
+    "interest_income_est", "funding_cost_est", "nii_est",
+    "pd_proxy", "lgd_assumption", "expected_loss_est", "rar_profit_est",
+]
+
+
+def _month_filter(col: str, month_ends: list[str] | None) -> tuple[str, dict]:
+    if not month_ends:
+        return "", {}
+    return f"WHERE {col} IN :months", {"months": month_ends}
+
+
+def _read(engine, sql: str, params: dict) -> pd.DataFrame:
+    q = text(sql)
+    if "months" in params:
+        q = q.bindparams(bindparam("months", expanding=True))
+    return pd.read_sql_query(q, engine, params=params)
+
+
+def load_loan_months(engine, month_ends: list[str] | None = None) -> pd.DataFrame:
+    """Loan-month rows (DPD status + loan terms) from mart_portfolio_snapshot."""
+    where, params = _month_filter("month_end", month_ends)
+    return _read(
+        engine,
+        f"""
+        SELECT month_end, month_key, loan_id, product_type, channel, principal_nzd, interest_rate_apr, dpd_bucket
+        FROM mart_portfolio_snapshot
+        {where}
+        """,
+        params,
+    )
+
+
+def eop_balance_by_loan_month(engine) -> pd.DataFrame:
+    """
+    EOP balance per (loan_id, month) from fct_schedule.
+
+    Months are the integer due_month_key (months since 2000-01), so no
+    per-row date arithmetic is needed and the group-by follows
+    idx_schedule_loan_month.
+    """
+    sched = pd.read_sql_query(
+        text(
+            """
+            SELECT s.loan_id, s.due_month_key AS month_key, SUM(s.scheduled_principal) AS sched_principal
+            FROM fct_schedule s
+            GROUP BY s.loan_id, s.due_month_key
+            """
+        ),
+        engine,
+    )
+    principal = pd.read_sql_query(text("SELECT loan_id, principal_nzd FROM fct_loans"), engine)
+
+    sched = sched.sort_values(["loan_id", "month_key"], kind="mergesort")
+    sched["cum_principal"] = sched.groupby("loan_id", sort=False)["sched_principal"].cumsum()
+    sched = sched.merge(principal, on="loan_id", how="left")
+    sched["eop_balance"] = np.maximum(0.0, sched["principal_nzd"] - sched["cum_principal"]).round(2)
+    return sched[["loan_id", "month_key", "eop_balance"]]
+
+
+def compute_commercial(loan_months: pd.DataFrame, balances: pd.DataFrame) -> pd.DataFrame:
+    """All commercial measures for each loan-month in one vectorised pass."""
+    df = loan_months.copy()
+    df["month_end"] = df["month_end"].astype(str).str[:10]
+    df = df.merge(balances, on=["loan_id", "month_key"], how="left")
+
+    bal = df["eop_balance"].to_numpy(dtype=float)
+    apr = df["interest_rate_apr"].to_numpy(dtype=float)
+    pd_proxy = df["dpd_bucket"].map(PD_PROXY).fillna(PD_PROXY["DPD_90_PLUS"]).to_numpy(dtype=float)
+
+    int_income = bal * apr / 12.0
+    funding_cost = bal * FUNDING_RATE / 12.0
+    nii = int_income - funding_cost
+    expected_loss = bal * pd_proxy * LGD_ASSUMPTION
+
+    df["interest_income_est"] = np.round(int_income, 2)
+    df["funding_cost_est"] = np.round(funding_cost, 2)
+    df["nii_est"] = np.round(nii, 2)
+    df["pd_proxy"] = pd_proxy
+    df["lgd_assumption"] = LGD_ASSUMPTION
+    df["expected_loss_est"] = np.round(expected_loss, 2)
+    df["rar_profit_est"] = np.round(nii - expected_loss, 2)
+    return df[COMM_COLS]
+
+
+def materialize(engine, month_ends: Iterable[str] | None = None, chunksize: int = 10000) -> int:
+    """
+    Recompute comm_loan_month for the given month_ends (all months when None).
+
+    The table itself is created by 20_commercial_marts.sql; affected months are
+    replaced inside one transaction. Returns the number of rows written.
+    """
+    months = sorted({str(m)[:10] for m in month_ends}) if month_ends else None
+    out = compute_commercial(load_loan_months(engine, months), eop_balance_by_loan_month(engine))
+
+    with engine.begin() as conn:
+        if months:
+            conn.execute(
+                text(f"DELETE FROM {COMM_TABLE} WHERE month_end IN :months").bindparams(bindparam("months", expanding=True)),
+                {"months": months},
+            )
+        else:
+            conn.execute(text(f"DELETE FROM {COMM_TABLE}"))
+        # plain executemany: far cheaper than method="multi" for wide rows
+        out.to_sql(COMM_TABLE, conn, if_exists="append", index=False, chunksize=chunksize)
+    return len(out)
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Materialise per loan-month commercial measures into comm_loan_month.")
+    parser.add_argument("--month-end", action="append", help="Only recompute this month_end (repeatable); default: all")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    sys.path.append(str(ROOT_DIR / "core" / "python"))
+    from db_engine import get_engine
+
+    engine = get_engine()
+    n = materialize(engine, args.month_end)
+    print(f"Saved {COMM_TABLE}: {n:,}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+"""
+Portfolio scenario / stress-test engine on the commercial loan-month data.
+
+Applies a grid of funding-cost, PD-multiplier and LGD shocks (optionally with
+a macro overlay from dim_macro_monthly) to comm_loan_month and produces a
+scenario x month_end x segment (product_type x channel) RAR cube.
+
+The loan-month arrays are reduced once to balance and interest-income totals
+per (month, segment, DPD bucket). Every measure is linear in those totals
+given a scenario (the PD is capped at 1 per bucket), so each scenario costs
+O(months x segments x buckets) regardless of portfolio size. Scenario blocks
+can be spread over a process pool (--workers); since each block returns its
+slice of the cube, the pool pays off for large grids with many macro-driven
+months rather than for small ones.
+
+Typical usage (from repo root, after commercial_engine.py):
+  python package_commercial/python/scenario_engine.py \
+      --funding-rates 0.045,0.055,0.07 --pd-multipliers 1,1.5,2,3 --lgds 0.45,0.55,0.65
+  python package_commercial/python/scenario_engine.py --macro-beta 0.25 --to-db
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from commercial_engine import COMM_TABLE, FUNDING_RATE, LGD_ASSUMPTION, PD_PROXY
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_OUTPUT_PATH = ROOT_DIR / "reports" / "scenario_rar_cube.csv"
+SCENARIO_TABLE = "comm_scenario_rar"
+
+BUCKETS = list(PD_PROXY)
+MEASURES = ["eop_balance", "interest_income", "funding_cost", "nii", "expected_loss", "rar_profit"]
+
+
+@dataclass
+class Scenario:
+    name: str
+    funding_rate: float = FUNDING_RATE
+    pd_multiplier: float = 1.0
+    lgd: float = LGD_ASSUMPTION
+    # PD sensitivity to unemployment: multiplier x (1 + macro_beta x (u_t - mean u)), per month
+    macro_beta: float = 0.0
+
+
+@dataclass
+class PortfolioBase:
+    """Balance and interest income summed per (month, segment, bucket)."""
+
+    month_ends: list[str]
+    segments: list[tuple[str, str]]
+    balance: np.ndarray          # (M, G, B)
+    interest_income: np.ndarray  # (M, G, B)
+    unemployment_dev: np.ndarray  # (M,) deviation from the window mean; zeros when no macro data
+
+
+def load_base(engine) -> PortfolioBase:
+    """Reduce comm_loan_month to (month, segment, bucket) totals with integer-coded bincounts."""
+    df = pd.read_sql_query(
+        text(f"SELECT month_end, product_type, channel, dpd_bucket, eop_balance, interest_rate_apr FROM {COMM_TABLE}"),
+        engine,
+    )
+    if df.empty:
+        raise SystemExit(f"{COMM_TABLE} is empty. Run package_commercial/python/commercial_engine.py first.")
+
+    m_idx, month_ends = pd.factorize(df["month_end"].astype(str).str[:10], sort=True)
+    g_idx, segments = pd.MultiIndex.from_frame(df[["product_type", "channel"]]).factorize(sort=True)
+    b_idx = df["dpd_bucket"].map({b: i for i, b in enumerate(BUCKETS)}).fillna(len(BUCKETS) - 1).to_numpy(dtype=np.int64)
+
+    M, G, B = len(month_ends), len(segments), len(BUCKETS)
+    flat = (m_idx.astype(np.int64) * G + g_idx) * B + b_idx
+    bal = df["eop_balance"].fillna(0.0).to_numpy(dtype=np.float64)
+    income = bal * df["interest_rate_apr"].to_numpy(dtype=np.float64) / 12.0
+
+    return PortfolioBase(
+        month_ends=list(month_ends),
+        segments=[tuple(s) for s in segments],
+        balance=np.bincount(flat, weights=bal, minlength=M * G * B).reshape(M, G, B),
+        interest_income=np.bincount(flat, weights=income, minlength=M * G * B).reshape(M, G, B),
+        unemployment_dev=_unemployment_dev(engine, list(month_ends)),
+    )
+
+
+def _unemployment_dev(engine, month_ends: list[str]) -> np.ndarray:
+    try:
+        macro = pd.read_sql_query(text("SELECT month, unemployment_rate FROM dim_macro_monthly"), engine)
+    except Exception:
+        macro = pd.DataFrame(columns=["month", "unemployment_rate"])
+    u = pd.Series(macro["unemployment_rate"].to_numpy(dtype=float), index=macro["month"].astype(str).str[:7])
+    series = pd.Series([m[:7] for m in month_ends]).map(u)
+    if series.notna().sum() == 0:
+        return np.zeros(len(month_ends))
+    series = series.ffill().bfill()
+    return (series - series.mean()).to_numpy(dtype=np.float64)
+
+
+def evaluate(base: PortfolioBase, scenarios: Sequence[Scenario]) -> np.ndarray:
+    """RAR cube for a block of scenarios: shape (S, M, G, len(MEASURES))."""
+    f = np.array([s.funding_rate for s in scenarios])[:, None, None]                 # (S,1,1)
+    lgd = np.array([s.lgd for s in scenarios])[:, None, None, None]                  # (S,1,1,1)
+    mult = np.array([s.pd_multiplier for s in scenarios])[:, None]                   # (S,1)
+    beta = np.array([s.macro_beta for s in scenarios])[:, None]                      # (S,1)
+    mult = np.maximum(0.0, mult * (1.0 + beta * base.unemployment_dev[None, :]))     # (S,M)
+
+    pd_base = np.array([PD_PROXY[b] for b in BUCKETS])                               # (B,)
+    pd_s = np.minimum(1.0, mult[:, :, None] * pd_base[None, None, :])                # (S,M,B)
+
+    bal = base.balance.sum(axis=2)[None]                                             # (1,M,G)
+    income = base.interest_income.sum(axis=2)[None]                                  # (1,M,G)
+    funding = bal * f / 12.0                                                         # (S,M,G)
+    el = np.einsum("mgb,smb->smg", base.balance, pd_s) * lgd[..., 0]                 # (S,M,G)
+    nii = income - funding
+
+    S = len(scenarios)
+    out = np.empty((S,) + base.balance.shape[:2] + (len(MEASURES),))
+    out[..., 0] = np.broadcast_to(bal, funding.shape)
+    out[..., 1] = np.broadcast_to(income, funding.shape)
+    out[..., 2] = funding
+    out[..., 3] = nii
+    out[..., 4] = el
+    out[..., 5] = nii - el
+    return out
+
+
+def run_scenarios(base: PortfolioBase, scenarios: Sequence[Scenario], workers: int = 1, block: int = 64) -> np.ndarray:
+    """Evaluate all scenarios, in blocks of `block` across `workers` processes."""
+    blocks = [list(scenarios[i:i + block]) for i in range(0, len(scenarios), block)]
+    if workers <= 1 or len(blocks) <= 1:
+        return np.concatenate([evaluate(base, b) for b in blocks], axis=0)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return np.concatenate(list(pool.map(evaluate, itertools.repeat(base), blocks)), axis=0)
+
+
+def cube_to_frame(base: PortfolioBase, scenarios: Sequence[Scenario], cube: np.ndarray, drop_empty: bool = True) -> pd.DataFrame:
+    """Long scenario x month_end x product_type x channel table (segment-months with no balance dropped)."""
+    S, M, G, _ = cube.shape
+    idx = pd.MultiIndex.from_product([range(S), range(M), range(G)], names=["s", "m", "g"])
+    df = pd.DataFrame(cube.reshape(S * M * G, -1), columns=MEASURES, index=idx).reset_index()
+    df.insert(0, "scenario", np.array([s.name for s in scenarios])[df["s"]])
+    df.insert(1, "funding_rate", np.array([s.funding_rate for s in scenarios])[df["s"]])
+    df.insert(2, "pd_multiplier", np.array([s.pd_multiplier for s in scenarios])[df["s"]])
+    df.insert(3, "lgd", np.array([s.lgd for s in scenarios])[df["s"]])
+    df.insert(4, "macro_beta", np.array([s.macro_beta for s in scenarios])[df["s"]])
+    df.insert(5, "month_end", np.array(base.month_ends)[df["m"]])
+    seg = np.array(base.segments, dtype=object)
+    df.insert(6, "product_type", seg[df["g"], 0])
+    df.insert(7, "channel", seg[df["g"], 1])
+    df = df.drop(columns=["s", "m", "g"])
+    if drop_empty:
+        df = df[(df["eop_balance"] != 0) | (df["interest_income"] != 0)].reset_index(drop=True)
+    return df
+
+
+def scenario_grid(funding_rates: Iterable[float], pd_multipliers: Iterable[float], lgds: Iterable[float], macro_beta: float = 0.0) -> list[Scenario]:
+    return [
+        Scenario(name=f"f{f:g}_pd{m:g}_lgd{l:g}" + (f"_b{macro_beta:g}" if macro_beta else ""),
+                 funding_rate=f, pd_multiplier=m, lgd=l, macro_beta=macro_beta)
+        for f, m, l in itertools.product(funding_rates, pd_multipliers, lgds)
+    ]
+
+
+def _floats(s: str) -> list[float]:
+    return [float(x) for x in s.split(",") if x.strip()]
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a grid of funding / PD / LGD stress scenarios over comm_loan_month.")
+    parser.add_argument("--funding-rates", type=_floats, default=[FUNDING_RATE], help="Comma-separated annual funding rates")
+    parser.add_argument("--pd-multipliers", type=_floats, default=[1.0, 1.5, 2.0], help="Comma-separated PD multipliers")
+    parser.add_argument("--lgds", type=_floats, default=[LGD_ASSUMPTION], help="Comma-separated LGD values")
+    parser.add_argument("--macro-beta", type=float, default=0.0, help="PD sensitivity to unemployment deviation (dim_macro_monthly)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for scenario blocks (default: 1)")
+    parser.add_argument("--output", default=str(DEFAULT_OUTPUT_PATH), help=f"Output CSV path (default: {DEFAULT_OUTPUT_PATH})")
+    parser.add_argument("--to-db", action="store_true", help=f"Also write the cube to the {SCENARIO_TABLE} table (replaced)")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    sys.path.append(str(ROOT_DIR / "core" / "python"))
+    from db_engine import get_engine
+
+    engine = get_engine()
+    base = load_base(engine)
+    scenarios = scenario_grid(args.funding_rates, args.pd_multipliers, args.lgds, args.macro_beta)
+    if args.macro_beta and not base.unemployment_dev.any():
+        print("  dim_macro_monthly has no unemployment data; macro overlay has no effect.")
+
+    cube = run_scenarios(base, scenarios, workers=args.workers)
+    out = cube_to_frame(base, scenarios, cube)
+    print(f"Scenarios: {len(scenarios)}  months: {len(base.month_ends)}  segments: {len(base.segments)}")
+
+    output_path = Path(args.output).expanduser().resolve()
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    out.to_csv(output_path, index=False)
+    print(f"Saved: {output_path}")
+
+    if args.to_db:
+        out.to_sql(SCENARIO_TABLE, engine, if_exists="replace", index=False, chunksize=10000)
+        print(f"Saved {SCENARIO_TABLE}: {len(out):,}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
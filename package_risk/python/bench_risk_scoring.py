@@ -0,0 +1,98 @@
+"""
+Latency / throughput benchmark for on-demand risk scoring.
+
+Measures RiskScorer (feature lookup + predict_proba) for single loans,
+batches of 100 and batches of 10,000, and reports p50/p99 latency and
+loan-months scored per second. Keys are sampled from risk_features_store.
+
+Typical usage (from repo root, after train_risk_model.py):
+  python package_risk/python/bench_risk_scoring.py
+  python package_risk/python/bench_risk_scoring.py --repeats 200 --json reports/bench_risk_scoring.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from risk_scoring import DEFAULT_MODEL_PATH, FEATURE_STORE, RiskScorer
+
+# (label, batch size, default repeats)
+CASES = [
+    ("single", 1, 200),
+    ("batch_100", 100, 50),
+    ("batch_10k", 10_000, 5),
+]
+
+
+def sample_keys(engine, n: int, seed: int = 42) -> list[tuple[int, str]]:
+    keys = pd.read_sql_query(text(f"SELECT loan_id, month_end FROM {FEATURE_STORE}"), engine)
+    if keys.empty:
+        raise SystemExit(f"{FEATURE_STORE} is empty. Run package_risk/python/train_risk_model.py first.")
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(keys), size=n, replace=len(keys) < n)
+    return list(keys.iloc[idx].itertuples(index=False, name=None))
+
+
+def run_case(scorer: RiskScorer, keys: list[tuple[int, str]], batch: int, repeats: int) -> dict:
+    # warm-up: first call pays for connection setup and sklearn validation caches
+    scorer.score_batch(keys[:batch])
+
+    latencies = []
+    for i in range(repeats):
+        start = (i * batch) % max(1, len(keys) - batch + 1)
+        chunk = keys[start:start + batch]
+        t0 = time.perf_counter()
+        if batch == 1:
+            scorer.score(*chunk[0])
+        else:
+            scorer.score_batch(chunk)
+        latencies.append(time.perf_counter() - t0)
+
+    lat_ms = np.array(latencies) * 1000.0
+    return {
+        "batch_size": batch,
+        "repeats": repeats,
+        "p50_ms": round(float(np.percentile(lat_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(lat_ms, 99)), 3),
+        "mean_ms": round(float(lat_ms.mean()), 3),
+        "throughput_per_s": round(batch * repeats / float(np.sum(latencies)), 1),
+    }
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark on-demand risk scoring latency and throughput.")
+    parser.add_argument("--model-path", default=str(DEFAULT_MODEL_PATH), help="Fitted pipeline to load")
+    parser.add_argument("--repeats", type=int, default=None, help="Override repeats for every case")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write results as JSON to this path")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    scorer = RiskScorer.from_env(args.model_path)
+    max_batch = max(b for _, b, _ in CASES)
+    keys = sample_keys(scorer.engine, max_batch * 2)
+
+    results = {}
+    for label, batch, repeats in CASES:
+        results[label] = run_case(scorer, keys, batch, args.repeats or repeats)
+
+    print(f"{'case':<10} {'batch':>7} {'p50 ms':>10} {'p99 ms':>10} {'rows/s':>12}")
+    for label, r in results.items():
+        print(f"{label:<10} {r['batch_size']:>7} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f} {r['throughput_per_s']:>12,.1f}")
+
+    if args.json_path:
+        out = Path(args.json_path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Saved: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
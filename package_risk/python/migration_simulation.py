@@ -0,0 +1,337 @@
+"""
+Forward credit-loss simulation over the DPD migration matrix.
+
+Estimates a monthly bucket-to-bucket transition matrix per product x channel
+segment from mart_dpd_migration_segment, then projects the portfolio as of a
+month-end (mart_portfolio_snapshot_v2) N months forward in two ways:
+
+- Markov projection: batched matrix powers over all segments give the
+  expected DPD distribution and cumulative default rate per month ahead.
+- Monte Carlo: per-loan paths simulated with vectorised inverse-CDF draws,
+  giving the distribution (mean, VaR percentiles) of the portfolio loss.
+  Loans are processed in chunks to bound memory and (simulation block x loan
+  chunk) tasks can run in a process pool.
+
+Default is entry into DPD_90_PLUS, which is treated as absorbing; a loan
+that defaults within the horizon loses eop_balance x LGD (EAD is the
+current balance). Loans already in 90+ at the start are excluded from new
+losses.
+
+Typical usage (from repo root, after core/sql/03_mart_views*.sql):
+  python package_risk/python/migration_simulation.py --horizon 12 --sims 1000
+  python package_risk/python/migration_simulation.py --horizon 24 --sims 5000 --workers 4 --chunk-size 500000
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_OUTPUT_DIR = ROOT_DIR / "reports"
+
+BUCKETS = ["DPD_0", "DPD_1_29", "DPD_30_59", "DPD_60_89", "DPD_90_PLUS"]
+DEFAULT_STATE = BUCKETS.index("DPD_90_PLUS")
+LGD_ASSUMPTION = 0.55  # same blended LGD as the commercial marts
+
+# Pseudo-count pulling sparse segment rows towards the pooled portfolio row.
+CREDIBILITY = 10.0
+
+# A due month is fully observed while its payments keep pace with its instalments
+# (payments dated in the month >= this share of instalments due in it). Past the
+# extract's cut-off, late payments still arrive for a few months but new dues go
+# unpaid, so every loan drifts to 90+ there.
+PAYMENT_COVERAGE = 0.5
+
+
+@dataclass
+class TransitionModel:
+    segments: list[tuple[str, str]]
+    P: np.ndarray  # (G, B, B) row-stochastic, default state absorbing
+
+
+@dataclass
+class StartBook:
+    segment_idx: np.ndarray  # (n,) int
+    state: np.ndarray        # (n,) int8 bucket index
+    balance: np.ndarray      # (n,) float
+    month_end: str
+
+
+def data_cutoff(engine) -> str:
+    """
+    The last fully observed due month-end: at or before the latest payment, and
+    with payments still keeping pace with the instalments due (PAYMENT_COVERAGE).
+    The marts also carry scheduled months beyond it, where every loan would look
+    delinquent.
+    """
+    sys.path.append(str(ROOT_DIR / "core" / "python"))
+    from month_keys import month_end_from_key
+
+    latest = pd.read_sql_query(text("SELECT MAX(payment_date) AS d FROM fct_payments"), engine)["d"].iloc[0]
+    if latest is None:
+        raise SystemExit("fct_payments is empty; pass --as-of explicitly.")
+    # last month-end on or before the latest payment date
+    last_end = (pd.Timestamp(str(latest)[:10]) + pd.Timedelta(days=1) - pd.offsets.MonthEnd(1)).strftime("%Y-%m-%d")
+    months = pd.read_sql_query(
+        text(
+            """
+            SELECT s.due_month_key AS month_key, s.n AS dues, COALESCE(p.n, 0) AS payments
+            FROM (SELECT due_month_key, COUNT(*) AS n FROM fct_schedule GROUP BY due_month_key) s
+            LEFT JOIN (SELECT payment_month_key, COUNT(*) AS n FROM fct_payments GROUP BY payment_month_key) p
+              ON p.payment_month_key = s.due_month_key
+            """
+        ),
+        engine,
+    )
+    months["month_end"] = month_end_from_key(months["month_key"].to_numpy())
+    observed = months[(months["month_end"] <= last_end) & (months["payments"] >= PAYMENT_COVERAGE * months["dues"])]
+    if observed.empty:
+        raise SystemExit("No fully observed due month before the latest payment; pass --as-of explicitly.")
+    return str(observed["month_end"].max())
+
+
+def estimate_transitions(engine, as_of: str, lookback_months: int | None = 24,
+                         cutoff: str | None = None) -> TransitionModel:
+    """
+    Transition matrices per product x channel from mart_dpd_migration_segment,
+    up to `as_of` and never past the data cut-off (`cutoff`, default data_cutoff).
+    """
+    cutoff = cutoff or data_cutoff(engine)
+    mig = pd.read_sql_query(
+        text(
+            """
+            SELECT month_end, product_type, channel, from_bucket, to_bucket, loan_count
+            FROM mart_dpd_migration_segment
+            WHERE month_end <= :as_of AND month_end <= :cutoff
+            """
+        ),
+        engine,
+        params={"as_of": as_of, "cutoff": cutoff},
+    )
+    if mig.empty:
+        raise SystemExit("mart_dpd_migration_segment is empty. Build core/sql/03_mart_views.sql and load data first.")
+    if lookback_months:
+        months = sorted(mig["month_end"].astype(str).unique())
+        mig = mig[mig["month_end"].astype(str) >= months[max(0, len(months) - lookback_months)]]
+
+    g_idx, segments = pd.MultiIndex.from_frame(mig[["product_type", "channel"]]).factorize(sort=True)
+    bmap = {b: i for i, b in enumerate(BUCKETS)}
+    f_idx = mig["from_bucket"].map(bmap).to_numpy(dtype=np.int64)
+    t_idx = mig["to_bucket"].map(bmap).to_numpy(dtype=np.int64)
+
+    G, B = len(segments), len(BUCKETS)
+    counts = np.bincount(
+        (g_idx * B + f_idx) * B + t_idx,
+        weights=mig["loan_count"].to_numpy(dtype=np.float64),
+        minlength=G * B * B,
+    ).reshape(G, B, B)
+
+    pooled = counts.sum(axis=0)
+    pooled_rows = pooled.sum(axis=1, keepdims=True)
+    pooled_p = np.where(pooled_rows > 0, pooled / np.where(pooled_rows > 0, pooled_rows, 1), np.eye(B))
+
+    # credibility blend: (n_ij + c * pooled_p_ij) / (n_i + c)
+    P = (counts + CREDIBILITY * pooled_p[None]) / (counts.sum(axis=2, keepdims=True) + CREDIBILITY)
+    P[:, DEFAULT_STATE, :] = 0.0
+    P[:, DEFAULT_STATE, DEFAULT_STATE] = 1.0
+    return TransitionModel(segments=[tuple(s) for s in segments], P=P)
+
+
+def load_start_book(engine, model: TransitionModel, as_of: str) -> StartBook:
+    """The `as_of` month of mart_portfolio_snapshot_v2, coded to the model's segments."""
+    snap = pd.read_sql_query(
+        text(
+            """
+            SELECT month_end, product_type, channel, dpd_bucket, eop_balance
+            FROM mart_portfolio_snapshot_v2
+            WHERE month_end = :as_of
+            """
+        ),
+        engine,
+        params={"as_of": as_of},
+    )
+    seg_lookup = {s: i for i, s in enumerate(model.segments)}
+    seg = pd.Series(list(zip(snap["product_type"], snap["channel"]))).map(seg_lookup)
+    keep = seg.notna().to_numpy()
+    if not keep.all():
+        print(f"  {int((~keep).sum()):,} loans in segments without migration history skipped.")
+    snap = snap[keep]
+    return StartBook(
+        segment_idx=seg[keep].to_numpy(dtype=np.int64),
+        state=snap["dpd_bucket"].map({b: i for i, b in enumerate(BUCKETS)}).to_numpy(dtype=np.int8),
+        balance=snap["eop_balance"].fillna(0.0).to_numpy(dtype=np.float64),
+        month_end=as_of,
+    )
+
+
+def project_markov(model: TransitionModel, book: StartBook, horizon: int, lgd: float = LGD_ASSUMPTION) -> pd.DataFrame:
+    """
+    Expected bucket distribution, cumulative default rate and expected loss per
+    segment for each month ahead, via batched matrix powers.
+    """
+    G, B = model.P.shape[:2]
+    counts = np.zeros((G, B))
+    bal = np.zeros((G, B))
+    np.add.at(counts, (book.segment_idx, book.state), 1.0)
+    np.add.at(bal, (book.segment_idx, book.state), book.balance)
+
+    rows = []
+    Pn = np.broadcast_to(np.eye(B), model.P.shape).copy()
+    for n in range(1, horizon + 1):
+        Pn = Pn @ model.P                                          # (G, B, B) batched
+        dist = np.einsum("gb,gbk->gk", counts, Pn)                 # expected loans per bucket
+        # new defaults: balance starting outside 90+ that is in 90+ after n months
+        pd_n = Pn[:, :, DEFAULT_STATE].copy()
+        pd_n[:, DEFAULT_STATE] = 0.0
+        el = (bal * pd_n).sum(axis=1) * lgd
+        n_loans = counts.sum(axis=1)
+        for g, (product, channel) in enumerate(model.segments):
+            if n_loans[g] == 0:
+                continue
+            row = {"product_type": product, "channel": channel, "months_ahead": n, "loans": n_loans[g]}
+            row.update({f"share_{b}": dist[g, k] / n_loans[g] for k, b in enumerate(BUCKETS)})
+            row["cum_default_rate"] = (counts[g] * pd_n[g]).sum() / n_loans[g]
+            row["expected_loss"] = el[g]
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _simulate_task(args) -> np.ndarray:
+    """One (simulation block, loan chunk): new-default loss per (sim, segment)."""
+    cum_P, seg, state0, balance, n_sims, horizon, lgd, seed, G = args
+    rng = np.random.default_rng(seed)
+    state = np.broadcast_to(state0, (n_sims, len(state0))).copy()
+    alive = state != DEFAULT_STATE
+    B = cum_P.shape[1]
+    # one contiguous column per threshold, indexed by segment * B + state
+    thresholds = [np.ascontiguousarray(cum_P[:, :, k].ravel()) for k in range(B - 1)]
+    seg_base = (seg * B)[None, :]
+    for _ in range(horizon):
+        u = rng.random(state.shape)
+        row = seg_base + state
+        nxt = np.zeros(state.shape, dtype=np.int8)
+        for col in thresholds:
+            nxt += u > np.take(col, row)
+        state = nxt
+    defaulted = alive & (state == DEFAULT_STATE)
+    flat = (np.arange(n_sims)[:, None] * G + seg[None, :])[defaulted]
+    w = np.broadcast_to(balance * lgd, state.shape)[defaulted]
+    return np.bincount(flat, weights=w, minlength=n_sims * G).reshape(n_sims, G)
+
+
+def simulate_losses(
+    model: TransitionModel,
+    book: StartBook,
+    horizon: int,
+    n_sims: int,
+    lgd: float = LGD_ASSUMPTION,
+    chunk_size: int = 250_000,
+    sims_per_task: int = 8,
+    workers: int = 1,
+    seed: int = 42,
+) -> np.ndarray:
+    """
+    Monte Carlo loss per (simulation, segment) over `horizon` months.
+
+    Each task holds at most sims_per_task x chunk_size int8 states plus one
+    uniform draw array of the same shape. Seeds are spawned per task, so results
+    are reproducible for a given seed, chunking and block size.
+    """
+    G = len(model.segments)
+    cum_P = np.cumsum(model.P, axis=2)
+    sim_blocks = [min(sims_per_task, n_sims - s) for s in range(0, n_sims, sims_per_task)]
+    chunks = [slice(i, i + chunk_size) for i in range(0, len(book.state), chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sim_blocks) * len(chunks))
+
+    tasks = [
+        (cum_P, book.segment_idx[c], book.state[c], book.balance[c], nb, horizon, lgd, seeds[i], G)
+        for i, (nb, c) in enumerate(itertools.product(sim_blocks, chunks))
+    ]
+    if workers <= 1:
+        results = map(_simulate_task, tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_simulate_task, tasks)
+
+    out = np.zeros((n_sims, G))
+    try:
+        for i, loss in enumerate(results):
+            b = i // len(chunks)
+            start = sum(sim_blocks[:b])
+            out[start:start + sim_blocks[b]] += loss
+    finally:
+        if workers > 1:
+            pool.shutdown()
+    return out
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Project DPD distribution and credit losses over the migration matrix.")
+    parser.add_argument("--as-of", default=None,
+                        help="Start month_end YYYY-MM-DD (default: last fully observed due month at the data cut-off)")
+    parser.add_argument("--horizon", type=int, default=12, help="Months to project (default: 12)")
+    parser.add_argument("--sims", type=int, default=1000, help="Monte Carlo simulations; 0 to skip (default: 1000)")
+    parser.add_argument("--lookback", type=int, default=24, help="Months of migration history to estimate from (default: 24)")
+    parser.add_argument("--lgd", type=float, default=LGD_ASSUMPTION, help=f"Loss given default (default: {LGD_ASSUMPTION})")
+    parser.add_argument("--chunk-size", type=int, default=250_000, help="Loans per Monte Carlo task (default: 250000)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for Monte Carlo tasks (default: 1)")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    parser.add_argument("--output-dir", default=str(DEFAULT_OUTPUT_DIR), help=f"Where to write CSV results (default: {DEFAULT_OUTPUT_DIR})")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    sys.path.append(str(ROOT_DIR / "core" / "python"))
+    from db_engine import get_engine
+
+    engine = get_engine(read_only=True)
+    cutoff = data_cutoff(engine)
+    as_of = str(args.as_of)[:10] if args.as_of else cutoff
+    if as_of > cutoff:
+        print(f"  --as-of {as_of} is past the data cut-off {cutoff}; transitions after {cutoff} are ignored.")
+    model = estimate_transitions(engine, as_of, args.lookback, cutoff)
+    book = load_start_book(engine, model, as_of)
+
+    out_dir = Path(args.output_dir).expanduser().resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    print(f"Start book: {book.month_end}  loans: {len(book.state):,}  segments: {len(model.segments)}")
+
+    proj = project_markov(model, book, args.horizon, args.lgd)
+    proj_path = out_dir / "migration_projection.csv"
+    proj.to_csv(proj_path, index=False)
+    el = proj.loc[proj["months_ahead"] == args.horizon, "expected_loss"].sum()
+    print(f"Markov expected loss at {args.horizon}m: {el:,.2f}")
+    print(f"Saved: {proj_path}")
+
+    if args.sims > 0:
+        losses = simulate_losses(
+            model, book, args.horizon, args.sims, args.lgd,
+            chunk_size=args.chunk_size, workers=args.workers, seed=args.seed,
+        )
+        total = losses.sum(axis=1)
+        summary = pd.DataFrame([{
+            "horizon_months": args.horizon,
+            "sims": args.sims,
+            "mean_loss": total.mean(),
+            "p50_loss": np.percentile(total, 50),
+            "p95_loss": np.percentile(total, 95),
+            "p99_loss": np.percentile(total, 99),
+            "markov_expected_loss": el,
+        }])
+        mc_path = out_dir / "migration_mc_losses.csv"
+        summary.to_csv(mc_path, index=False)
+        print(f"Monte Carlo loss: mean={total.mean():,.2f}  p95={np.percentile(total, 95):,.2f}  p99={np.percentile(total, 99):,.2f}")
+        print(f"Saved: {mc_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,85 @@
+"""
+Preprocessing for the 60+ in 3 months early-warning model.
+
+Keeps the design matrix sparse end-to-end: numeric features are cast to
+float32 and standardised, categorical features are held as pandas
+categoricals and one-hot encoded straight into a float32 CSR matrix.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+# scikit-learn is imported where a pipeline is built, so scoring code that only
+# needs the column lists (risk_scoring.py) starts without it
+if TYPE_CHECKING:
+    from sklearn.compose import ColumnTransformer
+    from sklearn.pipeline import Pipeline
+
+NUM_COLS = [
+    "credit_score",
+    "annual_income_nzd",
+    "roll3_paid_full_rate",
+    "roll3_missed_cnt",
+    "roll3_avg_arrears",
+    "eop_balance",
+    "interest_rate_apr",
+]
+CAT_COLS = ["product_type", "channel", "employment_type", "dpd_bucket"]
+
+# Fixed category sets keep the encoded column layout stable across training
+# windows (and across cached runs), even when a level is absent from a slice.
+CATEGORIES = {
+    "product_type": ["Personal", "Auto", "Mortgage", "SME"],
+    "channel": ["Online", "Broker", "Branch", "Partner"],
+    "employment_type": ["Salaried", "Self-employed", "Contractor", "Student", "Unemployed"],
+    "dpd_bucket": ["DPD_0", "DPD_1_29", "DPD_30_59", "DPD_60_89", "DPD_90_PLUS"],
+}
+
+
+def prepare_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the model columns with float32 numerics and categorical dtypes."""
+    cols = {c: pd.to_numeric(df[c], errors="coerce").astype(np.float32) for c in NUM_COLS}
+    cols.update({c: pd.Categorical(df[c], categories=CATEGORIES[c]) for c in CAT_COLS})
+    return pd.DataFrame(cols, index=df.index)
+
+
+def build_preprocessor() -> ColumnTransformer:
+    """Scale numerics and one-hot encode categoricals into one sparse matrix."""
+    from sklearn.compose import ColumnTransformer
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+    return ColumnTransformer(
+        transformers=[
+            ("num", StandardScaler(), NUM_COLS),
+            (
+                "cat",
+                OneHotEncoder(
+                    categories=[CATEGORIES[c] for c in CAT_COLS],
+                    handle_unknown="ignore",
+                    dtype=np.float32,
+                ),
+                CAT_COLS,
+            ),
+        ],
+        # Always emit CSR: the numeric block is only len(NUM_COLS) wide, so the
+        # stacked matrix stays overwhelmingly sparse.
+        sparse_threshold=1.0,
+    )
+
+
+def build_pipeline(memory: str | None = None) -> Pipeline:
+    """
+    Build the preprocessing + logistic regression pipeline.
+
+    When `memory` is a directory, the fitted preprocessor is cached there
+    (joblib) and reused on later runs over the same training data.
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+
+    model = LogisticRegression(max_iter=300, class_weight="balanced")
+    return Pipeline(steps=[("pre", build_preprocessor()), ("model", model)], memory=memory)
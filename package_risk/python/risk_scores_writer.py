@@ -0,0 +1,157 @@
+"""
+Bulk writer for the risk_scores table.
+
+Scores are upserted on (loan_id, month_end) in chunks inside a single
+transaction, and rows of the scored months whose loan is not in the new batch
+are deleted in the same transaction with an anti-join against a temporary
+table of the batch's keys. The table and its composite unique index are
+created once and kept across runs, so the risk_watchlist join stays indexed.
+"""
+
+from __future__ import annotations
+
+import pandas as pd
+from sqlalchemy import (Column, Float, Index, Integer, MetaData, String, Table, and_, delete, exists, func, insert,
+                        inspect, select, tuple_)
+
+SCORE_COLS = ["loan_id", "month_end", "risk_score", "will_be_60p_in_3m"]
+# (loan_id, month_end) keys per DELETE when de-duplicating a legacy table, under SQLite's variable limit
+DELETE_CHUNK = 500
+
+metadata = MetaData()
+
+risk_scores = Table(
+    "risk_scores",
+    metadata,
+    Column("loan_id", Integer, nullable=False),
+    Column("month_end", String(10), nullable=False),  # ISO date string YYYY-MM-DD
+    Column("risk_score", Float),
+    Column("will_be_60p_in_3m", Integer),
+)
+
+# Composite key used by the upsert and by risk_watchlist's (loan_id, month_end) join.
+ux_risk_scores = Index("ux_risk_scores_loan_month", risk_scores.c.loan_id, risk_scores.c.month_end, unique=True)
+
+# Keys of the batch being written, for the stale-row anti-join (per connection, dropped after use).
+score_keys = Table(
+    "risk_scores_batch_keys",
+    MetaData(),
+    Column("loan_id", Integer, primary_key=True),
+    Column("month_end", String(10), primary_key=True),
+    prefixes=["TEMPORARY"],
+)
+
+
+def _drop_duplicate_keys(conn) -> int:
+    """Keep one row per (loan_id, month_end), the last one read; returns the number of rows removed."""
+    dup = (select(risk_scores.c.loan_id, risk_scores.c.month_end)
+           .group_by(risk_scores.c.loan_id, risk_scores.c.month_end)
+           .having(func.count() > 1)
+           .subquery())
+    rows = pd.DataFrame(conn.execute(
+        select(risk_scores).join(dup, and_(risk_scores.c.loan_id == dup.c.loan_id,
+                                           risk_scores.c.month_end == dup.c.month_end))
+    ).fetchall(), columns=SCORE_COLS)
+    if rows.empty:
+        return 0
+    keep = rows.drop_duplicates(["loan_id", "month_end"], keep="last")
+    for start in range(0, len(keep), DELETE_CHUNK):
+        part = keep.iloc[start:start + DELETE_CHUNK]
+        keys = list(zip(part["loan_id"].tolist(), part["month_end"].tolist()))
+        conn.execute(delete(risk_scores).where(tuple_(risk_scores.c.loan_id, risk_scores.c.month_end).in_(keys)))
+    conn.execute(insert(risk_scores), keep.to_dict(orient="records"))
+    return len(rows) - len(keep)
+
+
+def ensure_risk_scores_table(engine) -> None:
+    """
+    Create risk_scores and its unique index if missing. A legacy unindexed
+    table is de-duplicated on (loan_id, month_end) before the index is added.
+    """
+    metadata.create_all(engine, tables=[risk_scores], checkfirst=True)
+    existing = {ix["name"] for ix in inspect(engine).get_indexes("risk_scores")}
+    if ux_risk_scores.name not in existing:
+        with engine.begin() as conn:
+            removed = _drop_duplicate_keys(conn)
+            if removed:
+                print(f"risk_scores: removed {removed:,} duplicate (loan_id, month_end) rows before indexing")
+            ux_risk_scores.create(conn)
+
+
+def _upsert_stmt(dialect: str):
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+
+        stmt = dialect_insert(risk_scores)
+        return stmt.on_duplicate_key_update(
+            risk_score=stmt.inserted.risk_score,
+            will_be_60p_in_3m=stmt.inserted.will_be_60p_in_3m,
+        )
+    else:
+        return None
+
+    stmt = dialect_insert(risk_scores)
+    return stmt.on_conflict_do_update(
+        index_elements=["loan_id", "month_end"],
+        set_={
+            "risk_score": stmt.excluded.risk_score,
+            "will_be_60p_in_3m": stmt.excluded.will_be_60p_in_3m,
+        },
+    )
+
+
+def _records(df: pd.DataFrame) -> list[dict]:
+    out = df[SCORE_COLS].copy()
+    out["loan_id"] = out["loan_id"].astype("int64")
+    out["month_end"] = out["month_end"].astype(str).str[:10]
+    out["risk_score"] = out["risk_score"].astype(float)
+    out["will_be_60p_in_3m"] = out["will_be_60p_in_3m"].astype("int64")
+    return out.to_dict(orient="records")
+
+
+def _delete_stale(conn, scores: pd.DataFrame, chunksize: int = 5000) -> int:
+    """Delete rows of each month_end in `scores` whose loan_id is not scored for that month."""
+    keys = pd.DataFrame({"loan_id": scores["loan_id"].astype("int64"),
+                         "month_end": scores["month_end"].astype(str).str[:10]}).drop_duplicates()
+    score_keys.create(conn)
+    try:
+        for start in range(0, len(keys), chunksize):
+            conn.execute(insert(score_keys), keys.iloc[start:start + chunksize].to_dict(orient="records"))
+        scored = exists().where(score_keys.c.loan_id == risk_scores.c.loan_id,
+                                score_keys.c.month_end == risk_scores.c.month_end)
+        result = conn.execute(delete(risk_scores).where(
+            risk_scores.c.month_end.in_(select(score_keys.c.month_end).distinct()), ~scored))
+    finally:
+        score_keys.drop(conn)
+    return result.rowcount
+
+
+def write_risk_scores(engine, scores: pd.DataFrame, chunksize: int = 5000) -> int:
+    """
+    Upsert scores on (loan_id, month_end) in chunks of `chunksize` rows, and
+    delete rows of the scored months for loans that are no longer scored.
+
+    Uses the dialect's native upsert (SQLite/PostgreSQL ON CONFLICT, MySQL
+    ON DUPLICATE KEY); other backends delete the chunk's keys then insert.
+    Returns the number of rows written.
+    """
+    ensure_risk_scores_table(engine)
+    stmt = _upsert_stmt(engine.dialect.name)
+
+    n = 0
+    with engine.begin() as conn:
+        for start in range(0, len(scores), chunksize):
+            rows = _records(scores.iloc[start:start + chunksize])
+            if stmt is not None:
+                conn.execute(stmt, rows)
+            else:
+                keys = [(r["loan_id"], r["month_end"]) for r in rows]
+                conn.execute(delete(risk_scores).where(tuple_(risk_scores.c.loan_id, risk_scores.c.month_end).in_(keys)))
+                conn.execute(insert(risk_scores), rows)
+            n += len(rows)
+        _delete_stale(conn, scores, chunksize)
+    return n
@@ -0,0 +1,208 @@
+"""
+On-demand scoring of single loans or small batches.
+
+Typical usage (e.g. when a collections agent opens an account):
+
+    scorer = RiskScorer.from_env()
+    scorer.score(100123, "2025-12-31")
+    scorer.score_batch([(100123, "2025-12-31"), (100456, "2025-12-31")])
+
+Features are read from `risk_features_store`, a table keyed and uniquely
+indexed on (loan_id, month_end) that train_risk_model.py refreshes from
+risk_features_3m. Each lookup is an index seek instead of an evaluation of
+the risk_features_3m view chain. The fitted pipeline is loaded once and kept
+in memory.
+
+save_model() also writes the pipeline folded into linear weights
+(<model>.linear.json). When that file is current, RiskScorer scores from it
+and never imports scikit-learn or joblib, which keeps short scoring jobs
+quick to start; the full pipeline is loaded only if `scorer.pipe` is used.
+"""
+
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+from typing import Iterable, Sequence
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import MetaData, Table, select, text, tuple_
+
+from risk_preprocessing import CAT_COLS, NUM_COLS
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_MODEL_PATH = ROOT_DIR / "package_risk" / "models" / "risk_model_60p_3m.joblib"
+
+FEATURE_STORE = "risk_features_store"
+
+# Keys per SELECT for batch lookups; two bound parameters per key keeps each
+# statement well under SQLite's variable limit.
+LOOKUP_CHUNK = 500
+
+
+def linear_path(model_path: Path | str) -> Path:
+    model_path = Path(model_path)
+    return model_path.with_name(model_path.stem + ".linear.json")
+
+
+def save_model(pipe, path: Path | str = DEFAULT_MODEL_PATH) -> Path:
+    import joblib
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(pipe, path)
+    LinearScorer.from_pipeline(pipe).save(linear_path(path))
+    return path
+
+
+def load_pipeline(path: Path | str = DEFAULT_MODEL_PATH):
+    import joblib
+
+    return joblib.load(path)
+
+
+def write_feature_store(engine, feat: pd.DataFrame, chunksize: int = 10_000) -> int:
+    """Refresh risk_features_store from a risk_features_3m frame and index it on (loan_id, month_end)."""
+    # plain executemany (as load_data.py): one bound row per execution, so no variable limit
+    feat.to_sql(FEATURE_STORE, engine, if_exists="replace", index=False, chunksize=chunksize)
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE UNIQUE INDEX ux_{FEATURE_STORE}_loan_month ON {FEATURE_STORE} (loan_id, month_end)"))
+    return len(feat)
+
+
+class LinearScorer:
+    """
+    The fitted scaler + one-hot + logistic regression folded into plain arrays.
+
+    For a handful of rows, sklearn's per-call validation and ColumnTransformer
+    dispatch cost far more than the arithmetic; this evaluates the same linear
+    model directly (numerically equal to pipe.predict_proba up to float32
+    rounding of the inputs).
+    """
+
+    def __init__(self, w_num: np.ndarray, intercept: float, w_cat: dict[str, dict[str, float]]):
+        self.w_num = np.asarray(w_num, dtype=np.float64)
+        self.intercept = float(intercept)
+        self.w_cat = w_cat
+
+    @classmethod
+    def from_pipeline(cls, pipe) -> "LinearScorer":
+        pre = pipe.named_steps["pre"]
+        model = pipe.named_steps["model"]
+        scaler = pre.named_transformers_["num"]
+        encoder = pre.named_transformers_["cat"]
+        coef = model.coef_.ravel().astype(np.float64)
+
+        n_num = len(NUM_COLS)
+        # fold standardisation into the weights: w * (x - mu) / sd
+        w_num = coef[:n_num] / scaler.scale_
+        intercept = float(model.intercept_[0] - np.dot(w_num, scaler.mean_))
+
+        w_cat = {}
+        pos = n_num
+        for col, cats in zip(CAT_COLS, encoder.categories_):
+            w_cat[col] = {str(c): float(w) for c, w in zip(cats, coef[pos:pos + len(cats)])}
+            pos += len(cats)
+        return cls(w_num, intercept, w_cat)
+
+    def save(self, path: Path | str) -> Path:
+        path = Path(path)
+        path.write_text(json.dumps({
+            "num_cols": NUM_COLS,
+            "w_num": self.w_num.tolist(),
+            "intercept": self.intercept,
+            "w_cat": self.w_cat,
+        }, indent=2), encoding="utf-8")
+        return path
+
+    @classmethod
+    def load(cls, path: Path | str) -> "LinearScorer":
+        d = json.loads(Path(path).read_text(encoding="utf-8"))
+        if d["num_cols"] != NUM_COLS or set(d["w_cat"]) != set(CAT_COLS):
+            raise ValueError(f"{path} was written for different feature columns; retrain the model")
+        return cls(d["w_num"], d["intercept"], d["w_cat"])
+
+    def predict(self, feat: pd.DataFrame) -> np.ndarray:
+        x = feat[NUM_COLS].to_numpy(dtype=np.float32).astype(np.float64)
+        z = x @ self.w_num + self.intercept
+        for col, weights in self.w_cat.items():
+            # unknown levels contribute 0, as with handle_unknown="ignore"
+            z += feat[col].map(weights).fillna(0.0).to_numpy(dtype=np.float64)
+        return 1.0 / (1.0 + np.exp(-z))
+
+
+class RiskScorer:
+    """Scores loan-months with a persisted pipeline and indexed feature lookups."""
+
+    def __init__(self, engine, model_path: Path | str = DEFAULT_MODEL_PATH):
+        model_path = Path(model_path)
+        if not model_path.exists():
+            raise FileNotFoundError(
+                f"Model not found: {model_path}. Run package_risk/python/train_risk_model.py first."
+            )
+        self.engine = engine
+        self.model_path = model_path
+        self._pipe = None
+        weights = linear_path(model_path)
+        if weights.exists() and weights.stat().st_mtime >= model_path.stat().st_mtime:
+            self.linear = LinearScorer.load(weights)
+        else:  # model saved before the weights file existed
+            self.linear = LinearScorer.from_pipeline(self.pipe)
+        self._table = Table(FEATURE_STORE, MetaData(), autoload_with=engine)
+
+    @property
+    def pipe(self):
+        """The full fitted sklearn pipeline (loaded on first use)."""
+        if self._pipe is None:
+            self._pipe = load_pipeline(self.model_path)
+        return self._pipe
+
+    @classmethod
+    def from_env(cls, model_path: Path | str = DEFAULT_MODEL_PATH) -> "RiskScorer":
+        sys.path.append(str(ROOT_DIR / "core" / "python"))
+        from db_engine import get_engine
+
+        return cls(get_engine(read_only=True), model_path)
+
+    def fetch_features(self, keys: Sequence[tuple[int, str]]) -> pd.DataFrame:
+        """Fetch feature rows for (loan_id, month_end) keys via the store's unique index."""
+        t = self._table
+        parts = []
+        with self.engine.connect() as conn:
+            for start in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = [(int(k[0]), str(k[1])[:10]) for k in keys[start:start + LOOKUP_CHUNK]]
+                if len(chunk) == 1:
+                    cond = (t.c.loan_id == chunk[0][0]) & (t.c.month_end == chunk[0][1])
+                else:
+                    cond = tuple_(t.c.loan_id, t.c.month_end).in_(chunk)
+                parts.append(pd.DataFrame(conn.execute(select(t).where(cond)).mappings().all()))
+        parts = [p for p in parts if not p.empty]
+        if not parts:
+            return pd.DataFrame(columns=["loan_id", "month_end"])
+        return pd.concat(parts, ignore_index=True)
+
+    def predict(self, feat: pd.DataFrame) -> pd.Series:
+        return pd.Series(self.linear.predict(feat), index=feat.index)
+
+    def score_batch(self, keys: Iterable[tuple[int, str]]) -> pd.DataFrame:
+        """
+        Score (loan_id, month_end) pairs. Returns loan_id, month_end, risk_score;
+        keys with no feature row (or not enough history) are omitted.
+        """
+        feat = self.fetch_features(list(keys))
+        if feat.empty:
+            return pd.DataFrame(columns=["loan_id", "month_end", "risk_score"])
+        # Same rule as training: rolling features need 3 months of history.
+        feat = feat.dropna(subset=["roll3_paid_full_rate", "roll3_avg_arrears"])
+        out = feat[["loan_id", "month_end"]].copy()
+        out["risk_score"] = self.predict(feat) if len(feat) else []
+        return out.reset_index(drop=True)
+
+    def score(self, loan_id: int, month_end: str) -> float | None:
+        """Score one loan-month; None when no features are available for it."""
+        out = self.score_batch([(loan_id, month_end)])
+        if out.empty:
+            return None
+        return float(out["risk_score"].iloc[0])
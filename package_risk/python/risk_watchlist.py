@@ -0,0 +1,118 @@
+"""
+Precomputed top-K collections watchlist per month_end x product_type x channel.
+
+risk_watchlist_topk holds, for each segment and month, the K loans with the
+highest risk_score (ties broken by eop_balance) together with their
+balance-weighted exposure (eop_balance x risk_score). Collections queues read
+it by (month_end, product_type, channel, segment_rank) instead of sorting
+the whole scored portfolio.
+
+train_risk_model.py refreshes the months it has just scored; to rebuild by
+hand (from repo root):
+  python package_risk/python/risk_watchlist.py --top-k 50
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Iterable
+
+from sqlalchemy import bindparam, text
+
+ROOT_DIR = Path(__file__).resolve().parents[2]
+
+WATCHLIST_TABLE = "risk_watchlist_topk"
+DEFAULT_TOP_K = 50
+
+DDL = f"""
+CREATE TABLE IF NOT EXISTS {WATCHLIST_TABLE} (
+  month_end          VARCHAR(10) NOT NULL,
+  product_type       VARCHAR(32) NOT NULL,
+  channel            VARCHAR(32) NOT NULL,
+  segment_rank       INTEGER NOT NULL,
+  loan_id            INTEGER NOT NULL,
+  dpd_bucket         VARCHAR(16),
+  eop_balance        REAL,
+  risk_score         REAL,
+  exposure_weighted  REAL,
+  PRIMARY KEY (month_end, product_type, channel, segment_rank)
+)
+"""
+
+# Ranked in a derived table so the filter on segment_rank stays portable
+# (no QUALIFY); SQLite >= 3.25, MySQL 8, SQL Server and PostgreSQL all run it.
+INSERT_TOPK = f"""
+INSERT INTO {WATCHLIST_TABLE}
+  (month_end, product_type, channel, segment_rank, loan_id, dpd_bucket, eop_balance, risk_score, exposure_weighted)
+SELECT month_end, product_type, channel, segment_rank, loan_id, dpd_bucket, eop_balance, risk_score, exposure_weighted
+FROM (
+  SELECT
+    s.month_end,
+    s.product_type,
+    s.channel,
+    ROW_NUMBER() OVER (
+      PARTITION BY s.month_end, s.product_type, s.channel
+      ORDER BY r.risk_score DESC, s.eop_balance DESC, s.loan_id
+    ) AS segment_rank,
+    s.loan_id,
+    s.dpd_bucket,
+    s.eop_balance,
+    r.risk_score,
+    ROUND(COALESCE(s.eop_balance, 0) * r.risk_score, 2) AS exposure_weighted
+  FROM risk_scores r
+  JOIN mart_portfolio_snapshot_v2 s
+    ON s.loan_id = r.loan_id AND s.month_end = r.month_end
+  {{where}}
+) ranked
+WHERE segment_rank <= :k
+"""
+
+
+def refresh_watchlist_topk(engine, month_ends: Iterable[str] | None = None, k: int = DEFAULT_TOP_K) -> int:
+    """
+    Rebuild the top-K rows for the given month_ends (all scored months when None).
+
+    Runs in one transaction: the affected months are deleted and re-ranked from
+    risk_scores, so readers see either the old or the new queue. Returns the
+    number of watchlist rows written.
+    """
+    with engine.begin() as conn:
+        conn.execute(text(DDL))
+        if month_ends is None:
+            conn.execute(text(f"DELETE FROM {WATCHLIST_TABLE}"))
+            res = conn.execute(text(INSERT_TOPK.format(where="")), {"k": k})
+            return res.rowcount
+
+        months = sorted({str(m)[:10] for m in month_ends})
+        if not months:
+            return 0
+        delete_q = text(f"DELETE FROM {WATCHLIST_TABLE} WHERE month_end IN :months").bindparams(
+            bindparam("months", expanding=True)
+        )
+        insert_q = text(INSERT_TOPK.format(where="WHERE r.month_end IN :months")).bindparams(
+            bindparam("months", expanding=True)
+        )
+        conn.execute(delete_q, {"months": months})
+        res = conn.execute(insert_q, {"months": months, "k": k})
+        return res.rowcount
+
+
+def main(argv: Iterable[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild the per-segment top-K risk watchlist table.")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help=f"Loans kept per segment and month (default: {DEFAULT_TOP_K})")
+    parser.add_argument("--month-end", action="append", help="Only refresh this month_end (repeatable); default: all")
+    args = parser.parse_args(list(argv) if argv is not None else None)
+
+    sys.path.append(str(ROOT_DIR / "core" / "python"))
+    from db_engine import get_engine
+
+    engine = get_engine()
+    n = refresh_watchlist_topk(engine, args.month_end, k=args.top_k)
+    print(f"Saved {WATCHLIST_TABLE}: {n:,}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
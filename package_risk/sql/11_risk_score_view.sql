@@ -2,6 +2,7 @@
 DROP VIEW IF EXISTS risk_watchlist;
 
 -- Output table created by train_risk_model.py: loan_analytics.risk_scores
+-- (upserted on loan_id, month_end; unique index ux_risk_scores_loan_month serves the join below)
 -- Create a watchlist view for Power BI
 CREATE VIEW risk_watchlist AS
 SELECT